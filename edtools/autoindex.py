@@ -1,13 +1,18 @@
-from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
 import threading
 import socket
 import sys, os
+import time
 from pathlib import Path
 from .utils import parse_args_for_fns
 
-import subprocess as sp
-
 from .extract_xds_info import xds_parser
+from .xds_inp import XDSInput
+from .watch import DatasetWatcher, expected_frames
+from .resources import CoreAllocator
+from .runlog import RunLog, step_timings
+from . import runner
+from .scheduler import PriorityScheduler, CellConsensus, dataset_priority
 
 try:
     from instamatic import config
@@ -17,17 +22,19 @@ try:
 except ImportError:
     HOST, PORT = None, None
 
-DEVNULL = open(os.devnull, 'w')
-platform = sys.platform
-
-if platform == "win32":
-    from .wsl import bash_exe
-
 
 XDSJOBS = ("XYCORR", "INIT", "COLSPOT", "IDXREF", "DEFPIX", "INTEGRATE", "CORRECT")
+TRIAGE_JOBS = XDSJOBS[:4]
+INTEGRATION_JOBS = XDSJOBS[4:]
 
 rlock = threading.RLock()
 
+# `RunLog` to record the timing of every XDS run, set by `main`
+runlog = None
+
+# exit status of all external program runs
+results = []
+
 
 def clear_files(path: str) -> None:
     """Clear  LP files"""
@@ -115,7 +122,24 @@ def parse_xds(path: str, sequence: int=0) -> None:
 
 
 
-def xds_index(path: str, sequence: int=0, clear: bool=True, parallel: bool=True) -> None:
+@contextmanager
+def limit_cores(path: str, cores: int):
+    """Temporarily set the number of cores XDS may use in XDS.INP in `path`.
+    XDS distributes them over a single job (MAXIMUM_NUMBER_OF_JOBS=1). The
+    original XDS.INP is restored afterwards."""
+    fn = Path(path) / "XDS.INP"
+    inp = XDSInput.read(fn)
+    original = str(inp)
+    inp.update({"MAXIMUM_NUMBER_OF_JOBS": "1", "MAXIMUM_NUMBER_OF_PROCESSORS": f"{cores:d}"})
+    inp.write(fn)
+    try:
+        yield
+    finally:
+        XDSInput.from_string(original).write(fn)
+
+
+def xds_index(path: str, sequence: int=0, clear: bool=True, parallel: bool=True, 
+              cores: int=None, cpus: list=None):
     """Run XDS at given path.
     
     Parameters
@@ -128,32 +152,226 @@ def xds_index(path: str, sequence: int=0, clear: bool=True, parallel: bool=True)
         Clear some LP files before running XDS
     parallel : bool
         Call `xds_par` rather than `xds`
+    cores : int
+        Limit XDS to this many cores (sets MAXIMUM_NUMBER_OF_PROCESSORS 
+        in XDS.INP for this run and OMP_NUM_THREADS)
+    cpus : list
+        Pin XDS to these CPUs (Linux only)
+
+    Returns the `runner.RunResult`
     """
     if clear:
         clear_files(path)
 
     cmd = "xds_par" if parallel else "xds"
 
-    cwd = str(path)
+    env = None
+    limits = nullcontext()
+    if cores:
+        limits = limit_cores(path, cores)
+        env = dict(os.environ, OMP_NUM_THREADS=str(cores))
 
-    if platform == "win32":
-        try:
-            p = sp.Popen(f"{bash_exe} -ic {cmd} 2>&1 >/dev/null", cwd=cwd)
-            p.wait()
-        except Exception as e:
-            print("ERROR in subprocess call:", e)
-    else:
+    started = time.time()
+
+    with limits:
+        result = runner.run(cmd, cwd=path, env=env, cpus=cpus)
+    results.append(result)
+    if result.error:
+        print("ERROR in subprocess call:", result.error)
+    elif result.timed_out:
+        with rlock:
+            print(f"{sequence: 4d}: {path} -> XDS timed out")
+
+    if runlog is not None:
         try:
-            p = sp.Popen(cmd, cwd=cwd, stdout=DEVNULL)
-            p.wait()
-        except Exception as e:
-            print("ERROR in subprocess call:", e)
+            job = XDSInput.read(Path(path) / "XDS.INP").get("JOB")
+        except OSError:
+            job = None
+        # `result.stats` holds the returncode too, unless the program did not start
+        stats = dict(result.stats, returncode=result.returncode)
+        runlog.record(directory=str(path), sequence=sequence, job=job, cores=cores,
+                      steps=step_timings(path, since=started - 1), timed_out=result.timed_out,
+                      attempts=result.attempts, **stats)
 
     try:
         parse_xds(path, sequence=sequence)
     except Exception as e:
         print("ERROR:", e)
 
+    return result
+
+
+def parse_idxref(path: str) -> dict:
+    """Parse IDXREF.LP in `path`.
+
+    Returns a dict with the `cell`, `spgr`, and the number of `indexed` and
+    total `spots` if indexing succeeded, otherwise None.
+    """
+    fn = Path(path) / "IDXREF.LP"
+    if not fn.exists():
+        return None
+
+    d = {}
+    with open(fn, "r", errors="replace") as f:
+        for line in f:
+            if "!!! ERROR" in line:
+                return None
+            elif line.startswith(" UNIT CELL PARAMETERS"):
+                d["cell"] = list(map(float, line.split()[3:9]))
+            elif line.startswith(" SPACE GROUP NUMBER"):
+                d["spgr"] = int(line.split()[-1])
+            elif line.rstrip().endswith("SPOTS INDEXED."):
+                inp = line.split()
+                d["indexed"], d["spots"] = int(inp[0]), int(inp[3])
+
+    return d if "cell" in d else None
+
+
+def xds_run_jobs(path: str, jobs: tuple, sequence: int=0, clear: bool=True, edits: dict=None, **kwargs) -> None:
+    """Run XDS at given path with `JOB=` temporarily set to `jobs`. Other
+    keywords in `edits` are written to XDS.INP permanently. The original
+    JOB line is restored afterwards."""
+    fn = Path(path) / "XDS.INP"
+
+    inp = XDSInput.read(fn)
+    original = [line.text for line in inp.lines if "JOB" in line.keywords]
+    if edits:
+        inp.update(edits)
+    inp.delete(["JOB"])
+    inp.insert(0, "JOB= " + " ".join(jobs))
+    inp.write(fn)
+
+    try:
+        xds_index(path, sequence=sequence, clear=clear, **kwargs)
+    finally:
+        inp = XDSInput.read(fn)
+        inp.delete(["JOB"])
+        for line in reversed(original):
+            inp.insert(0, line)
+        inp.write(fn)
+
+
+def triage(jobs: list, max_workers: int=1, allocator=None) -> dict:
+    """Run the cheap steps (XYCORR INIT COLSPOT IDXREF) for all data sets in
+    `jobs` (list of (sequence, directory)) in parallel.
+
+    Returns a dict directory -> IDXREF results for the data sets that indexed.
+    """
+    print(f"Triage: running {' '.join(TRIAGE_JOBS)} for {len(jobs)} data sets")
+
+    with PriorityScheduler(max_workers=max_workers) as scheduler:
+        for i, drc in jobs:
+            scheduler.submit(allocated(xds_run_jobs, allocator), drc, TRIAGE_JOBS, i)
+
+    results = {}
+    for i, drc in jobs:
+        d = parse_idxref(drc)
+        if d:
+            results[drc] = d
+
+    print(f"Triage: {len(results)}/{len(jobs)} data sets indexed")
+    return results
+
+
+def allocated(func, allocator=None):
+    """Wrap `func(path, ...)` so that every call waits for a core budget from
+    `allocator` (`CoreAllocator`), and passes it on as `cores`/`cpus`."""
+    if allocator is None:
+        return func
+
+    def wrapper(path, *args, **kwargs):
+        n_frames = len(expected_frames(Path(path) / "XDS.INP"))
+        with allocator.job(n_frames=n_frames) as (cores, cpus):
+            return func(path, *args, cores=cores, cpus=cpus, **kwargs)
+
+    return wrapper
+
+
+def consensus_edits(results: dict, rel_tol: float=0.02, angle_tol: float=2.0) -> dict:
+    """Find the largest group of consistent cells in the triage `results`.
+
+    Returns a dict directory -> XDS.INP edits (UNIT_CELL_CONSTANTS and
+    SPACE_GROUP_NUMBER, the mean cell and most common space group of the
+    group) for the data sets in the group.
+    """
+    consensus = CellConsensus(n_target=len(results) + 1, rel_tol=rel_tol, angle_tol=angle_tol)
+    for d in results.values():
+        consensus.add(d["cell"])
+
+    group = consensus.best()
+    if not group:
+        return {}
+
+    reference = group[0]
+    members = [drc for drc, d in results.items() if consensus.consistent(reference, d["cell"])]
+
+    n = len(group)
+    cell = [sum(vals) / n for vals in zip(*group)]
+    spgrs = [results[drc]["spgr"] for drc in members if "spgr" in results[drc]]
+    spgr = max(set(spgrs), key=spgrs.count) if spgrs else None
+
+    edits = {"UNIT_CELL_CONSTANTS": " ".join(f"{val:.3f}" for val in cell)}
+    if spgr:
+        edits["SPACE_GROUP_NUMBER"] = f"{spgr}"
+
+    print(f"Consensus cell from {len(members)} data sets: {edits['UNIT_CELL_CONSTANTS']} (space group: {spgr})")
+    return {drc: edits for drc in members}
+
+
+def xdsconv(path: str) -> None:
+    """Convert XDS_ASCII.HKL in `path` to a SHELX hkl file using XDSCONV."""
+    drc = Path(path)
+
+    with open(drc / "XDSCONV.INP", "w") as f:
+        print("""
+INPUT_FILE= XDS_ASCII.HKL
+OUTPUT_FILE= shelx.hkl  SHELX    ! Warning: do _not_ name this file "temp.mtz" !
+FRIEDEL'S_LAW= FALSE             ! default is FRIEDEL'S_LAW=TRUE""", file=f)
+
+    results.append(runner.run("xdsconv", cwd=drc, retries=0))
+
+
+def xds_index_and_convert(path: str, sequence: int=0, **kwargs) -> None:
+    """Run XDS and XDSCONV at given path, used in watch mode."""
+    xds_index(path, sequence=sequence, **kwargs)
+    if (Path(path) / "XDS_ASCII.HKL").exists():
+        xdsconv(path)
+
+
+def indexed_cell(path: str) -> list:
+    """Return the unit cell from CORRECT.LP in `path`, or None if XDS did
+    not finish successfully."""
+    correct_lp = Path(path) / "CORRECT.LP"
+    if not correct_lp.exists():
+        return None
+    try:
+        d = xds_parser(correct_lp).d
+    except Exception:
+        return None
+    return d["cell"] if d else None
+
+
+def watch(root: str, executor, use_server: bool=False, match: str=None, 
+          interval: float=5.0, settle: float=10.0, seen=(), priority: bool=False,
+          allocator=None) -> None:
+    """Watch `root` for new data sets, and submit every data set to
+    `executor` as soon as its XDS.INP and all frames are complete."""
+    counter = iter(range(len(seen), sys.maxsize))
+
+    def submit(fn):
+        drc = fn.parent
+        i = next(counter)
+        with rlock:
+            print(f"{i: 4d}: {drc} -> New data set, queued")
+        kwargs = {"priority": dataset_priority(drc)} if priority else {}
+        if use_server:
+            executor.submit(connect, drc, **kwargs)
+        else:
+            executor.submit(allocated(xds_index_and_convert, allocator), drc, i, **kwargs)
+
+    watcher = DatasetWatcher(root, callback=submit, match=match, 
+                             interval=interval, settle=settle, seen=seen)
+    watcher.run()
 
 
 def main():
@@ -185,10 +403,81 @@ def main():
                         action="store", type=int, dest="n_jobs",
                         help="Number of jobs to run in parallel")
 
+    parser.add_argument("-w", "--watch",
+                        action="store_true", dest="watch",
+                        help="After processing the existing data sets, keep watching the directory for new data sets and process them as soon as they are complete (stop with Ctrl-C)")
+
+    parser.add_argument("--interval",
+                        action="store", type=float, dest="interval",
+                        help="Polling interval in seconds for `--watch` (default: 5)")
+
+    parser.add_argument("--settle",
+                        action="store", type=float, dest="settle",
+                        help="A data set is considered complete when all frames exist and nothing has changed for this many seconds (default: 10)")
+
+    parser.add_argument("-p", "--priority",
+                        action="store_true", dest="priority",
+                        help="Process the most promising data sets first, ranked by the ISa of a previous run, the number of spots in SPOT.XDS, and the number of frames")
+
+    parser.add_argument("--stop-after",
+                        action="store", type=int, dest="stop_after",
+                        help="Stop processing once this many data sets with consistent unit cells have been found")
+
+    parser.add_argument("-t", "--triage",
+                        action="store_true", dest="triage",
+                        help="Run XYCORR INIT COLSPOT IDXREF for all data sets first, and DEFPIX INTEGRATE CORRECT only for the data sets that indexed")
+
+    parser.add_argument("--consensus",
+                        action="store_true", dest="consensus",
+                        help="With `--triage`, integrate only the data sets with the most common unit cell, using the mean cell and most common space group")
+
+    parser.add_argument("--cores",
+                        action="store", type=int, dest="cores",
+                        help="Total number of cores to divide over the concurrent XDS jobs (default: all available cores)")
+
+    parser.add_argument("--affinity",
+                        action="store_true", dest="affinity",
+                        help="Pin every XDS job to its own set of cores (Linux only)")
+
+    parser.add_argument("--mem-per-job",
+                        action="store", type=float, dest="mem_per_job",
+                        help="Memory in GB needed per XDS job, limits the number of concurrent jobs to the available memory")
+
+    parser.add_argument("--adaptive",
+                        action="store_true", dest="adaptive",
+                        help="Adapt the number of concurrent jobs (up to `--jobs`) to the measured throughput")
+
+    parser.add_argument("--log",
+                        action="store", type=str, nargs="?", const="autoindex_log.jsonl", dest="log",
+                        help="Record the wall time, cpu time and memory of every XDS run and step in this file (JSON lines), "
+                        "and print a summary at the end (default: autoindex_log.jsonl)")
+
+    parser.add_argument("--timeout",
+                        action="store", type=float, dest="timeout",
+                        help="Stop XDS if a run takes longer than this many seconds (default: no timeout)")
+
+    parser.add_argument("--retries",
+                        action="store", type=int, dest="retries",
+                        help="Number of times to run XDS again if it fails or times out (default: 0)")
+
     parser.set_defaults(use_server=False,
                         match=None,
                         unprocessed_only=False,
                         n_jobs=1,
+                        watch=False,
+                        interval=5.0,
+                        settle=10.0,
+                        priority=False,
+                        stop_after=None,
+                        triage=False,
+                        consensus=False,
+                        cores=None,
+                        affinity=False,
+                        mem_per_job=None,
+                        adaptive=False,
+                        log=None,
+                        timeout=None,
+                        retries=0,
                         )
     
     options = parser.parse_args()
@@ -199,42 +488,113 @@ def main():
     n_jobs = options.n_jobs
     args = options.args
 
+    if options.watch and len(args) > 1:
+        parser.error("--watch takes a single directory")
+    if options.triage and use_server:
+        parser.error("--triage cannot be used with --server")
+
     fns = parse_args_for_fns(args, name="XDS.INP", match=match)
+    found = list(fns)
 
     if unprocessed_only:
         fns = [fn for fn in fns if not fn.with_name("XYCORR.LP").exists()]
         print(f"Filtered directories which have already been processed, {len(fns)} left")
 
-    max_connections = 1
+    max_connections = 1 if use_server else n_jobs
 
-    with ThreadPoolExecutor(max_workers=max_connections) as executor:
-        futures = []
+    runner.TIMEOUTS["xds"] = runner.TIMEOUTS["xds_par"] = options.timeout
+    runner.RETRIES = options.retries
 
-        for i, fn in enumerate(fns):
-            drc = fn.parent
+    with runner.cancel_on_interrupt():
+        run_all(options, fns, found, max_connections)
 
-            if use_server:
-                f = executor.submit(connect, drc)
-            else:
-                f = executor.submit(xds_index, drc, i)
-            futures.append(f)
- 
-        for future in futures:
-            ret = future.result()
+    runner.report(results)
 
-    for i, fn in enumerate(fns):
-        drc = fn.parent
 
-        with open(drc / "XDSCONV.INP", "w") as f:
-            print(f"""
-INPUT_FILE= XDS_ASCII.HKL
-OUTPUT_FILE= shelx.hkl  SHELX    ! Warning: do _not_ name this file "temp.mtz" !
-FRIEDEL'S_LAW= FALSE             ! default is FRIEDEL'S_LAW=TRUE""", file=f)
-            
-        if platform == "win32":
-            sp.run(f"{bash_exe} -ic xdsconv 2>&1 >/dev/null", cwd=drc)
+def run_all(options, fns: list, found: list, max_connections: int=1) -> None:
+    """Run XDS for the XDS.INP files in `fns` with the options from the
+    command line, see `main`. `found` are all XDS.INP files that existed at
+    the start (for `--watch`)."""
+    use_server = options.use_server
+    n_jobs = options.n_jobs
+
+    global runlog
+    if options.log:
+        runlog = RunLog(options.log)
+
+    allocator = None
+    if not use_server and (n_jobs > 1 or options.cores or options.affinity):
+        allocator = CoreAllocator(max_jobs=n_jobs, 
+                                  total_cores=options.cores, 
+                                  affinity=options.affinity,
+                                  mem_per_job=options.mem_per_job,
+                                  adaptive=options.adaptive)
+        max_connections = allocator.max_jobs
+        print(f"Running up to {allocator.max_jobs} XDS jobs with {allocator.cores_per_job} cores each")
+
+    jobs = list(enumerate(fn.parent for fn in fns))
+    if options.priority:
+        priorities = {drc: dataset_priority(drc) for _, drc in jobs}
+        jobs.sort(key=lambda job: priorities[job[1]], reverse=True)
+    else:
+        priorities = {}
+
+    edits = {}
+    if options.triage:
+        indexed = triage(jobs, max_workers=max_connections, allocator=allocator)
+        if options.consensus:
+            edits = consensus_edits(indexed)
+            jobs = [job for job in jobs if job[1] in edits]
         else:
-            sp.run("xdsconv 2>&1 >/dev/null", cwd=drc, shell=True)
+            jobs = [job for job in jobs if job[1] in indexed]
+
+    consensus = CellConsensus(options.stop_after) if options.stop_after else None
+    processed = []
+
+    with PriorityScheduler(max_workers=max_connections) as scheduler:
+
+        def run(drc, i):
+            if consensus is not None and consensus.reached():
+                return
+            if options.triage:
+                allocated(xds_run_jobs, allocator)(drc, INTEGRATION_JOBS, i, clear=False, edits=edits.get(drc))
+            else:
+                allocated(xds_index, allocator)(drc, i)
+            processed.append(drc)
+            if consensus is None:
+                return
+            cell = indexed_cell(drc)
+            if cell and consensus.add(cell):
+                n_cancelled = scheduler.cancel_pending()
+                with rlock:
+                    print(f"\nFound {consensus.n_target} data sets with consistent unit cells, skipping the remaining {n_cancelled} data sets")
+
+        for i, drc in jobs:
+            priority = priorities.get(drc, 0)
+            if use_server:
+                scheduler.submit(connect, drc, priority=priority)
+                processed.append(drc)
+            else:
+                scheduler.submit(run, drc, i, priority=priority)
+
+    for drc in processed:
+        if (Path(drc) / "XDS_ASCII.HKL").exists():
+            xdsconv(drc)
+
+    if runlog is not None and not options.watch:
+        print()
+        print(runlog.summary())
+
+    if options.watch:
+        root = options.args[0] if options.args else "."
+        with PriorityScheduler(max_workers=max_connections) as scheduler:
+            watch(root, scheduler, use_server=use_server, match=options.match,
+                  interval=options.interval, settle=options.settle, seen=found,
+                  priority=options.priority, allocator=allocator)
+
+        if runlog is not None:
+            print()
+            print(runlog.summary())
 
 
 if __name__ == '__main__':
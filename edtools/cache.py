@@ -0,0 +1,107 @@
+from pathlib import Path
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+
+def cache_dir() -> Path:
+    """Location of the result cache, `$EDTOOLS_CACHE` or the user cache
+    directory (`$XDG_CACHE_HOME/edtools` or `~/.cache/edtools`)."""
+    root = os.environ.get("EDTOOLS_CACHE")
+    if root:
+        return Path(root)
+    xdg = os.environ.get("XDG_CACHE_HOME")
+    return Path(xdg or Path.home() / ".cache") / "edtools"
+
+
+def file_fingerprint(fn, content: bool = False) -> list:
+    """Fingerprint of input file `fn`, the resolved path, size and
+    modification time, or the sha256 of the contents if `content` is True
+    (slower, but independent of the location of the file)."""
+    fn = Path(fn).resolve()
+    if content:
+        h = hashlib.sha256()
+        with open(fn, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+        return [fn.name, h.hexdigest()]
+    stat = fn.stat()
+    return [str(fn), stat.st_size, stat.st_mtime_ns]
+
+
+def cache_key(tool: str, files, keywords: str = "", content: bool = False) -> str:
+    """Key for the result of running `tool` on the input `files` with
+    `keywords`."""
+    payload = {
+        "tool": tool,
+        "files": [file_fingerprint(fn, content=content) for fn in files],
+        "keywords": keywords,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+class ResultCache:
+    """Content-addressed cache for the results of external programs.
+
+    An entry holds the parsed results (anything that can be stored as JSON)
+    and copies of the output files.
+
+    Usage:
+        cache = ResultCache()
+        key = cache_key("xscale", fns, keywords)
+        if cache.restore(key, drc, ["XSCALE.LP"]) is None:
+            ...  # run xscale
+            cache.store(key, d, drc, ["XSCALE.LP"])
+    """
+
+    def __init__(self, root=None, enabled: bool = True):
+        self.root = Path(root) if root else cache_dir()
+        self.enabled = enabled
+
+    def path(self, key: str) -> Path:
+        return self.root / key[:2] / key
+
+    def restore(self, key: str, drc, outputs=()) -> dict:
+        """Copy the cached `outputs` to `drc` and return the cached results,
+        or None on a cache miss."""
+        if not self.enabled:
+            return None
+        entry = self.path(key)
+        try:
+            with open(entry / "result.json", "r") as f:
+                result = json.load(f)
+            for name in outputs:
+                src = entry / "files" / name
+                if src.exists():
+                    shutil.copy2(src, Path(drc) / name)
+        except (OSError, ValueError):
+            return None
+        return result
+
+    def store(self, key: str, result: dict, drc, outputs=()) -> None:
+        """Store `result` and the `outputs` (file names in `drc`)."""
+        if not self.enabled:
+            return
+        entry = self.path(key)
+        if (entry / "result.json").exists():
+            return
+        try:
+            entry.parent.mkdir(parents=True, exist_ok=True)
+            # build the entry in a temporary directory and rename it, so
+            # that concurrent runs never see an incomplete entry
+            tmp = Path(tempfile.mkdtemp(dir=entry.parent, prefix=f".{key}."))
+            (tmp / "files").mkdir()
+            for name in outputs:
+                src = Path(drc) / name
+                if src.exists():
+                    shutil.copy2(src, tmp / "files" / name)
+            with open(tmp / "result.json", "w") as f:
+                json.dump(result, f)
+            try:
+                os.rename(tmp, entry)
+            except OSError:
+                shutil.rmtree(tmp, ignore_errors=True)  # stored by another run
+        except OSError as e:
+            print(f"Could not store result in cache: {e}")
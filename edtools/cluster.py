@@ -2,25 +2,22 @@ from scipy.cluster.hierarchy import linkage, dendrogram, fcluster
 from collections import defaultdict
 from pathlib import Path
 import shutil
-import subprocess as sp
 import numpy as np
 import matplotlib.pyplot as plt
 from types import SimpleNamespace
+from xml.etree import ElementTree
 import sys
+import threading
+from . import runner
+from .cache import ResultCache, cache_key
 
 platform = sys.platform
 
-if platform == "win32":
-    from .wsl import bash_exe
-
 def check_for_pointless():
-    if platform == "win32":
-        # -i to run bash in interactive mode, i.e. .bashrc is loaded
-        p = sp.run(f'{bash_exe} -ic which pointless', stdout=sp.PIPE)  # check if pointless can be run
-    else:
-        p = sp.run("which pointless", stdout=sp.PIPE, shell=True)  # check if pointless can be run
+    # on windows, bash is run in interactive mode, i.e. .bashrc is loaded
+    p = runner.run("which pointless", capture=True, retries=0)  # check if pointless can be run
 
-    if p.stdout:
+    if p.output:
         return True
     else:
         return False
@@ -78,51 +75,138 @@ def parse_xscale_lp(fn):
     return d
 
 
-def run_pointless(filepat, verbose=True, i=0):
-    drc = filepat.parent
-    with open(drc / "pointless.sh", "w") as f:
-        print(f"""pointless {filepat.name} << eof
-SETTING SYMMETRY-BASED
+POINTLESS_KEYWORDS = """SETTING SYMMETRY-BASED
 CHIRALITY NONCHIRAL
 NEIGHBOUR 0.02
 RESOLUTION 10.0 1.0
 SYSTEMATICABSENCES OFF
-XMLOUT pointless.xml
-eof""", file=f)
+XMLOUT {xmlout}
+"""
+
+rlock = threading.RLock()
+
+# results of pointless and XSCALE/XDSCONV runs, disabled with `--no-cache`
+cache = ResultCache()
+
+XSCALE_OUTPUTS = ("XSCALE.LP", "MERGED.HKL", "XDSCONV.LP", "shelx.hkl")
+
+
+def strip_comments(inp: str) -> str:
+    """Remove the `!` comments and empty lines from XDS input `inp`."""
+    lines = (line.split("!", 1)[0].rstrip() for line in inp.splitlines())
+    return "\n".join(line for line in lines if line)
+
+
+def parse_pointless_xml(fn):
+    """Parse the best solution from the XML output of pointless (XMLOUT).
+    The file is parsed incrementally, and the parsing stops after the
+    best solution."""
+    d = {}
+    cell = {}
+
+    for event, elem in ElementTree.iterparse(fn, events=("end",)):
+        if elem.tag == "BestSolution":
+            if elem.get("Type", "pointgroup").lower() == "pointgroup":
+                for child in elem.iter():
+                    text = (child.text or "").strip()
+                    if not text:
+                        continue
+                    if child.tag == "GroupName":
+                        d["laue_group"] = text.replace(" ", "")
+                    elif child.tag == "ReindexOperator":
+                        d["reindex_operator"] = text
+                    elif child.tag in ("LGProb", "TotalProb"):
+                        d.setdefault("probability", float(text))
+                    elif child.tag == "Confidence":
+                        d["confidence"] = float(text)
+                    elif child.tag in ("a", "b", "c", "alpha", "beta", "gamma"):
+                        cell[child.tag] = float(text)
+                break
+            elem.clear()
+
+    if len(cell) == 6:
+        d["unit_cell"] = "{a:.2f} {b:.2f} {c:.2f} {alpha:.2f} {beta:.2f} {gamma:.2f}".format(**cell)
+
+    return d
+
+
+def parse_pointless_log(fn, verbose=True):
+    """Parse the best solution from the pointless log file. Returns the
+    results and the summary table (if `verbose`)."""
+    d = {}
+    summary = []
+
+    with open(fn, "r") as f:
+        output = False
+        for line in f:
+            if "Best Solution" in line:
+                # output = True
+                d["laue_group"] = line.split("point group")[-1].replace(" ", "").strip()
+            elif "Laue Group        Lklhd" in line:
+                output = verbose
+            
+            if line.startswith("   Reindex operator:"):
+                d["reindex_operator"] = line.split(":")[-1].strip()
+            if line.startswith("   Laue group probability:"):
+                d["probability"] = float(line.split(":")[-1])
+            if line.startswith("   Confidence:"):
+                d["confidence"] = float(line.split(":")[-1])
+            if line.startswith("   Unit cell:"):
+                d["unit_cell"] = line.split(":")[-1].strip()
+
+            if "<!--SUMMARY_END-->" in line:
+                output = False
+
+            if output and line.strip():
+                summary.append(line)
+
+    return d, "".join(summary)
+
+
+def run_pointless(filepat, verbose=True, i=0, xmlout="pointless.xml", logfile="pointless.log"):
+    """Run pointless on `filepat` (file name or pattern). The keywords are
+    passed on stdin, the results are read from the XML output, or from the
+    log file if the XML output is incomplete."""
+    drc = filepat.parent
 
     d = {}
 
     if POINTLESS:
+        keywords = POINTLESS_KEYWORDS.format(xmlout=xmlout)
+        key = cache_key("pointless", sorted(drc.glob(filepat.name)), keywords)
+        d = cache.restore(key, drc, (xmlout, logfile))
+        if d is not None:
+            print(f"Using cached pointless results for cluster {i}\n")
+            return d
+
         print(f"Running pointless on cluster {i}\n")
-        if platform == "win32":
-            sp.run(f"{bash_exe} -ic ./pointless.sh > pointless.log", cwd=drc)
-        else:
-            sp.run("bash ./pointless.sh > pointless.log", cwd=drc, shell=True)
-
-        with open(drc / "pointless.log", "r") as f:
-            output = False
-            for line in f:
-                if "Best Solution" in line:
-                    # output = True
-                    d["laue_group"] = line.split("point group")[-1].replace(" ", "").strip()
-                elif "Laue Group        Lklhd" in line:
-                    output = verbose
-                
-                if line.startswith("   Reindex operator:"):
-                    d["reindex_operator"] = line.split(":")[-1].strip()
-                if line.startswith("   Laue group probability:"):
-                    d["probability"] = float(line.split(":")[-1])
-                if line.startswith("   Confidence:"):
-                    d["confidence"] = float(line.split(":")[-1])
-                if line.startswith("   Unit cell:"):
-                    d["unit_cell"] = line.split(":")[-1].strip()
-
-                if "<!--SUMMARY_END-->" in line:
-                    output = False
-
-                if output and line.strip():
-                    print(line, end="")
-        print("-----\n")
+        result = runner.run(f"pointless {filepat.name}", cwd=drc, input=keywords, 
+                            stdout=drc / logfile, name="pointless")
+        if not result.ok:
+            print(f"Pointless did not finish successfully: {result}")
+
+        keys = ("laue_group", "reindex_operator", "probability", "confidence", "unit_cell")
+
+        try:
+            d = parse_pointless_xml(drc / xmlout)
+        except (OSError, ElementTree.ParseError, ValueError):
+            d = {}
+
+        summary = ""
+        if verbose or not all(key in d for key in keys):
+            try:
+                log, summary = parse_pointless_log(drc / logfile, verbose=verbose)
+            except OSError:
+                log = {}
+            for key, value in log.items():
+                d.setdefault(key, value)
+
+        with rlock:
+            print(summary, end="")
+            print("-----\n")
+
+        if result.ok and d:
+            cache.store(key, d, drc, (xmlout, logfile))
 
         return d
 
@@ -141,6 +225,7 @@ def run_xscale(clusters, cell, spgr, resolution=(20.0, 0.8), ioversigma=2):
         item = clusters[i]
         
         fns = item["files"]
+        sources = []
         drc = Path(f"cluster_{i}")
         drc.mkdir(parents=True, exist_ok=True)
     
@@ -170,8 +255,9 @@ def run_xscale(clusters, cell, spgr, resolution=(20.0, 0.8), ioversigma=2):
                 fn = s.replace(f"/mnt/{drive_letter}", drive)
             j += 1
             fn = Path(fn)
+            sources.append(fn)
             dst = drc / f"{j}_{fn.name}"
-            shutil.copy(fn, dst)
+            shutil.copy2(fn, dst)  # keep the modification time for the result cache
             print(f"    ! {fn}", file=f)
             print(f"    INPUT_FILE= {dst.name}", file=f)
             print(f"    INCLUDE_RESOLUTION_RANGE= {dmax:8.2f} {dmin:8.2f}", file=f)
@@ -183,12 +269,6 @@ def run_xscale(clusters, cell, spgr, resolution=(20.0, 0.8), ioversigma=2):
         filelist.close()
 
         item.update(run_pointless(drc / "*_XDS_ASCII.HKL"))
-
-        print(f"Running XSCALE on cluster {i}")
-        if platform == "win32":
-            sp.run(f"{bash_exe} -ic xscale 2>&1 >/dev/null", cwd=drc)
-        else:
-            sp.run("xscale 2>&1 >/dev/null", cwd=drc, shell=True)
     
         with open(drc / "XDSCONV.INP", "w") as f:
             print(f"""
@@ -196,13 +276,31 @@ INPUT_FILE= MERGED.HKL
 INCLUDE_RESOLUTION_RANGE= {dmax:8.2f} {dmin:8.2f} ! optional 
 OUTPUT_FILE= shelx.hkl  SHELX    ! Warning: do _not_ name this file "temp.mtz" !
 FRIEDEL'S_LAW= FALSE             ! default is FRIEDEL'S_LAW=TRUE""", file=f)
-        
-        if platform == "win32":
-            sp.run(f"{bash_exe} -ic xdsconv 2>&1 >/dev/null", cwd=drc)
+
+        # the `!` comments hold the cluster description and the source paths,
+        # the data are fingerprinted by content so the key does not depend on
+        # where the files are or which cluster they ended up in
+        keywords = strip_comments((drc / "XSCALE.INP").read_text() + (drc / "XDSCONV.INP").read_text())
+        key = cache_key("xscale", sources, keywords, content=True)
+        d = cache.restore(key, drc, XSCALE_OUTPUTS)
+
+        if d is not None:
+            print(f"Using cached XSCALE results for cluster {i}")
         else:
-            sp.run("xdsconv 2>&1 >/dev/null", cwd=drc, shell=True)
+            print(f"Running XSCALE on cluster {i}")
+            xscale = runner.run("xscale", cwd=drc)
+            if not xscale.ok:
+                print(f"XSCALE did not finish successfully: {xscale}")
+            
+            xdsconv = runner.run("xdsconv", cwd=drc)
+            if not xdsconv.ok:
+                print(f"XDSCONV did not finish successfully: {xdsconv}")
 
-        item.update(parse_xscale_lp(drc / "XSCALE.LP"))
+            d = parse_xscale_lp(drc / "XSCALE.LP")
+            if xscale.ok and xdsconv.ok:
+                cache.store(key, d, drc, XSCALE_OUTPUTS)
+
+        item.update(d)
         item["number"] = i
         results.append(item)
 
@@ -381,12 +479,17 @@ def main():
                         action="store_true", dest="show_dendrogram_only",
                         help="Just show the dendrogram and then quit.")
 
+    parser.add_argument("--no-cache",
+                        action="store_false", dest="use_cache",
+                        help="Always run pointless and XSCALE, do not use results from previous runs on the same input files.")
+
     parser.set_defaults(distance=None,
                         method="average",
                         resolution=(20, 0.8),
                         ioversigma=2,
                         show_dendrogram_only=False,
-                        min_size=1)
+                        min_size=1,
+                        use_cache=True)
 
     options = parser.parse_args()
     distance = options.distance
@@ -395,6 +498,7 @@ def main():
     dmax, dmin = options.resolution
     ioversigma = options.ioversigma
     show_dendrogram_only = options.show_dendrogram_only
+    cache.enabled = options.use_cache
 
     sort_key = "Completeness"
 
@@ -0,0 +1,86 @@
+import numpy as np
+from scipy import ndimage
+from .peaks import subpixel_offset
+
+
+def phase_correlation(stack: np.ndarray, reference: np.ndarray, whiten: float = 0.5, window: bool = False) -> np.ndarray:
+    """Sub-pixel shifts that register each frame in `stack` onto `reference`.
+
+    All cross-correlations are computed with a single batched FFT. The
+    integer peak is refined with a gaussian fit along each axis.
+
+    stack: array of shape (n_frames, h, w), or (h, w) for a single frame
+    reference: array of shape (h, w), or (n_frames, h, w) for a separate
+        reference per frame
+    whiten: exponent of the normalization of the cross-power spectrum, 1 gives
+        the classic phase correlation, 0 the plain cross-correlation. The
+        default is a compromise that keeps the correlation peak smooth enough
+        for the sub-pixel fit on a gaussian beam profile.
+    window: apply a Hann window to suppress edge effects (this biases the
+        shift of a beam that is not centered in the window)
+
+    Returns an array (n_frames, 2) with the (row, column) shift, i.e.
+    `ndimage.shift(stack[i], shifts[i])` matches the reference.
+    """
+    stack = np.asarray(stack, dtype=float)
+    single = stack.ndim == 2
+    if single:
+        stack = stack[None]
+    reference = np.asarray(reference, dtype=float)
+
+    n, h, w = stack.shape
+
+    if window:
+        taper = np.outer(np.hanning(h), np.hanning(w))
+        stack = stack * taper
+        reference = reference * taper
+
+    f_mov = np.fft.fft2(stack, axes=(-2, -1))
+    f_ref = np.fft.fft2(reference, axes=(-2, -1))
+
+    cross = f_ref * f_mov.conj()
+    if whiten:
+        cross /= np.maximum(np.abs(cross), np.finfo(float).eps) ** whiten
+    corr = np.fft.ifft2(cross, axes=(-2, -1)).real
+
+    flat = corr.reshape(n, -1).argmax(axis=1)
+    py, px = np.unravel_index(flat, (h, w))
+    idx = np.arange(n)
+
+    dy = subpixel_offset(corr[idx, (py - 1) % h, px], corr[idx, py, px], corr[idx, (py + 1) % h, px])
+    dx = subpixel_offset(corr[idx, py, (px - 1) % w], corr[idx, py, px], corr[idx, py, (px + 1) % w])
+
+    shifts = np.c_[py + dy, px + dx]
+    # wrap the periodic peak position to the range [-size/2, size/2)
+    shifts[:, 0] = (shifts[:, 0] + h / 2) % h - h / 2
+    shifts[:, 1] = (shifts[:, 1] + w / 2) % w - w / 2
+
+    return shifts[0] if single else shifts
+
+
+def track_drift(stack: np.ndarray, template: np.ndarray, running: bool = False, smooth: float = 0) -> np.ndarray:
+    """Track the drift of a sequence of frames (n_frames, h, w) relative to
+    `template`.
+
+    running: correlate every frame against the previous frame instead of
+        the template, and accumulate the frame-to-frame shifts. This is more
+        robust if the appearance of the beam changes slowly over the series.
+    smooth: standard deviation (in frames) of the gaussian filter applied to
+        the trajectory (0 = no smoothing)
+
+    Returns an array (n_frames, 2) with the (row, column) shifts that move
+    each frame onto the template.
+    """
+    stack = np.asarray(stack, dtype=float)
+
+    if running:
+        previous = np.concatenate((template[None], stack[:-1]))
+        steps = phase_correlation(stack, previous)
+        shifts = np.cumsum(steps, axis=0)
+    else:
+        shifts = phase_correlation(stack, template)
+
+    if smooth and len(shifts) > 1:
+        shifts = ndimage.gaussian_filter1d(shifts, smooth, axis=0, mode='nearest')
+
+    return shifts
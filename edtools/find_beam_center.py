@@ -1,191 +1,239 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+from collections import deque
+import os
 from .utils import parse_args_for_fns
 import numpy as np
-from scipy import ndimage
-from scipy import interpolate
-from skimage.registration import phase_cross_correlation
-import scipy.ndimage as ndimage
 from .update_xds import update_xds
+from .xds_inp import XDSInput
+from .image_io import write_adsc, read_frame, open_frame, find_frames, frame_suffix, prefetch
+from .translate import shift_image, shift_integer
+from .drift import track_drift
+from .peaks import find_peak_positions
 
-def read_adsc(fname: str) -> (np.array, dict):
-    """read in the file."""
-    with open(fname, 'rb', buffering=0) as infile:
-        try:
-            header = readheader(infile)
-        except BaseException:
-            raise Exception('Error processing adsc header')
-        # banned by bzip/gzip???
-        try:
-            infile.seek(int(header['HEADER_BYTES']), 0)
-        except TypeError:
-            # Gzipped does not allow a seek and read header is not
-            # promising to stop in the right place
-            infile.close()
-            infile = open(fname, 'rb', buffering=0)
-            infile.read(int(header['HEADER_BYTES']))
-        binary = infile.read()
-    # infile.close()
-
-    # now read the data into the array
-    dim1 = int(header['SIZE1'])
-    dim2 = int(header['SIZE2'])
-    data = np.frombuffer(binary, np.uint16)
-    if swap_needed(header):
-        data.byteswap(True)
-    try:
-        data.shape = (dim2, dim1)
-    except ValueError:
-        raise OSError(f'Size spec in ADSC-header does not match size of image data field {dim1}x{dim2} != {data.size}')
-
-    return data, header
-
-def write_adsc(fname: str, data: np.array, header: dict = {}):
-    """Write adsc format."""
-    if 'SIZE1' not in header and 'SIZE2' not in header:
-        dim2, dim1 = data.shape
-        header['SIZE1'] = dim1
-        header['SIZE2'] = dim2
-
-    out = b'{\n'
-    for key in header:
-        out += '{:}={:};\n'.format(key, header[key]).encode()
-    if 'HEADER_BYTES' in header:
-        pad = int(header['HEADER_BYTES']) - len(out) - 2
-    else:
-        #         hsize = ((len(out) + 23) // 512 + 1) * 512
-        hsize = (len(out) + 533) & ~(512 - 1)
-        out += f'HEADER_BYTES={hsize:d};\n'.encode()
-        pad = hsize - len(out) - 2
-    out += b'}' + (pad + 1) * b'\x00'
-    assert len(out) % 512 == 0, 'Header is not multiple of 512'
-
-    # NOTE: XDS can handle only "SMV" images of TYPE=unsigned_short.
-    dtype = np.uint16
-    data = np.round(data, 0).astype(dtype, copy=False)  # copy=False ensures that no copy is made if dtype is already satisfied
-    if swap_needed(header):
-        data.byteswap(True)
-
-    with open(fname, 'wb') as outf:
-        outf.write(out)
-        outf.write(data.tostring())
-
-
-def readheader(infile):
-    """read an adsc header."""
-    header = {}
-    line = infile.readline()
-    bytesread = len(line)
-    while b'}' not in line:
-        string = line.decode().strip()
-        if '=' in string:
-            (key, val) = string.split('=')
-            val = val.strip(';')
-            key = key.strip()
-            header[key] = val
-        line = infile.readline()
-        bytesread = bytesread + len(line)
-    return header
-    
-def swap_needed(header: dict) -> bool:
-    if 'BYTE_ORDER' not in header:
-        # logger.warning("No byte order specified, assuming little_endian")
-        BYTE_ORDER = 'little_endian'
-    else:
-        BYTE_ORDER = header['BYTE_ORDER']
-    if 'little' in BYTE_ORDER and np.little_endian:
-        return False
-    elif 'big' in BYTE_ORDER and not np.little_endian:
-        return False
-    elif 'little' in BYTE_ORDER and not np.little_endian:
-        return True
-    elif 'big' in BYTE_ORDER and np.little_endian:
-        return True
-
-def find_peak_max(arr: np.ndarray, sigma: int, m: int = 50, w: int = 10, kind: int = 3) -> (float, float):
+def find_peak_max(arr: np.ndarray, sigma: int, w: int = 10, method: str = "gaussian") -> float:
     """Find the index of the pixel corresponding to peak maximum in 1D pattern
     `arr`.
 
     First, the pattern is smoothed using a gaussian filter with standard
-    deviation `sigma` The initial guess takes the position corresponding
-    to the largest value in the resulting pattern A window of size 2*w+1
-    around this guess is taken and expanded by factor `m` to to
-    interpolate the pattern to get the peak maximum position with
-    subpixel precision.
+    deviation `sigma`. The position of the largest value in the resulting
+    pattern is refined with subpixel precision using a closed-form fit
+    (see `peaks.find_peak_positions`).
     """
-    y1 = ndimage.filters.gaussian_filter1d(arr, sigma)
-    c1 = np.argmax(y1)  # initial guess for beam center
+    return find_peak_positions(arr, sigma, method=method, w=w)
 
-    win_len = 2 * w + 1
+def find_beam_centers(stack: np.ndarray, sigma: int = 5, method: str = "gaussian", threshold: int = 7000) -> np.ndarray:
+    """Find the center of the primary beam in every image of `stack`
+    (n_frames, h, w) at once. Returns an array (n_frames, 2)."""
+    stack = np.asarray(stack, dtype=float)
+    stack = np.where(stack < threshold, 0, stack)
+    xx = np.sum(stack, axis=2)
+    yy = np.sum(stack, axis=1)
 
-    try:
-        r1 = np.linspace(c1 - w, c1 + w, win_len)
-        f = interpolate.interp1d(r1, y1[c1 - w: c1 + w + 1], kind=kind)
-        r2 = np.linspace(c1 - w, c1 + w, win_len * m)  # extrapolate for subpixel accuracy
-        y2 = f(r2)
-        c2 = np.argmax(y2) / m  # find beam center with `m` precision
-    except ValueError:  # if c1 is too close to the edges, return initial guess
-        return c1
+    cx = find_peak_positions(xx, sigma, method=method)
+    cy = find_peak_positions(yy, sigma, method=method)
 
-    return c2 + c1 - w
+    return np.c_[cx, cy]
 
-def find_beam_center(img: np.ndarray, sigma: int = 30, m: int = 100, kind: int = 3) -> (float, float):
+def find_beam_center(img: np.ndarray, sigma: int = 30, method: str = "gaussian") -> (float, float):
     """Find the center of the primary beam in the image `img` The position is
     determined by summing along X/Y directions and finding the position along
     the two directions independently.
 
-    Uses interpolation by factor `m` to find the coordinates of the
-    pimary beam with subpixel accuracy.
+    The peak of each profile is located with subpixel accuracy by a
+    closed-form fit (`method`), see `peaks.find_peak_positions`.
     """
-    img_thresh = img.copy()
-    img_thresh[img_thresh<7000] = 0
-    xx = np.sum(img_thresh, axis=1)
-    yy = np.sum(img_thresh, axis=0)
-
-    cx = find_peak_max(xx, sigma, m=m, kind=kind)
-    cy = find_peak_max(yy, sigma, m=m, kind=kind)
-
-    center = np.array([cx, cy])
-    return center
+    return find_beam_centers(img[None], sigma=sigma, method=method)[0]
     
 def translate_image(arr, shift: np.array) -> np.array:
     """Translate an image according to shift. Shift should be a 2D numpy array"""
-    img = np.zeros(arr.shape, dtype=np.uint16)
     shift = np.int16(shift)
-    avg = np.uint16(arr.mean())
-    if shift[0] >= 0 and shift[1] >= 0:
-        if shift[0] == 0 and shift[1] == 0:
-            return arr
-        elif shift[0] == 0:
-            img[:, shift[1]:] = arr[:, :-shift[1]]
-            img[:, :shift[1]] = avg
-        elif shift[1] == 0:
-            img[shift[0]:, :] = arr[:-shift[0], :]
-            img[:shift[0], :] = avg
+    if shift[0] == 0 and shift[1] == 0:
+        return arr
+    img = np.empty(arr.shape, dtype=np.uint16)
+    return shift_integer(arr, shift, out=img, fill=np.uint16(arr.mean()))
+
+def read_window(img: str, window: tuple) -> np.ndarray:
+    """Read only the region `window` of frame `img`."""
+    crop, _ = read_frame(img, roi=window)
+    return crop
+
+
+def apply_shift(img: str, shift: (float, float), beam_center: (float, float), order=3, out: str = None) -> None:
+    """Translate frame `img` by `shift` and write it to `out` as SMV (default:
+    in place). `order` selects the interpolation (see `translate.shift_image`)."""
+    reader = open_frame(img)
+    data = reader.read()
+    header = reader.smv_header()
+    data = shift_image(data, shift, order=order)
+    header['BEAM_CENTER_X'] = beam_center[1]
+    header['BEAM_CENTER_Y'] = beam_center[0]
+    write_adsc(out if out else img, data, header)
+
+
+def map_bounded(executor, func, arglist, max_in_flight: int = 16):
+    """Yield `func(*args)` for every item in `arglist` in order. If `executor`
+    is given, at most `max_in_flight` calls are submitted at any time, so
+    that memory use does not grow with the size of the data set."""
+    if executor is None:
+        for args in arglist:
+            yield func(*args)
+        return
+
+    in_flight = deque()
+    for args in arglist:
+        if len(in_flight) >= max_in_flight:
+            yield in_flight.popleft().result()
+        in_flight.append(executor.submit(func, *args))
+    while in_flight:
+        yield in_flight.popleft().result()
+
+
+def process_dataset(fn, executor=None, max_in_flight: int = 16, order=3, dry_run: bool = False, output: str = None,
+                    method: str = "profile", running: bool = False, smooth: float = 0):
+    """Find the beam center for the data set belonging to `fn` (XDS.INP)
+    and translate all frames in `data/` to the beam center of the first frame.
+    Frames can be in any format supported by `image_io` (SMV, gzipped SMV,
+    TIFF, CBF); only SMV frames can be corrected in place.
+
+    The shifts for all frames are estimated first and written to
+    `beam_shifts.csv` next to XDS.INP.
+
+    executor: optional (process) pool to handle the frames in parallel
+    max_in_flight: maximum number of frames submitted to `executor` at any time
+    order: interpolation order used to translate the frames
+    dry_run: only estimate the shifts, do not touch XDS.INP or the frames
+    output: write the corrected frames to this directory (relative to the
+        data set) instead of overwriting the originals
+    method: `profile` finds the beam center in every frame from the smoothed
+        row/column sums, `phase` loads the windows of all frames into one
+        stack and registers them against the first frame by batched
+        phase correlation (see `drift.track_drift`)
+    running, smooth: passed to `drift.track_drift` for method `phase`
+
+    Returns a dict with the beam center (ORGX/ORGY) to be written to XDS.INP
+    (see `apply_centers`), or None if the data set could not be processed.
+    """
+    data_path = fn.parent/'data'
+    try:
+        print(data_path)
+        img_list = find_frames(data_path)
+        img_first = str(img_list[0])
+        data, _ = read_frame(img_first)
+        center_x, center_y = find_beam_center(data)
+        #center_x, center_y = (268, 249)
+        x0 = int(round(center_x-16))
+        y0 = int(round(center_y-16))
+        window = (slice(x0, x0+32), slice(y0, y0+32))
+        template = data[window].copy()
+        center_x_new, center_y_new = find_beam_center(template, sigma=5)
+        print(center_x_new, center_y_new)
+        template_center = (center_x_new, center_y_new)
+
+        # only the window around the beam is read for the other frames
+        if executor is None:
+            crops = (crop for crop, _ in prefetch(img_list[1:], roi=window))
         else:
-            img[shift[0]:, shift[1]:] = arr[:-shift[0], :-shift[1]]
-            img[:shift[0], :] = avg
-            img[:, :shift[1]] = avg
-    elif shift[0] >= 0 and shift[1] < 0:
-        if shift[0] == 0:
-            img[:, :shift[1]] = arr[:, -shift[1]:]
-            img[:, shift[1]:] = avg
+            arglist = [(str(img), window) for img in img_list[1:]]
+            crops = map_bounded(executor, read_window, arglist, max_in_flight)
+        stack = np.array(list(crops)).reshape((-1,) + template.shape)
+        if method == "phase":
+            shifts = track_drift(stack, template, running=running, smooth=smooth).reshape(-1, 2)
         else:
-            img[shift[0]:, :shift[1]] = arr[:-shift[0], -shift[1]:]
-            img[:shift[0], :] = avg
-            img[:, shift[1]:] = avg
-    elif shift[0] < 0 and shift[1] >= 0:
-        if shift[1] == 0:
-            img[:shift[0], :] = arr[-shift[0]:, :]
-            img[shift[0]:, :] = avg
+            shifts = template_center - find_beam_centers(stack, sigma=5)
+
+        frames = np.arange(1, len(img_list))
+        np.savetxt(fn.with_name("beam_shifts.csv"), np.c_[frames, shifts], fmt=("%d", "%.3f", "%.3f"),
+                   delimiter=",", header="frame,shift_x,shift_y", comments="")
+        if len(shifts):
+            print(f"Drift (px): mean {shifts.mean(axis=0).round(2)}, max {np.abs(shifts).max(axis=0).round(2)}")
+
+        # XDS counts pixels from 1
+        result = {"directory": str(fn.parent),
+                  "ORGX": round(y0+center_y_new+1, 2),
+                  "ORGY": round(x0+center_x_new+1, 2),
+                  "n_frames": len(img_list)}
+        if len(shifts):
+            result["drift_max_x"], result["drift_max_y"] = np.abs(shifts).max(axis=0).round(3)
+
+        if dry_run:
+            return result
+
+        suffix = frame_suffix(img_first)
+        if output:
+            # frames are always written as SMV
+            out_path = fn.parent / output
+            out_path.mkdir(parents=True, exist_ok=True)
+            out_names = [str(out_path / (img.name[:-len(suffix)] + ".img")) for img in img_list]
+            write_adsc(out_names[0], data, open_frame(img_first).smv_header())
+            template = output_template(fn, output)
+            if template:
+                result["NAME_TEMPLATE_OF_DATA_FRAMES"] = template
+        elif suffix != ".img":
+            print(f"Frames in `{suffix}` format cannot be corrected in place, use `--output`: {data_path}")
+            return result
         else:
-            img[:shift[0], shift[1]:] = arr[-shift[0]:, :-shift[1]]
-            img[shift[0]:, :] = avg
-            img[:, :shift[1]] = avg
-    elif shift[0] < 0 and shift[1] < 0:
-        img[:shift[0], :shift[1]] = arr[-shift[0]:, -shift[1]:]
-        img[shift[0]:, :] = avg
-        img[:, shift[1]:] = avg
+            out_names = [None] * len(img_list)
+
+        arglist = [(str(img), shift, (center_x, center_y), order, out_name)
+                   for img, shift, out_name in zip(img_list[1:], shifts, out_names[1:])]
+        for _ in map_bounded(executor, apply_shift, arglist, max_in_flight):
+            pass
+
+        return result
+    except Exception as e:
+        print(f'Beam center finding was interrupted: {data_path} ({type(e).__name__}: {e})')
+
+
+def output_template(fn, output: str) -> str:
+    """NAME_TEMPLATE_OF_DATA_FRAMES of XDS.INP `fn` for the corrected frames
+    in directory `output` (relative to XDS.INP), which are always SMV. Returns
+    None if XDS.INP has no frame template."""
+    try:
+        template = XDSInput.read(fn).get("NAME_TEMPLATE_OF_DATA_FRAMES")
+    except OSError:
+        return None
+    if not template:
+        return None
+    name = Path(template.split()[0]).name
+    suffix = frame_suffix(name)
+    if suffix:
+        name = name[:-len(suffix)]
+    return f"{(Path(output) / name).as_posix()}.img   SMV"
+
+
+def apply_centers(results: list) -> None:
+    """Write the beam centers collected from `process_dataset` to the
+    corresponding XDS.INP files, one (atomic) rewrite per file. Data sets
+    corrected with `--output` are pointed to the corrected frames."""
+    for result in results:
+        fn = Path(result["directory"]) / "XDS.INP"
+        edits = {}
+        if result.get("NAME_TEMPLATE_OF_DATA_FRAMES"):
+            edits["NAME_TEMPLATE_OF_DATA_FRAMES"] = result["NAME_TEMPLATE_OF_DATA_FRAMES"]
+        update_xds(fn, jobs=(), center=(result["ORGX"], result["ORGY"]), edits=edits)
+    print(f"Updated beam center in {len(results)} XDS.INP files")
+
+
+def write_center_summary(results: list, fn: str = None) -> None:
+    """Write a table with the beam center per data set to `fn` (default:
+    `beam_centers.csv` in the common parent directory of the data sets). The
+    ORGX/ORGY columns use the XDS keywords, so the table can be used as an
+    update plan."""
+    import pandas as pd
+    directories = [Path(result["directory"]).resolve() for result in results]
+    if fn is None:
+        fn = Path(os.path.commonpath(directories)) / "beam_centers.csv"
+    df = pd.DataFrame(results)
+    # relative to the table, `update_xds --plan` reads them like that
+    root = Path(fn).resolve().parent
+    try:
+        df["directory"] = [os.path.relpath(drc, root) for drc in directories]
+    except ValueError:  # on another drive
+        df["directory"] = [str(drc) for drc in directories]
+    df.to_csv(fn, index=False)
+    print(f"Wrote beam centers of {len(df)} data sets to file {fn}")
 
-    return img
 
 def main():
     import argparse
@@ -206,48 +254,86 @@ def main():
                         action="store", type=float, nargs=2, dest="stretch",
                         help="Correct for the elliptical distortion")
 
+    parser.add_argument("-j", "--jobs",
+                        action="store", type=int, dest="n_jobs",
+                        help="Number of processes used to correct the frames in parallel (default: 1)")
+    parser.add_argument("-n", "--datasets",
+                        action="store", type=int, dest="n_datasets",
+                        help="Number of data sets to process concurrently when running with `--jobs` (default: 2)")
+
+    parser.add_argument("-o", "--order",
+                        action="store", type=str, dest="order",
+                        help="Interpolation used to translate the frames: 0 (integer shift, fastest), 1 (bilinear), 3 (cubic spline, default) or `fourier`")
+
+    parser.add_argument("-d", "--dry-run",
+                        action="store_true", dest="dry_run",
+                        help="Only estimate the shift of every frame and write them to `beam_shifts.csv`; XDS.INP and the frames are not changed")
+
+    parser.add_argument("--output",
+                        action="store", type=str, dest="output",
+                        help="Write the corrected frames to this directory (relative to XDS.INP) instead of overwriting them, "
+                        "NAME_TEMPLATE_OF_DATA_FRAMES in XDS.INP is changed to the corrected (SMV) frames")
+
+    parser.add_argument("--summary",
+                        action="store", type=str, dest="summary",
+                        help="Write the table with the beam center of every data set to this file "
+                        "(default: `beam_centers.csv` in the common directory of the data sets)")
+
+    parser.add_argument("--method",
+                        action="store", type=str, dest="method", choices=("profile", "phase"),
+                        help="Method to find the shift of every frame: `profile` (peak of the row/column sums in each frame, default) "
+                        "or `phase` (batched phase correlation of all frames against the first one)")
+
+    parser.add_argument("--running",
+                        action="store_true", dest="running",
+                        help="With `--method phase`, correlate every frame against the previous one and accumulate the shifts")
+
+    parser.add_argument("--smooth",
+                        action="store", type=float, dest="smooth",
+                        help="With `--method phase`, smooth the drift trajectory with a gaussian filter of this width (in frames)")
+
     parser.set_defaults(match=None,
-                        stretch=None)
+                        stretch=None,
+                        n_jobs=1,
+                        n_datasets=2,
+                        order="3",
+                        dry_run=False,
+                        output=None,
+                        summary=None,
+                        method="profile",
+                        running=False,
+                        smooth=0)
 
     options = parser.parse_args()
     
     match = options.match
     args = options.args
+    n_jobs = options.n_jobs
+    n_datasets = options.n_datasets
+    order = options.order if options.order == "fourier" else int(options.order)
+    kwargs = {"order": order, "dry_run": options.dry_run, "output": options.output,
+              "method": options.method, "running": options.running, "smooth": options.smooth}
 
     XDS_input_path = parse_args_for_fns(args = args, name="XDS.INP", match=match)
 
     
-    for fn in XDS_input_path:
-        try:
-            data_path = fn.parent/'data'
-            print(data_path)
-            img_list = list(data_path.glob("*.img"))
-            img_first = str(img_list[0])
-            data, header = read_adsc(img_first)
-            center_x, center_y = find_beam_center(data)
-            #center_x, center_y = (268, 249)
-            template = data[int(round(center_x-16)):int(round(center_x+16)), 
-                            int(round(center_y-16)):int(round(center_y+16))].copy()
-            center_x_new, center_y_new = find_beam_center(template, sigma=5)
-            print(center_x_new, center_y_new)
-            update_xds(fn, jobs=(), center=(center_y-16+center_y_new+0.8, center_x-16+center_x_new+0.8))
-            
-            for img in img_list[1:]:
-                img = str(img)
-                data, header = read_adsc(img)
-                #center = find_beam_center(data)
-                #center_area = data[round(center_y)-10:round(center_y)+10, round(center_x)-10:round(center_x)+10]
-                center  = find_beam_center(data[int(round(center_x-16)):int(round(center_x+16)), 
-                                            int(round(center_y-16)):int(round(center_y+16))],sigma=5)
-                shift = (center_x_new-center[0], center_y_new-center[1])
-                #shift, error, phasediff = phase_cross_correlation(template, center_area, upsample_factor=10)
-                print(shift)
-                data = ndimage.shift(data, shift, output=np.uint16, mode='nearest')
-                header['BEAM_CENTER_X'] = center_y
-                header['BEAM_CENTER_Y'] = center_x
-                write_adsc(img, data, header)
-        except:
-            print(f'Beam center finding was interrupted: {data_path}')
+    if n_jobs > 1:
+        max_in_flight = 4 * n_jobs
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor, \
+             ThreadPoolExecutor(max_workers=n_datasets) as datasets:
+            futures = [datasets.submit(process_dataset, fn, executor, max_in_flight, **kwargs) for fn in XDS_input_path]
+            results = [future.result() for future in futures]
+    else:
+        results = [process_dataset(fn, **kwargs) for fn in XDS_input_path]
+
+    results = [result for result in results if result]
+    if not results:
+        return
+
+    write_center_summary(results, fn=options.summary)
+
+    if not options.dry_run:
+        apply_centers(results)
 
 if __name__ == '__main__':
     main()
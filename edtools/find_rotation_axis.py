@@ -4,6 +4,7 @@ from scipy import ndimage
 import yaml
 import numpy as np
 import os, sys
+from .geometry import ReciprocalMapper
 
 
 def rotation_axis_to_xyz(rotation_axis, invert=False, setting='xds'):
@@ -102,21 +103,7 @@ def make(arr, omega: float, wavelength: float):
     This is to ensure to match the XDS convention with the one I'm used to
     """
 
-    reflections = arr[:,0:2]
-    angle = arr[:,2]
-
-    omega_rad = np.radians(omega)
-    r = make_2d_rotmat(omega_rad)
-
-    refs_ = np.dot(reflections, r)
-
-    y, x = refs_.T  # NOTE 1
-
-    R = 1/wavelength
-    C = R - np.sqrt(R**2 - x**2 - y**2).reshape(-1,1)
-    xyz = np.c_[x * np.cos(angle), y, -x*np.sin(angle)] + C * np.c_[-np.sin(angle), np.zeros_like(angle), -np.cos(angle)]
-
-    return xyz
+    return ReciprocalMapper(arr, wavelength).project(omega)
 
 
 def optimize(arr, omega_start: float, wavelength=float,
@@ -135,8 +122,11 @@ def optimize(arr, omega_start: float, wavelength=float,
     best_score = 0
     best_omega = 0
 
+    mapper = ReciprocalMapper(arr, wavelength)
+    xyz = np.empty((len(mapper), 3))
+
     for omega in r:
-        xyz = make(arr, omega, wavelength)
+        mapper.project(omega, out=xyz)
 
         nvectors = sum(range(len(xyz)))
 
@@ -0,0 +1,96 @@
+import numpy as np
+
+
+def distance_to_rotation_axis(x, y, center, slope):
+    """Perpendicular distance (in pixels) of the spot positions `x`, `y`
+    to the rotation axis passing through `center` along direction `slope`,
+    where `slope` is given as (dx, dy) in the XDS pixel convention."""
+    sx, sy = slope
+    return np.abs(-sx * (x - center[0]) + sy * (y - center[1])) / np.hypot(sx, sy)
+
+
+class ReciprocalMapper:
+    """Map spot positions to reciprocal space coordinates for a series of
+    rotation axis positions (omega).
+
+    All terms that do not depend on omega (Ewald sphere correction and the
+    sin/cos of the frame angles) are computed once in the constructor, so
+    that `project` reduces to a handful of fused array operations into
+    preallocated buffers.
+
+    arr: array with columns x, y (reciprocal Ångström, relative to the beam
+        center) and the rotation angle (radians) of each spot, as returned by
+        `find_rotation_axis.load_spot_xds`
+    wavelength: wavelength in Ångström
+    """
+
+    def __init__(self, arr, wavelength: float):
+        arr = np.asarray(arr, dtype=float)
+        rx = arr[:, 0]
+        ry = arr[:, 1]
+        angle = arr[:, 2]
+
+        # the length of the in-plane vector is invariant under the 2D rotation,
+        # so the Ewald sphere correction does not depend on omega
+        R = 1 / wavelength
+        C = R - np.sqrt(R**2 - rx**2 - ry**2)
+
+        cos_a = np.cos(angle)
+        sin_a = np.sin(angle)
+
+        self.rx = rx
+        self.ry = ry
+        self.rx_cos = rx * cos_a
+        self.ry_cos = ry * cos_a
+        self.rx_sin = rx * sin_a
+        self.ry_sin = ry * sin_a
+        self.c_sin = C * sin_a
+        self.c_cos = C * cos_a
+
+        self._tmp = np.empty_like(rx)
+
+    @classmethod
+    def from_pixels(cls, xy, angle, beam_center, pixelsize: float, wavelength: float):
+        """Set up the mapper from raw pixel coordinates `xy` (n, 2), the
+        rotation angle per spot (radians), the beam center (px) and the
+        pixelsize (Å-1/px)."""
+        xy = np.asarray(xy, dtype=float)
+        reflections = (xy - beam_center) * pixelsize
+        return cls(np.c_[reflections, angle], wavelength)
+
+    def __len__(self):
+        return len(self.rx)
+
+    def project(self, omega: float, out=None) -> np.ndarray:
+        """Return the xyz coordinates for rotation axis `omega` (degrees).
+
+        Equivalent to `find_rotation_axis.make`. If `out` is given, it must be
+        a C-contiguous float array of shape (n, 3), and is filled in-place."""
+        if out is None:
+            out = np.empty((len(self), 3))
+
+        omega_rad = np.radians(omega)
+        c = np.cos(omega_rad)
+        s = np.sin(omega_rad)
+
+        tmp = self._tmp
+        x_, y_, z_ = out.T
+
+        # x' = x*cos(angle) - C*sin(angle), with x = ry*cos(omega) - rx*sin(omega)
+        np.multiply(self.ry_cos, c, out=x_)
+        np.multiply(self.rx_cos, s, out=tmp)
+        x_ -= tmp
+        x_ -= self.c_sin
+
+        # y' = rx*cos(omega) + ry*sin(omega)
+        np.multiply(self.rx, c, out=y_)
+        np.multiply(self.ry, s, out=tmp)
+        y_ += tmp
+
+        # z' = -x*sin(angle) - C*cos(angle)
+        np.multiply(self.rx_sin, s, out=z_)
+        np.multiply(self.ry_sin, c, out=tmp)
+        z_ -= tmp
+        z_ -= self.c_cos
+
+        return out
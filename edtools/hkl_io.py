@@ -0,0 +1,231 @@
+from io import BytesIO
+from pathlib import Path
+import mmap
+import re
+import numpy as np
+import pandas as pd
+
+# columns of INTEGRATE.HKL, see http://xds.mpimf-heidelberg.mpg.de/html_doc/xds_files.html#INTEGRATE.HKL
+INTEGRATE_COLUMNS = ("H", "K", "L", "IOBS", "SIGMA", "XCAL", "YCAL", "ZCAL",
+                     "RLP", "PEAK", "CORR", "MAXC", "XOBS", "YOBS", "ZOBS",
+                     "ALF0", "BET0", "ALF1", "BET1", "PSI", "ISEG")
+
+# columns that are stored as integers, all others are float64
+INTEGER_COLUMNS = {"H": np.int32, "K": np.int32, "L": np.int32, "ISEG": np.int32, "ISET": np.int32}
+
+END_OF_HEADER = b"!END_OF_HEADER"
+END_OF_DATA = b"!END_OF_DATA"
+
+# `KEY=` in a header line, a line can hold several keywords (`!NX= 512 NY= 512`)
+HEADER_KEYWORD = re.compile(r"([A-Za-z][\w'().\-]*)=")
+
+
+def _parse_value(val: str):
+    """Convert a header value to int, float or a list of numbers, if
+    possible."""
+    items = val.split()
+    numbers = []
+    for item in items:
+        try:
+            numbers.append(int(item))
+        except ValueError:
+            try:
+                numbers.append(float(item))
+            except ValueError:
+                return val.strip()
+    if len(numbers) == 1:
+        return numbers[0]
+    return numbers
+
+
+def _close_value(val: str) -> str:
+    """Cut `val` at the first unmatched `)`, the end of a keyword inside
+    parentheses (`(VERSION Jan 26, 2018  BUILT=20180126)   22-Jan-2019`)."""
+    depth = 0
+    for i, c in enumerate(val):
+        if c == "(":
+            depth += 1
+        elif c == ")":
+            if depth == 0:
+                return val[:i]
+            depth -= 1
+    return val
+
+
+def parse_header_line(line: str) -> dict:
+    """Return the keywords in header line `line` (starting with `!`)."""
+    line = line.lstrip("!")
+    matches = list(HEADER_KEYWORD.finditer(line))
+    d = {}
+    for match, nxt in zip(matches, matches[1:] + [None]):
+        end = nxt.start() if nxt else len(line)
+        d[match.group(1)] = _parse_value(_close_value(line[match.end():end]))
+    return d
+
+
+def read_header(fn) -> (dict, int):
+    """Read the header of an XDS reflection file (INTEGRATE.HKL,
+    XDS_ASCII.HKL).
+
+    Returns the header keywords as a dict (`NX`, `ORGX`, `ROTATION_AXIS`,
+    `STARTING_ANGLE`, ...) and the byte offset of the first data line.
+    """
+    header = {}
+    offset = 0
+    with open(fn, "rb") as f:
+        for raw in f:
+            if not raw.startswith(b"!"):
+                break
+            offset += len(raw)
+            if raw.startswith(END_OF_HEADER):
+                break
+            header.update(parse_header_line(raw.decode(errors="replace")))
+    return header, offset
+
+
+def header_columns(header: dict) -> list:
+    """Column names from the `ITEM_*` keywords of the header, or the
+    INTEGRATE.HKL columns if there are none."""
+    items = {key[5:]: val for key, val in header.items() if key.startswith("ITEM_") and isinstance(val, int)}
+    if items:
+        return sorted(items, key=items.get)
+    n = header.get("NUMBER_OF_ITEMS_IN_EACH_DATA_RECORD", len(INTEGRATE_COLUMNS))
+    return list(INTEGRATE_COLUMNS[:n])
+
+
+def column_dtype(columns) -> np.dtype:
+    """Structured dtype for `columns`."""
+    return np.dtype([(col, INTEGER_COLUMNS.get(col, np.float64)) for col in columns])
+
+
+def read_xds_hkl(fn, columns=None, as_frame: bool = False):
+    """Read an XDS reflection file (INTEGRATE.HKL, XDS_ASCII.HKL).
+
+    The file is memory-mapped and the data block (between `!END_OF_HEADER`
+    and `!END_OF_DATA`) is parsed in one pass with the pandas C parser.
+
+    columns: column names, by default taken from the header (see
+        `header_columns`)
+    as_frame: return a `pandas.DataFrame` instead of a structured array
+
+    Returns the reflections as a structured numpy array (or DataFrame) and
+    the header keywords as a dict.
+    """
+    header, offset = read_header(fn)
+    if columns is None:
+        columns = header_columns(header)
+    dtype = column_dtype(columns)
+
+    data = b""
+    with open(fn, "rb") as f:
+        if Path(fn).stat().st_size > offset:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                end = mm.find(END_OF_DATA, offset)
+                data = mm[offset:end if end >= 0 else len(mm)]
+
+    if data and not data.isspace():
+        df = pd.read_csv(BytesIO(data), sep=r"\s+", comment="!", header=None, names=list(columns),
+                         dtype={col: dtype[col] for col in columns}, engine="c")
+    else:
+        df = pd.DataFrame(np.empty(0, dtype=dtype))
+
+    if as_frame:
+        return df, header
+
+    arr = np.empty(len(df), dtype=dtype)
+    for col in columns:
+        arr[col] = df[col].to_numpy()
+    return arr, header
+
+
+# SHELX HKLF 4 format: h, k, l (4 characters), intensity and sigma (8 characters)
+SHELX_WIDTHS = (4, 4, 4, 8, 8)
+SHELX_COLUMNS = ("H", "K", "L", "I", "SIGMA")
+
+
+def _shelx_value(value: float, decimals: int) -> str:
+    """`value` in 8 characters, with fewer decimals if it does not fit with
+    `decimals` (like cctbx)."""
+    for d in range(decimals, -1, -1):
+        s = "%8.*f" % (d, value)
+        if len(s) <= 8:
+            return s
+    raise ValueError(f"Value does not fit in the HKLF 4 format: {value}")
+
+
+def format_shelx_hkl(hkl, intensity, sigma, decimals: int = 2, terminate: bool = True) -> bytes:
+    """Format reflections as SHELX HKLF 4 (`%4d%4d%4d%8.2f%8.2f`).
+
+    All rows are formatted with a single `%` operation on a repeated row
+    template. Values that do not fit in 8 characters are written with fewer
+    decimals (like cctbx), a ValueError is raised if they do not fit at all.
+    With `terminate`, the `0 0 0` end record is added.
+    """
+    hkl = np.asarray(hkl, dtype=np.int64).reshape(-1, 3)
+    values = np.column_stack([np.asarray(intensity, dtype=float), np.asarray(sigma, dtype=float)])
+
+    bad = (hkl < -999) | (hkl > 9999)
+    if bad.any():
+        raise ValueError(f"Miller index does not fit in 4 characters: {hkl[bad.any(axis=1)][0]}")
+
+    # values that may not fit with `decimals`, these are formatted one by one
+    large = ~(np.abs(values) < 10.0**(6 - decimals) - 1)
+    rows = np.flatnonzero(large.any(axis=1))
+
+    template = f"%4d%4d%4d%8.{decimals}f%8.{decimals}f\n"
+    args = np.column_stack([hkl, values]).tolist()
+    if len(rows):
+        templates = np.full(len(hkl), template, dtype=object)
+        templates[rows] = "%4d%4d%4d%s%s\n"
+        for i in rows:
+            args[i][3:] = [_shelx_value(value, decimals) for value in values[i]]
+        template = "".join(templates)
+    else:
+        template = template * len(hkl)
+
+    text = template % tuple(x for row in args for x in row)
+    if terminate:
+        text += "   0   0   0" + "0.00".rjust(8) * 2 + "\n"
+    return text.encode()
+
+
+def write_shelx_hkl(fn, hkl, intensity, sigma, decimals: int = 2, terminate: bool = True) -> None:
+    """Write reflections to SHELX HKLF 4 file `fn`, see `format_shelx_hkl`."""
+    with open(fn, "wb") as f:
+        f.write(format_shelx_hkl(hkl, intensity, sigma, decimals=decimals, terminate=terminate))
+
+
+def read_shelx_hkl(fn) -> np.ndarray:
+    """Read SHELX HKLF 4 file `fn` into a structured array with the columns
+    H, K, L, I, SIGMA. Reading stops at the `0 0 0` end record, extra
+    columns (batch numbers) are ignored."""
+    line_length = sum(SHELX_WIDTHS)
+    with open(fn, "rb") as f:
+        lines = f.read().splitlines()
+    dtype = column_dtype(SHELX_COLUMNS)
+
+    # fields can touch (`  12-120  -3`), so pad/truncate every line to the
+    # fixed width, put a space between the fields and parse the result in bulk
+    chars = np.array(lines, dtype=f"S{line_length}").view(np.uint8).reshape(-1, line_length)
+    chars = chars[(chars > ord(" ")).any(axis=1)]  # skip empty lines
+    if not len(chars):
+        return np.empty(0, dtype=dtype)
+    bounds = np.cumsum((0,) + SHELX_WIDTHS)
+    sep = np.full((len(chars), 1), ord(" "), dtype=np.uint8)
+    parts = []
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        parts.extend((chars[:, start:stop], sep))
+    parts[-1] = np.full((len(chars), 1), ord("\n"), dtype=np.uint8)
+    buf = np.hstack(parts)
+    buf[buf == 0] = ord(" ")
+
+    df = pd.read_csv(BytesIO(buf.tobytes()), sep=r"\s+", header=None, names=SHELX_COLUMNS,
+                     dtype={col: dtype[col] for col in SHELX_COLUMNS}, engine="c")
+    arr = np.empty(len(df), dtype=dtype)
+    for col in SHELX_COLUMNS:
+        arr[col] = df[col].to_numpy()
+
+    end = np.flatnonzero((arr["H"] == 0) & (arr["K"] == 0) & (arr["L"] == 0))
+    if len(end):
+        arr = arr[:end[0]]
+    return arr
@@ -0,0 +1,368 @@
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from pathlib import Path
+import gzip
+import re
+import numpy as np
+
+try:
+    import tifffile
+except ImportError:
+    tifffile = None
+
+# maps file name suffix -> frame reader class, see `register_reader`
+READERS = {}
+
+
+def _parse_header(raw: bytes) -> dict:
+    """Parse the key=value; pairs of an SMV header block."""
+    header = {}
+    text = raw.split(b'}', 1)[0].decode(errors='replace')
+    for line in text.splitlines():
+        line = line.strip()
+        if '=' in line:
+            key, val = line.split('=', 1)
+            header[key.strip()] = val.strip().strip(';')
+    return header
+
+
+def readheader(infile) -> dict:
+    """read an adsc header from the open binary file `infile`."""
+    raw = infile.read(512)
+    while b'}' not in raw:
+        block = infile.read(512)
+        if not block:
+            break
+        raw += block
+    return _parse_header(raw)
+
+
+def swap_needed(header: dict) -> bool:
+    if 'BYTE_ORDER' not in header:
+        # logger.warning("No byte order specified, assuming little_endian")
+        BYTE_ORDER = 'little_endian'
+    else:
+        BYTE_ORDER = header['BYTE_ORDER']
+    if 'little' in BYTE_ORDER and np.little_endian:
+        return False
+    elif 'big' in BYTE_ORDER and not np.little_endian:
+        return False
+    elif 'little' in BYTE_ORDER and not np.little_endian:
+        return True
+    elif 'big' in BYTE_ORDER and np.little_endian:
+        return True
+
+
+def file_dtype(header: dict) -> np.dtype:
+    """Return the on-disk dtype (including byte order) of the image data."""
+    byte_order = header.get('BYTE_ORDER', 'little_endian')
+    return np.dtype('>u2' if 'big' in byte_order else '<u2')
+
+
+def register_reader(*suffixes):
+    """Class decorator that registers a frame reader for the given file name
+    suffixes (e.g. '.img', '.img.gz'). A reader is constructed with the file
+    name, exposes the parsed `header` and `shape`, and implements
+    `read(roi=None)`."""
+    def decorator(cls):
+        for suffix in suffixes:
+            READERS[suffix.lower()] = cls
+        cls.suffixes = suffixes
+        return cls
+    return decorator
+
+
+def frame_suffix(fname) -> str:
+    """Return the registered suffix matching `fname`, or None. Multi-part
+    suffixes such as '.img.gz' take precedence over '.gz'."""
+    name = Path(fname).name.lower()
+    matches = [suffix for suffix in READERS if name.endswith(suffix)]
+    return max(matches, key=len) if matches else None
+
+
+def open_frame(fname):
+    """Return a frame reader for `fname`, selected by the file name suffix."""
+    suffix = frame_suffix(fname)
+    if suffix is None:
+        raise ValueError(f"No frame reader registered for {fname} (supported: {', '.join(sorted(READERS))})")
+    return READERS[suffix](fname)
+
+
+def read_frame(fname, roi=None) -> (np.ndarray, dict):
+    """Read frame `fname` in any registered format.
+
+    roi: optional tuple of slices (rows, columns) to read only part of the image
+    """
+    reader = open_frame(fname)
+    return reader.read(roi=roi), reader.header
+
+
+def find_frames(drc) -> list:
+    """Return the sorted list of frames in directory `drc`. If several
+    formats are present, the most common one is used."""
+    groups = {}
+    for fn in Path(drc).iterdir():
+        suffix = frame_suffix(fn)
+        if suffix:
+            groups.setdefault(suffix, []).append(fn)
+    if not groups:
+        return []
+    return sorted(max(groups.values(), key=len))
+
+
+def prefetch(frames, roi=None, depth: int = 8, max_workers: int = 4):
+    """Yield `(data, header)` for each of `frames` in order, while up to
+    `depth` frames are read ahead on a thread pool."""
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        queue = deque()
+        for frame in frames:
+            if len(queue) >= depth:
+                yield queue.popleft().result()
+            queue.append(executor.submit(read_frame, frame, roi))
+        while queue:
+            yield queue.popleft().result()
+
+
+def _normalize_roi(roi, shape: (int, int)) -> (slice, slice):
+    """Return `roi` as a pair of slices with explicit, clipped bounds."""
+    rows, cols = roi
+    return (slice(*rows.indices(shape[0])[:2]), slice(*cols.indices(shape[1])[:2]))
+
+
+@register_reader('.img', '.smv')
+class SMVFile:
+    """Lazy view on an SMV/ADSC image file.
+
+    The header is parsed once on construction. The data block after the
+    header is memory-mapped with the byte order given in the header, so that
+    reading a region of interest only pages in the rows that are touched.
+    """
+
+    def __init__(self, fname):
+        self.fname = Path(fname)
+        with open(self.fname, 'rb') as infile:
+            try:
+                self.header = readheader(infile)
+            except BaseException:
+                raise Exception('Error processing adsc header')
+
+        self.offset = int(self.header['HEADER_BYTES'])
+        self.dtype = file_dtype(self.header)
+        self.shape = (int(self.header['SIZE2']), int(self.header['SIZE1']))
+
+        expected = self.offset + self.dtype.itemsize * self.shape[0] * self.shape[1]
+        size = self.fname.stat().st_size
+        if size < expected:
+            dim2, dim1 = self.shape
+            n = (size - self.offset) // self.dtype.itemsize
+            raise OSError(f'Size spec in ADSC-header does not match size of image data field {dim1}x{dim2} != {n}')
+
+    def memmap(self) -> np.memmap:
+        """Return a read-only memory map of the data block."""
+        return np.memmap(self.fname, dtype=self.dtype, mode='r', offset=self.offset, shape=self.shape)
+
+    def read(self, roi=None) -> np.ndarray:
+        """Read the image data in native byte order.
+
+        roi: optional tuple of slices (rows, columns); only this region is read
+        """
+        mm = self.memmap()
+        try:
+            if roi is not None:
+                mm = mm[roi]
+            # always copy, so that the map can be closed and the file rewritten
+            return mm.astype(np.uint16)
+        finally:
+            del mm
+
+    def smv_header(self) -> dict:
+        """Header to use when the frame is written as SMV."""
+        return dict(self.header)
+
+
+@register_reader('.img.gz', '.smv.gz')
+class GzipSMVFile:
+    """SMV/ADSC image compressed with gzip.
+
+    The file is decompressed as a stream; for a region of interest only the
+    data up to the last row of the region are decompressed.
+    """
+
+    def __init__(self, fname):
+        self.fname = Path(fname)
+        with gzip.open(self.fname, 'rb') as infile:
+            self.header = readheader(infile)
+        self.offset = int(self.header['HEADER_BYTES'])
+        self.dtype = file_dtype(self.header)
+        self.shape = (int(self.header['SIZE2']), int(self.header['SIZE1']))
+
+    def read(self, roi=None) -> np.ndarray:
+        nrows, ncols = self.shape
+        if roi is not None:
+            roi = _normalize_roi(roi, self.shape)
+            nrows = roi[0].stop
+
+        nbytes = nrows * ncols * self.dtype.itemsize
+        with gzip.open(self.fname, 'rb') as infile:
+            infile.seek(self.offset)
+            binary = infile.read(nbytes)
+
+        if len(binary) < nbytes:
+            raise OSError(f'Size spec in ADSC-header does not match size of image data field in {self.fname}')
+
+        data = np.frombuffer(binary, dtype=self.dtype).reshape(nrows, ncols)
+        if roi is not None:
+            data = data[roi]
+        return data.astype(np.uint16)
+
+    def smv_header(self) -> dict:
+        return dict(self.header)
+
+
+@register_reader('.tif', '.tiff')
+class TiffFile:
+    """TIFF image, read with the optional `tifffile` package. Uncompressed
+    images are memory-mapped."""
+
+    def __init__(self, fname):
+        if tifffile is None:
+            raise ImportError("Reading TIFF files requires the `tifffile` package (pip install tifffile)")
+        self.fname = Path(fname)
+        with tifffile.TiffFile(self.fname) as tif:
+            page = tif.pages[0]
+            self.shape = page.shape
+            self.header = {tag.name: tag.value for tag in page.tags.values()
+                           if isinstance(tag.value, (int, float, str))}
+
+    def read(self, roi=None) -> np.ndarray:
+        try:
+            data = tifffile.memmap(self.fname, mode='r')
+        except ValueError:  # compressed or not contiguous
+            data = tifffile.imread(self.fname)
+        if roi is not None:
+            data = data[roi]
+        return np.array(data)
+
+    def smv_header(self) -> dict:
+        return {'DIM': 2, 'BYTE_ORDER': 'little_endian', 'TYPE': 'unsigned_short'}
+
+
+CBF_BINARY_START = b'\x0c\x1a\x04\xd5'
+
+
+def decode_byte_offset(binary: bytes, size: int = None) -> np.ndarray:
+    """Decode a CBF 'x-CBF_BYTE_OFFSET' compressed buffer.
+
+    Each value is stored as the difference to the previous one in a signed
+    byte. The escape value 0x80 announces a 16-bit difference, whose escape
+    0x8000 announces a 32-bit difference (and 0x80000000 a 64-bit one). The
+    loop only runs over the escapes, the single-byte differences (the vast
+    majority) are handled with array operations.
+    """
+    raw = np.frombuffer(binary, dtype=np.uint8)
+    deltas = raw.view(np.int8).astype(np.int64)
+    keep = np.ones(len(raw), dtype=bool)
+
+    skip_until = 0
+    for pos in np.flatnonzero(raw == 0x80):
+        if pos < skip_until:
+            continue  # part of the payload of a previous escape
+        end = pos + 3
+        value = int.from_bytes(binary[pos+1:end], 'little', signed=True)
+        if value == -0x8000:
+            end = pos + 7
+            value = int.from_bytes(binary[pos+3:end], 'little', signed=True)
+            if value == -0x80000000:
+                end = pos + 15
+                value = int.from_bytes(binary[pos+7:end], 'little', signed=True)
+        deltas[pos] = value
+        keep[pos+1:end] = False
+        skip_until = end
+
+    data = np.cumsum(deltas[keep])
+    if size is not None:
+        data = data[:size]
+    return data
+
+
+@register_reader('.cbf')
+class CBFFile:
+    """CBF image with byte offset compression (e.g. Pilatus/Eiger mini-CBF)."""
+
+    def __init__(self, fname):
+        self.fname = Path(fname)
+        with open(self.fname, 'rb') as infile:
+            content = infile.read()
+
+        start = content.find(CBF_BINARY_START)
+        if start < 0:
+            raise OSError(f'No binary section found in {self.fname}')
+
+        text = content[:start].decode(errors='replace')
+        if 'x-CBF_BYTE_OFFSET' not in text:
+            raise OSError(f'Only byte offset compression is supported: {self.fname}')
+
+        self.header = {}
+        for key, val in re.findall(r'^\s*([\w-]+):\s*(.+?)\s*$', text, flags=re.MULTILINE):
+            self.header[key] = val.strip('"')
+
+        self.shape = (int(self.header['X-Binary-Size-Second-Dimension']),
+                      int(self.header['X-Binary-Size-Fastest-Dimension']))
+        nbytes = int(self.header['X-Binary-Size'])
+        self._binary = content[start+4:start+4+nbytes]
+
+    def read(self, roi=None) -> np.ndarray:
+        nrows, ncols = self.shape
+        size = nrows * ncols
+        data = decode_byte_offset(self._binary, size=size)
+        if len(data) != size:
+            raise OSError(f'Size spec in CBF header does not match size of image data field in {self.fname}')
+        data = data.astype(np.int32).reshape(self.shape)
+        if roi is not None:
+            data = data[roi].copy()
+        return data
+
+    def smv_header(self) -> dict:
+        return {'DIM': 2, 'BYTE_ORDER': 'little_endian', 'TYPE': 'unsigned_short'}
+
+
+def read_adsc(fname: str, roi=None) -> (np.array, dict):
+    """read in the file.
+
+    roi: optional tuple of slices (rows, columns) to read only part of the image
+    """
+    smv = SMVFile(fname)
+    return smv.read(roi=roi), smv.header
+
+
+def write_adsc(fname: str, data: np.array, header: dict = {}):
+    """Write adsc format."""
+    if 'SIZE1' not in header and 'SIZE2' not in header:
+        dim2, dim1 = data.shape
+        header['SIZE1'] = dim1
+        header['SIZE2'] = dim2
+
+    out = b'{\n' + ''.join(f'{key}={val};\n' for key, val in header.items()).encode()
+    if 'HEADER_BYTES' in header:
+        pad = int(header['HEADER_BYTES']) - len(out) - 2
+    else:
+        #         hsize = ((len(out) + 23) // 512 + 1) * 512
+        hsize = (len(out) + 533) & ~(512 - 1)
+        out += f'HEADER_BYTES={hsize:d};\n'.encode()
+        pad = hsize - len(out) - 2
+    out += b'}' + (pad + 1) * b'\x00'
+    assert len(out) % 512 == 0, 'Header is not multiple of 512'
+
+    # NOTE: XDS can handle only "SMV" images of TYPE=unsigned_short.
+    dtype = np.dtype(np.uint16)
+    if swap_needed(header):
+        dtype = dtype.newbyteorder()
+    if data.dtype.kind == 'f':
+        data = np.round(data, 0)
+    if data.dtype != np.uint16:
+        data = np.clip(data, 0, np.iinfo(np.uint16).max)
+    data = data.astype(dtype, copy=False)  # copy=False ensures that no copy is made if dtype is already satisfied
+
+    # header and data go out in a single write
+    with open(fname, 'wb') as outf:
+        outf.write(out + data.tobytes())
@@ -6,6 +6,7 @@ import numpy as np
 import yaml
 from collections import Counter
 from .utils import space_group_lib
+from .hkl_io import read_header
 
 platform = sys.platform
 
@@ -16,19 +17,10 @@ threshold = 2.0
 
 def parse_xds_ascii(fn):
     d = {"xds_ascii": fn.absolute()}
-    with open(fn, "r") as f:
-        for line in f:
-            if not line.startswith("!"):
-                break
-            if "UNIT_CELL_CONSTANTS" in line:
-                inp = line.split()
-                cell = [float(val) for val in inp[-6:]]
-            if "SPACE_GROUP_NUMBER" in line:
-                inp = line.strip().split("=")
-                spgr = int(inp[-1])
-
-        d["space_group"] = spgr
-        d["unit_cell"] = cell
+    header, _ = read_header(fn)
+
+    d["space_group"] = int(header["SPACE_GROUP_NUMBER"])
+    d["unit_cell"] = [float(val) for val in header["UNIT_CELL_CONSTANTS"]]
     
     return d
 
@@ -0,0 +1,70 @@
+import numpy as np
+from scipy import ndimage
+
+
+def subpixel_offset(c_m: np.ndarray, c_0: np.ndarray, c_p: np.ndarray, method: str = "gaussian") -> np.ndarray:
+    """Closed-form sub-pixel offset of a peak from three equidistant samples
+    at -1, 0, +1 around the maximum `c_0`.
+
+    method: `parabolic` fits a parabola through the samples, `gaussian` fits
+        a parabola through their logarithm (exact for gaussian peaks)
+
+    Returns the offset in the range [-0.5, 0.5].
+    """
+    c_m, c_0, c_p = (np.asarray(c, dtype=float) for c in (c_m, c_0, c_p))
+    if method == "gaussian":
+        tiny = np.finfo(float).tiny
+        c_m, c_0, c_p = (np.log(np.maximum(c, tiny)) for c in (c_m, c_0, c_p))
+    elif method != "parabolic":
+        raise ValueError(f"Unknown method: {method!r}")
+
+    denom = c_m - 2 * c_0 + c_p
+    with np.errstate(divide='ignore', invalid='ignore'):
+        offset = 0.5 * (c_m - c_p) / denom
+    offset = np.where(np.isfinite(offset), offset, 0.0)
+    return np.clip(offset, -0.5, 0.5)
+
+
+def find_peak_positions(profiles: np.ndarray, sigma: float = 0, method: str = "gaussian", w: int = 10) -> np.ndarray:
+    """Find the position of the maximum of many 1D profiles at once with
+    sub-pixel precision.
+
+    profiles: array of shape (n, length), or (length,) for a single profile
+    sigma: standard deviation of the gaussian filter applied along each
+        profile first (0 = no smoothing)
+    method: `gaussian` or `parabolic` for a 3-point fit around the maximum
+        (see `subpixel_offset`), or `centroid` for the intensity-weighted
+        centroid in a window of 2*w+1 pixels around the maximum
+    w: half width of the centroid window
+
+    If the maximum is on the edge of a profile, its integer position is returned.
+    """
+    profiles = np.asarray(profiles, dtype=float)
+    single = profiles.ndim == 1
+    y = np.atleast_2d(profiles)
+
+    if sigma:
+        y = ndimage.gaussian_filter1d(y, sigma, axis=-1)
+
+    n, length = y.shape
+    idx = np.arange(n)
+    c1 = y.argmax(axis=-1)
+
+    if method == "centroid":
+        offsets = np.arange(-w, w + 1)
+        cols = c1[:, None] + offsets
+        valid = (cols >= 0) & (cols < length)
+        win = y[idx[:, None], np.clip(cols, 0, length - 1)]
+        win = np.where(valid, win - win.min(axis=1, keepdims=True), 0.0)
+        total = win.sum(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            shift = (win * offsets).sum(axis=1) / total
+        shift = np.where(total > 0, shift, 0.0)
+    else:
+        inner = (c1 > 0) & (c1 < length - 1)
+        c_m = y[idx, np.clip(c1 - 1, 0, length - 1)]
+        c_p = y[idx, np.clip(c1 + 1, 0, length - 1)]
+        shift = np.where(inner, subpixel_offset(c_m, y[idx, c1], c_p, method=method), 0.0)
+
+    pos = c1 + shift
+    return pos[0] if single else pos
@@ -0,0 +1,355 @@
+from concurrent.futures import ProcessPoolExecutor
+from collections import Counter
+from functools import partial
+from pathlib import Path
+import os
+import numpy as np
+import pandas as pd
+
+from .geometry import distance_to_rotation_axis
+from .hkl_io import read_xds_hkl, read_shelx_hkl, write_shelx_hkl, INTEGRATE_COLUMNS
+from .reflection_ops import d_spacings, group_reflections, split_groups, scale_intensities, symmetry_rotations
+
+# same defaults as the variables of `reflection_tool.GroupReflectionsGUI`
+DEFAULTS = {
+    "img_size": 512,
+    "center": (256.0, 256.0),
+    "slope": 0.0,
+    "lorentz_corr": True,
+    "prec_angle": 1.2,
+    "wavelength": 0.01968,
+    "cell": (10.0, 10.0, 10.0, 90.0, 90.0, 90.0),
+    "space_group": "",
+    "ratio": 0.5,
+    "scale_iobs": False,
+    "power": 1.5,
+    "save_smaller": False,
+}
+
+
+def read_reflections(fn) -> pd.DataFrame:
+    """Read SHELX HKLF 4 file `fn` into a DataFrame with the columns H, K,
+    L, I, sigma."""
+    hkl = read_shelx_hkl(fn)
+    return pd.DataFrame({"H": hkl["H"], "K": hkl["K"], "L": hkl["L"], "I": hkl["I"], "sigma": hkl["SIGMA"]})
+
+
+def save_reflections(df, fn, decimals: int = 2, terminate: bool = True) -> None:
+    """Write `df` (columns H, K, L, I, sigma) to `fn`, as CSV if the file
+    name ends with `.csv`, otherwise as SHELX HKLF 4."""
+    if str(fn).lower().endswith(".csv"):
+        df.to_csv(fn)
+    else:
+        write_shelx_hkl(fn, df[["H", "K", "L"]].to_numpy(), df["I"], df["sigma"],
+                        decimals=decimals, terminate=terminate)
+
+
+def integrate_geometry(header: dict) -> dict:
+    """Image size, beam center and slope of the rotation axis from the
+    header of INTEGRATE.HKL (only the values that are present)."""
+    d = {}
+    if "NX" in header:
+        d["img_size"] = int(header["NX"])
+    if "ORGX" in header and "ORGY" in header:
+        d["center"] = (float(header["ORGX"]), float(header["ORGY"]))
+    if "ROTATION_AXIS" in header:
+        d["slope"] = float(np.tan(np.arccos(-float(header["ROTATION_AXIS"][0]))))
+    return d
+
+
+def transform_integrated(fn, img_size: int = None, center=None, slope: float = None,
+                         lorentz_corr: bool = DEFAULTS["lorentz_corr"]) -> pd.DataFrame:
+    """Convert INTEGRATE.HKL `fn` to intensities (IOBS / RLP / 10), with the
+    Lorentz correction from the distance to the rotation axis if
+    `lorentz_corr`. The image size, center and slope are taken from the
+    header, unless given."""
+    df, header = read_xds_hkl(fn, columns=INTEGRATE_COLUMNS, as_frame=True)
+    geometry = {key: DEFAULTS[key] for key in ("img_size", "center", "slope")}
+    geometry.update(integrate_geometry(header))
+    img_size = geometry["img_size"] if img_size is None else img_size
+    center = geometry["center"] if center is None else center
+    slope = geometry["slope"] if slope is None else slope
+
+    intensity = df["IOBS"] / df["RLP"] / 10
+    sigma = df["SIGMA"] / df["RLP"] / 10
+    if lorentz_corr:
+        factor = distance_to_rotation_axis(df["XOBS"], df["YOBS"], center, [slope, 1]) / img_size
+        intensity = intensity * factor
+        sigma = sigma * factor
+
+    return pd.DataFrame({"H": df["H"], "K": df["K"], "L": df["L"], "I": intensity, "sigma": sigma})
+
+
+def remove_zero_indices(fn) -> pd.DataFrame:
+    """Remove the reflections with a zero index (h, k or l) from `fn`."""
+    df = read_reflections(fn)
+    return df[(df["H"] != 0) & (df["K"] != 0) & (df["L"] != 0)]
+
+
+def precession_correction(fn, cell=DEFAULTS["cell"], prec_angle: float = DEFAULTS["prec_angle"],
+                          wavelength: float = DEFAULTS["wavelength"]) -> pd.DataFrame:
+    """Correct precession intensities in `fn` (Lorentz factor for the
+    precession angle `prec_angle` in degrees), see Daliang Zhang's paper for
+    the formula."""
+    df = read_reflections(fn)
+    d = d_spacings(df[["H", "K", "L"]].to_numpy(), cell)
+    angle = np.radians(prec_angle)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        factor = (1 / d) * np.sqrt(((1 / wavelength) * np.sin(angle))**2 - (1 / d / 2)**2) * wavelength / 2
+    df["d_spacings"] = d
+    df["I"] = df["I"] * factor
+    df["sigma"] = df["sigma"] * factor
+    return df
+
+
+def group_equivalents(fn, space_group: str) -> pd.DataFrame:
+    """Group the symmetry-equivalent reflections in `fn`, see
+    `reflection_ops.group_reflections`."""
+    df = read_reflections(fn)
+    merged = group_reflections(df[["H", "K", "L"]].to_numpy(), df["I"], df["sigma"], symmetry_rotations(space_group))
+    return merged.rename(columns={"SIGMA": "sigma"})
+
+
+def split_equivalents(fn, space_group: str, ratio: float = DEFAULTS["ratio"],
+                      scale_iobs: bool = DEFAULTS["scale_iobs"], power: float = DEFAULTS["power"],
+                      save_smaller: bool = DEFAULTS["save_smaller"]) -> pd.DataFrame:
+    """Split every group of symmetry-equivalent reflections in `fn` in the
+    weakest `ratio` and the rest. Returns the strong part (scaled with
+    `power` if `scale_iobs`), or the weak part if `save_smaller`."""
+    merged = group_equivalents(fn, space_group)
+    larger = split_groups(merged["GROUP"].to_numpy(), ratio)
+
+    if save_smaller:
+        return merged[~larger]
+
+    selected = merged[larger].copy()
+    if scale_iobs:
+        selected["I"], selected["sigma"] = scale_intensities(selected["I"], selected["sigma"], power)
+    return selected
+
+
+# operation -> function, options for `save_reflections`
+OPERATIONS = {
+    "transform": (transform_integrated, {"decimals": 1, "terminate": False}),
+    "remove_zero": (remove_zero_indices, {}),
+    "precession": (precession_correction, {}),
+    "group": (group_equivalents, {}),
+    "split": (split_equivalents, {}),
+}
+
+
+def output_name(fn, operation: str, fmt: str = "hkl", outdir=None, suffix: str = None,
+                prefix: str = "") -> Path:
+    """Output file for input `fn`: `{stem}_{operation}.{fmt}` next to the
+    input file (or in `outdir`)."""
+    fn = Path(fn)
+    suffix = f"_{operation}" if suffix is None else suffix
+    drc = Path(outdir) if outdir else fn.parent
+    return drc / f"{prefix}{fn.stem}{suffix}.{fmt}"
+
+
+def output_names(fns, operation: str, fmt: str = "hkl", outdir=None, suffix: str = None) -> list:
+    """Output files for all input files `fns`, see `output_name`. If names
+    collide (e.g. `*/SMV/INTEGRATE.HKL` with `outdir`), the path of the
+    directory relative to the common parent of all inputs is added to the
+    name (`e1_SMV_INTEGRATE_transform.hkl`).
+
+    Raises ValueError if the names are still not unique.
+    """
+    outs = [output_name(fn, operation, fmt=fmt, outdir=outdir, suffix=suffix) for fn in fns]
+    if len(set(outs)) < len(outs):
+        parents = [Path(fn).resolve().parent for fn in fns]
+        common = Path(os.path.commonpath(parents))
+        outs = [output_name(fn, operation, fmt=fmt, outdir=outdir, suffix=suffix,
+                            prefix="".join(f"{part}_" for part in parent.relative_to(common).parts))
+                for fn, parent in zip(fns, parents)]
+
+    duplicates = sorted(str(out) for out, n in Counter(outs).items() if n > 1)
+    if duplicates:
+        raise ValueError(f"Output file names are not unique: {', '.join(duplicates)}")
+    return outs
+
+
+def process(operation: str, fn, out=None, **kwargs) -> Path:
+    """Run `operation` (see `OPERATIONS`) on file `fn` and write the result
+    to `out` (default: `output_name`). `kwargs` are passed to the function
+    of the operation. Returns the output file name."""
+    func, save_kwargs = OPERATIONS[operation]
+    out = out or output_name(fn, operation)
+    df = func(fn, **kwargs)
+    save_reflections(df, out, **save_kwargs)
+    return Path(out)
+
+
+def _process_one(args, operation, kwargs):
+    fn, out = args
+    try:
+        return fn, process(operation, fn, out, **kwargs), None
+    except Exception as e:
+        return fn, None, e
+
+
+def process_many(operation: str, fns, n_jobs: int = 1, fmt: str = "hkl", outdir=None,
+                 suffix: str = None, **kwargs) -> list:
+    """Run `operation` on all files `fns` on a pool of `n_jobs` worker
+    processes.
+
+    Returns a list of (input file, output file, exception) for every file,
+    the exception is None if the file was processed successfully.
+    """
+    outs = output_names(fns, operation, fmt=fmt, outdir=outdir, suffix=suffix)
+    jobs = list(zip(fns, outs))
+    func = partial(_process_one, operation=operation, kwargs=kwargs)
+    if n_jobs == 1:
+        return [func(job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        return list(executor.map(func, jobs))
+
+
+def main():
+    import argparse
+
+    description = """Apply the reflection_tool operations to many files without the GUI.
+
+Operations:
+  transform    INTEGRATE.HKL -> SHELX hkl, intensities corrected for RLP and the distance to the rotation axis
+  remove_zero  remove reflections with a zero index
+  precession   correct precession intensities (needs --cell)
+  group        group symmetry-equivalent reflections (needs --spgr)
+  split        keep the strongest part of every group of equivalents (needs --spgr)
+"""
+    parser = argparse.ArgumentParser(description=description,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    parser.add_argument("operation",
+                        type=str, choices=list(OPERATIONS), metavar="OPERATION",
+                        help="Operation to apply: " + ", ".join(OPERATIONS))
+
+    parser.add_argument("args",
+                        type=str, nargs="+", metavar="FILE",
+                        help="Input files (INTEGRATE.HKL for `transform`, SHELX hkl files otherwise)")
+
+    parser.add_argument("-j", "--jobs",
+                        action="store", type=int, dest="n_jobs",
+                        help="Number of files to process in parallel (default: 1)")
+
+    parser.add_argument("-o", "--outdir",
+                        action="store", type=str, dest="outdir",
+                        help="Directory for the output files (default: next to the input file)")
+
+    parser.add_argument("--suffix",
+                        action="store", type=str, dest="suffix",
+                        help="Added to the name of the input file (default: _OPERATION)")
+
+    parser.add_argument("-f", "--format",
+                        action="store", type=str, dest="fmt", choices=["hkl", "csv"],
+                        help="Output format (default: hkl)")
+
+    parser.add_argument("--size",
+                        action="store", type=int, dest="img_size",
+                        help="transform: image size (default: NX from the header, or 512)")
+
+    parser.add_argument("--center",
+                        action="store", type=float, nargs=2, dest="center", metavar=("X", "Y"),
+                        help="transform: beam center (default: ORGX/ORGY from the header, or 256 256)")
+
+    parser.add_argument("--slope",
+                        action="store", type=float, dest="slope",
+                        help="transform: slope of the rotation axis (default: from ROTATION_AXIS in the header, or 0)")
+
+    parser.add_argument("--no-lorentz",
+                        action="store_false", dest="lorentz_corr",
+                        help="transform: do not apply the Lorentz correction")
+
+    parser.add_argument("--prec-angle",
+                        action="store", type=float, dest="prec_angle",
+                        help=f"precession: precession angle in degrees (default: {DEFAULTS['prec_angle']})")
+
+    parser.add_argument("-w", "--wavelength",
+                        action="store", type=float, dest="wavelength",
+                        help=f"precession: wavelength in Ångström (default: {DEFAULTS['wavelength']})")
+
+    parser.add_argument("-c", "--cell",
+                        action="store", type=float, nargs=6, dest="cell", metavar=("a", "b", "c", "al", "be", "ga"),
+                        help="precession: unit cell")
+
+    parser.add_argument("-s", "--spgr",
+                        action="store", type=str, dest="space_group",
+                        help="group/split: space group")
+
+    parser.add_argument("-r", "--ratio",
+                        action="store", type=float, dest="ratio",
+                        help=f"split: fraction of the weakest reflections in every group to remove (default: {DEFAULTS['ratio']})")
+
+    parser.add_argument("--scale",
+                        action="store_true", dest="scale_iobs",
+                        help="split: scale the remaining intensities with (1 + I)**power")
+
+    parser.add_argument("--power",
+                        action="store", type=float, dest="power",
+                        help=f"split: power for --scale (default: {DEFAULTS['power']})")
+
+    parser.add_argument("--smaller",
+                        action="store_true", dest="save_smaller",
+                        help="split: keep the weakest part instead")
+
+    parser.set_defaults(n_jobs=1,
+                        outdir=None,
+                        suffix=None,
+                        fmt="hkl",
+                        img_size=None,
+                        center=None,
+                        slope=None,
+                        lorentz_corr=DEFAULTS["lorentz_corr"],
+                        prec_angle=DEFAULTS["prec_angle"],
+                        wavelength=DEFAULTS["wavelength"],
+                        cell=None,
+                        space_group=None,
+                        ratio=DEFAULTS["ratio"],
+                        scale_iobs=DEFAULTS["scale_iobs"],
+                        power=DEFAULTS["power"],
+                        save_smaller=DEFAULTS["save_smaller"])
+
+    options = parser.parse_args()
+    operation = options.operation
+
+    if operation == "transform":
+        kwargs = {"img_size": options.img_size, "center": options.center, "slope": options.slope,
+                  "lorentz_corr": options.lorentz_corr}
+    elif operation == "remove_zero":
+        kwargs = {}
+    elif operation == "precession":
+        if not options.cell:
+            parser.error("precession needs the unit cell (--cell)")
+        kwargs = {"cell": options.cell, "prec_angle": options.prec_angle, "wavelength": options.wavelength}
+    else:
+        if not options.space_group:
+            parser.error(f"{operation} needs the space group (--spgr)")
+        kwargs = {"space_group": options.space_group}
+        if operation == "split":
+            kwargs.update(ratio=options.ratio, scale_iobs=options.scale_iobs, power=options.power,
+                          save_smaller=options.save_smaller)
+
+    if options.outdir:
+        Path(options.outdir).mkdir(parents=True, exist_ok=True)
+
+    fns = [Path(arg) for arg in options.args]
+    try:
+        results = process_many(operation, fns, n_jobs=options.n_jobs, fmt=options.fmt,
+                               outdir=options.outdir, suffix=options.suffix, **kwargs)
+    except ValueError as e:
+        parser.error(str(e))
+
+    n_failed = 0
+    for fn, out, error in results:
+        if error is None:
+            print(f"{fn} -> {out}")
+        else:
+            n_failed += 1
+            print(f"{fn}: ERROR: {error}")
+
+    print(f"\n{len(results) - n_failed} of {len(results)} files processed.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,198 @@
+import numpy as np
+import pandas as pd
+
+try:
+    from cctbx import sgtbx
+except ImportError:
+    sgtbx = None
+
+
+def hkl_keys(hkl, bound: int = None) -> (np.ndarray, np.ndarray):
+    """Encode the miller indices `hkl` (N x 3 integer array) as a single
+    int64 key per reflection. Returns the keys of `hkl` and of the Friedel
+    mates `-hkl`, so that `keys[j] == neg_keys[i]` if reflection j is the
+    Friedel mate of reflection i."""
+    hkl = np.asarray(hkl, dtype=np.int64).reshape(-1, 3)
+    if bound is None:
+        bound = int(np.abs(hkl).max()) if len(hkl) else 0
+    base = 2 * bound + 1
+
+    def encode(h, k, l):
+        return ((h + bound) * base + (k + bound)) * base + (l + bound)
+
+    h, k, l = hkl.T
+    return encode(h, k, l), encode(-h, -k, -l)
+
+
+def friedel_pairs(hkl) -> (np.ndarray, np.ndarray, np.ndarray):
+    """Find the Friedel mate of every reflection among the reflections that
+    come after it in `hkl` (e.g. sorted by frame number).
+
+    Matching is done with a sort on (key, position) and `np.searchsorted`,
+    O(N log N) instead of comparing every pair.
+
+    Returns:
+        first: index of every reflection with exactly one later Friedel mate
+        second: index of that mate
+        n_mates: number of later Friedel mates of every reflection
+    """
+    keys, neg_keys = hkl_keys(hkl)
+    n = len(keys)
+    pos = np.arange(n, dtype=np.int64)
+
+    # combined key, sorts by hkl and then by position in the list
+    combined = keys * n + pos
+    order = np.argsort(combined, kind="stable")
+    combined = combined[order]
+
+    start = np.searchsorted(combined, neg_keys * n + pos, side="right")
+    stop = np.searchsorted(combined, neg_keys * n + n, side="left")
+    n_mates = np.maximum(stop - start, 0)
+
+    first = np.flatnonzero(n_mates == 1)
+    second = order[start[first]]
+    return first, second, n_mates
+
+
+def friedel_differences(iobs, hkl, frames=None) -> (float, pd.DataFrame, np.ndarray):
+    """Intensity differences I(hkl) - I(-hkl) between every reflection and
+    its later Friedel mate (see `friedel_pairs`).
+
+    iobs: intensities
+    hkl: miller indices (N x 3), in the order of observation
+    frames: frame number of every reflection (e.g. ZOBS), used to collect
+        the statistics per frame of the first reflection of the pair
+
+    Returns the accumulated difference, a DataFrame with the number of
+    pairs, the sum and the mean of the differences per frame, and the
+    `n_mates` array from `friedel_pairs`.
+    """
+    iobs = np.asarray(iobs, dtype=float)
+    first, second, n_mates = friedel_pairs(hkl)
+    diff = iobs[first] - iobs[second]
+
+    if frames is None:
+        frames = np.zeros(len(iobs))
+    frame = np.floor(np.asarray(frames, dtype=float)[first]).astype(np.int64)
+
+    stats = pd.DataFrame({"frame": frame, "diff": diff}).groupby("frame")["diff"].agg(["count", "sum", "mean"])
+    stats.columns = ["n_pairs", "diff_sum", "diff_mean"]
+
+    return diff.sum(), stats, n_mates
+
+
+def symmetry_rotations(space_group_symbol: str) -> np.ndarray:
+    """Rotation matrices (n_ops x 3 x 3 integer array) of the symmetry
+    operators of the space group, from cctbx."""
+    if sgtbx is None:
+        raise ImportError("cctbx is needed to look up the symmetry operators")
+    group = sgtbx.space_group_info(symbol=space_group_symbol).group()
+    rotations = []
+    for op in group.all_ops():
+        r = op.r()
+        rotations.append(np.array(r.num(), dtype=np.int64).reshape(3, 3) // r.den())
+    return np.unique(np.array(rotations), axis=0)
+
+
+def asu_representatives(hkl, rotations, anomalous: bool = False, chunk: int = 100000) -> np.ndarray:
+    """Map every miller index in `hkl` (N x 3) to a representative of its
+    set of symmetry equivalents, `h R` for all rotations `R` (and the Friedel
+    mates `-h R` unless `anomalous`). The representative is the equivalent
+    with the largest (h, k, l), so all equivalents map to the same index.
+
+    The equivalents are generated with one integer matrix product over all
+    reflections, in chunks of `chunk` reflections to limit the memory use.
+    """
+    hkl = np.asarray(hkl, dtype=np.int64).reshape(-1, 3)
+    rotations = np.asarray(rotations, dtype=np.int64).reshape(-1, 3, 3)
+    if not anomalous:
+        rotations = np.concatenate([rotations, -rotations])
+
+    out = np.empty_like(hkl)
+    for start in range(0, len(hkl), chunk):
+        block = hkl[start:start + chunk]
+        equivalents = np.einsum("nj,oji->noi", block, rotations)
+        keys, _ = hkl_keys(equivalents.reshape(-1, 3))
+        best = keys.reshape(len(block), -1).argmax(axis=1)
+        out[start:start + chunk] = equivalents[np.arange(len(block)), best]
+    return out
+
+
+def group_reflections(hkl, intensity, sigma, rotations, anomalous: bool = False) -> pd.DataFrame:
+    """Group symmetry-equivalent reflections.
+
+    Multiple observations of the same hkl are averaged first. Returns a
+    DataFrame with the columns H, K, L, I, SIGMA, the representative of the
+    group (H2, K2, L2, see `asu_representatives`) and the group number
+    GROUP. The rows are sorted by group, and by intensity within a group
+    (one `np.lexsort`).
+    """
+    hkl = np.asarray(hkl, dtype=np.int64).reshape(-1, 3)
+    intensity = np.asarray(intensity, dtype=float)
+    sigma = np.asarray(sigma, dtype=float)
+
+    # average duplicate observations
+    keys, _ = hkl_keys(hkl)
+    _, first, inverse, counts = np.unique(keys, return_index=True, return_inverse=True, return_counts=True)
+    inverse = inverse.ravel()
+    hkl = hkl[first]
+    intensity = np.bincount(inverse, weights=intensity) / counts
+    sigma = np.bincount(inverse, weights=sigma) / counts
+
+    representative = asu_representatives(hkl, rotations, anomalous=anomalous)
+    group_keys, _ = hkl_keys(representative)
+    _, group = np.unique(group_keys, return_inverse=True)
+    group = group.ravel()
+
+    order = np.lexsort((intensity, group))
+    return pd.DataFrame({
+        "H": hkl[order, 0], "K": hkl[order, 1], "L": hkl[order, 2],
+        "I": intensity[order], "SIGMA": sigma[order],
+        "H2": representative[order, 0], "K2": representative[order, 1], "L2": representative[order, 2],
+        "GROUP": group[order],
+    })
+
+
+def split_groups(group, ratio: float = 0.5) -> np.ndarray:
+    """Split every group in the lower `ratio` and the rest, for rows that
+    are sorted by group and by intensity within a group (as returned by
+    `group_reflections`). Returns a boolean array that is True for the
+    rows in the upper part (`x.iloc[int(size * ratio):]` for every group)."""
+    group = np.asarray(group)
+    _, start, counts = np.unique(group, return_index=True, return_counts=True)
+    index = np.searchsorted(group[start], group)
+    rank = np.arange(len(group)) - start[index]
+    cut = (counts * ratio).astype(np.int64)
+    return rank >= cut[index]
+
+
+def scale_intensities(intensity, sigma, power: float) -> (np.ndarray, np.ndarray):
+    """Scale the intensities with (1 + I)**power (and -(1 - I)**power for
+    negative intensities), and the sigmas with the derivative."""
+    intensity = np.asarray(intensity, dtype=float)
+    sigma = np.asarray(sigma, dtype=float)
+
+    def scaling_func(value, power):
+        return np.where(value > 0, (1 + np.abs(value)) ** power, -(1 + np.abs(value)) ** power)
+
+    sigma = sigma * power * scaling_func(intensity, power - 1)
+    intensity = scaling_func(intensity, power) * intensity
+    return intensity, sigma
+
+
+def d_spacings(hkl, cell) -> np.ndarray:
+    """d-spacings (Ångström) of the reflections `hkl` (N x 3) for unit cell
+    `cell` (a, b, c, alpha, beta, gamma), from the reciprocal metric
+    tensor."""
+    a, b, c, alpha, beta, gamma = cell
+    al, be, ga = np.radians([alpha, beta, gamma])
+    metric = np.array([
+        [a * a, a * b * np.cos(ga), a * c * np.cos(be)],
+        [a * b * np.cos(ga), b * b, b * c * np.cos(al)],
+        [a * c * np.cos(be), b * c * np.cos(al), c * c],
+    ])
+    reciprocal = np.linalg.inv(metric)
+    hkl = np.asarray(hkl, dtype=float).reshape(-1, 3)
+    inv_d2 = np.einsum("ni,ij,nj->n", hkl, reciprocal, hkl)
+    with np.errstate(divide="ignore"):
+        return 1 / np.sqrt(inv_d2)
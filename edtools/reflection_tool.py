@@ -1,6 +1,5 @@
 import numpy as np
 import pandas as pd
-from io import StringIO
 from tkinter import *
 from tkinter.ttk import *
 from tkinter import filedialog
@@ -8,8 +7,12 @@ from tkinter import filedialog
 from cctbx import crystal, miller
 from cctbx.array_family import flex
 import iotbx.cif as cif
-from iotbx.reflection_file_reader import any_reflection_file
 from .widgets import Spinbox, Hoverbox
+from .geometry import distance_to_rotation_axis
+from .hkl_io import read_header, read_xds_hkl, INTEGRATE_COLUMNS
+from .reflection_ops import friedel_differences
+from .reflection_batch import (integrate_geometry, transform_integrated, remove_zero_indices, precession_correction,
+                               group_equivalents, split_equivalents, save_reflections)
 
 class GroupReflectionsGUI(LabelFrame):
     """A GUI frame for reflections grouping"""
@@ -204,34 +207,16 @@ class GroupReflectionsGUI(LabelFrame):
             return False
 
     def remove_reflection(self):
-        self.unit_cell = (self.var_a.get(), self.var_b.get(), self.var_c.get(), self.var_alpha.get(), self.var_beta.get(), self.var_gamma.get())
-        self.space_group = self.var_space_group.get()
-        hkl = any_reflection_file(f"{self.file_name}=hklf4").as_miller_arrays(crystal.symmetry(unit_cell=self.unit_cell, space_group_symbol=self.space_group))[0]
-        hkl_df = pd.DataFrame(hkl,columns=('indice','I','sigma'))
-        filtered_df = hkl_df[hkl_df['indice'].apply(lambda x: x[0] != 0 and x[1] != 0 and x[2] != 0)]
+        filtered_df = remove_zero_indices(self.file_name)
         self.save_file(filtered_df)
 
     def corr_prec(self):
         # Correct precession intensities, see Daliang Zhang's paper for formula
         self.unit_cell = (self.var_a.get(), self.var_b.get(), self.var_c.get(), self.var_alpha.get(), self.var_beta.get(), self.var_gamma.get())
         self.space_group = self.var_space_group.get()
-        hkl = any_reflection_file(f"{self.file_name}=hklf4").as_miller_arrays(crystal.symmetry(unit_cell=self.unit_cell, space_group_symbol=self.space_group))[0]
-        hkl_df = pd.DataFrame(hkl,columns=('indice','I','sigma'))
-        d_spacings = hkl.d_spacings().data()
-        hkl_df['d_spacings'] = d_spacings
-        self.lorentz_corr(hkl_df)
+        hkl_df = precession_correction(self.file_name, self.unit_cell, self.var_prec_angle.get(), self.var_lambda.get())
         self.save_file(hkl_df)
 
-    def lorentz_corr(self, df):
-        angle = self.var_prec_angle.get() * np.pi / 180
-        wavelength = self.var_lambda.get()
-        factor = (1/df['d_spacings']) * np.sqrt(((1/wavelength)*np.sin(angle))**2 - (1/df['d_spacings']/2)**2) * wavelength / 2 
-        print(df)
-        print(factor)
-        df['I'] = df['I'] * factor
-        df['sigma'] = df['sigma'] * factor
-        print(df)
-
     def read_cif(self,f):
         #read a cif file  One cif file can contain multiple structures
         try:
@@ -331,7 +316,7 @@ class GroupReflectionsGUI(LabelFrame):
         Fcalc_DF.to_csv(self.var_save_name.get() + '.csv')
 
     def point_to_rotation_axis(self, x, y, center, slope):
-        return np.abs(-slope[0] * (x - center[0]) + slope[1] * (y - center[1])) / np.sqrt(slope[0]**2 + slope[1]**2)
+        return distance_to_rotation_axis(x, y, center, slope)
 
     def exti_corr(self, value, power, param):
         if value > 0:
@@ -346,29 +331,20 @@ class GroupReflectionsGUI(LabelFrame):
             return -power * param * self.exti_corr(value, power-1, param)
 
     def transform_integrated(self):
-        with open(self.file_name, 'r') as f:
-            contents = f.readlines()
-        header = contents[:32]
-        df = pd.read_csv(StringIO(''.join(contents[32:-1])), sep='\s+', names=['H','K','L','IOBS','SIGMA','XCAL','YCAL','ZCAL',
-                                        'RLP','PEAK','CORR','MAXC','XOBS','YOBS','ZOBS','ALF0','BET0','ALF1','BET1','PSI','ISEG'])
-
-        for line in header:
-            if 'NX' in line:
-                self.var_img_size.set(int(line.split()[1]))
-            if 'ORGX' in line:
-                split = line.split()
-                self.var_center_x.set(float(split[1]))
-                self.var_center_y.set(float(split[3]))
-            if 'ROTATION_AXIS' in line:
-                split = line.split()
-                self.var_slope.set(np.tan(np.arccos(-float(split[1]))))
-
-        df.loc[:, 'IOBS'] = df['IOBS'] / df['RLP'] / 10
-        df.loc[:, 'SIGMA'] = df['SIGMA'] / df['RLP'] / 10
-        if self.var_lorentz_corr.get():
-            factor = self.point_to_rotation_axis(df['XOBS'], df['YOBS'], [self.var_center_x.get(), self.var_center_y.get()], [self.var_slope.get(),1]) / self.var_img_size.get()
-            df.loc[:, 'IOBS'] = df['IOBS'] * factor
-            df.loc[:, 'SIGMA'] = df['SIGMA'] * factor
+        header, _ = read_header(self.file_name)
+        geometry = integrate_geometry(header)
+
+        if 'img_size' in geometry:
+            self.var_img_size.set(geometry['img_size'])
+        if 'center' in geometry:
+            self.var_center_x.set(geometry['center'][0])
+            self.var_center_y.set(geometry['center'][1])
+        if 'slope' in geometry:
+            self.var_slope.set(geometry['slope'])
+
+        df = transform_integrated(self.file_name, img_size=self.var_img_size.get(),
+                                  center=[self.var_center_x.get(), self.var_center_y.get()],
+                                  slope=self.var_slope.get(), lorentz_corr=self.var_lorentz_corr.get())
 
         if self.var_exti_corr.get():
             power = self.var_power.get()
@@ -378,9 +354,7 @@ class GroupReflectionsGUI(LabelFrame):
             #df.loc[:, 'IOBS'] = df.loc[:, 'IOBS'].apply(lambda x: self.exti_corr(x, power, exti)) * df.loc[:, 'IOBS']
 
 
-        with open(self.var_save_name.get() + '.hkl', 'w') as f:
-            for i in range(len(df)):
-                f.write(f"{df.loc[i, 'H']:4}{df.loc[i, 'K']:4}{df.loc[i, 'L']:4}{df.loc[i, 'IOBS']:8.1f}{df.loc[i, 'SIGMA']:8.1f}\n")
+        save_reflections(df, self.var_save_name.get() + '.hkl', decimals=1, terminate=False)
 
     def open_file(self):
         self.file_name = filedialog.askopenfilename(title='Select file', 
@@ -388,51 +362,19 @@ class GroupReflectionsGUI(LabelFrame):
         self.lb_file.config(text=self.file_name)
 
     def save_file(self, df):
-        filetype = self.var_appendix.get()
-        if filetype == ".csv":
-            df.to_csv(self.var_save_name.get()+self.var_appendix.get())
-        elif filetype == ".hkl":
-            ms = miller.set(crystal_symmetry=crystal.symmetry(space_group_symbol=self.space_group, unit_cell=self.unit_cell), anomalous_flag=False,
-               indices=flex.miller_index(list(df['indice'])))
-            ma = miller.array(ms, data=flex.double(list(df['I'].map(lambda x: round(x,2)))), 
-                  sigmas=flex.double(list(df['sigma'].map(lambda x: round(x,2)))))
-            with open(self.var_save_name.get()+filetype, 'w') as f:
-                ma.export_as_shelx_hklf(f)
+        save_reflections(df, self.var_save_name.get() + self.var_appendix.get())
 
     def group_df(self):
         self.unit_cell = (self.var_a.get(), self.var_b.get(), self.var_c.get(), self.var_alpha.get(), self.var_beta.get(), self.var_gamma.get())
         self.space_group = self.var_space_group.get()
-        hkl = any_reflection_file(f"{self.file_name}=hklf4").as_miller_arrays(crystal.symmetry(unit_cell=self.unit_cell, space_group_symbol=self.space_group))[0]
-        merge_eq_hkl = hkl.merge_equivalents().array()
-        merge_eq_hkl_indice = pd.DataFrame(merge_eq_hkl,columns=('indice2', 'I', 'sigma'))
-
-        df = pd.DataFrame(merge_eq_hkl.expand_to_p1(),columns=('indice1','I','sigma')).merge(merge_eq_hkl_indice,left_on='indice1',right_on='indice2',how='left')[['indice1','indice2']]
-        df = df.fillna(method='ffill')
-        df_fpair = pd.DataFrame(df['indice1'].apply(lambda x:(-x[0],-x[1],-x[2])))
-        df_fpair['indice2'] = df['indice2']
-        df = df.append(df_fpair)
-
-        hkl_df = pd.DataFrame(hkl,columns=('indice','I','sigma'))
-        hkl_df_no_dup = hkl_df.groupby('indice').mean().reset_index()
-
-        merged = hkl_df_no_dup.merge(df,left_on='indice',right_on='indice1',how='left')
-        merged = merged.sort_values('indice2').drop(['indice1'], axis=1)
-
-        return merged
+        return group_equivalents(self.file_name, self.space_group)
 
     def check_I_frame_seq(self):
         self.unit_cell = (self.var_a.get(), self.var_b.get(), self.var_c.get(), self.var_alpha.get(), self.var_beta.get(), self.var_gamma.get())
-        with open(self.file_name, 'r') as f:
-            contents = f.readlines()
-            header = contents[:32]
-            df = pd.read_csv(StringIO(''.join(contents[32:-1])), sep='\s+', names=['H','K','L','IOBS','SIGMA','XCAL','YCAL','ZCAL',
-                                'RLP','PEAK','CORR','MAXC','XOBS','YOBS','ZOBS','ALF0','BET0','ALF1','BET1','PSI','ISEG'])
-
-        for line in header:
-            if 'STARTING_ANGLE' in line:
-                start_angle = float(line[17:].strip())
-            elif 'OSCILLATION_RANGE' in line:
-                oscillation_angle = float(line[20:].strip())
+        df, header = read_xds_hkl(self.file_name, columns=INTEGRATE_COLUMNS, as_frame=True)
+
+        start_angle = float(header['STARTING_ANGLE'])
+        oscillation_angle = float(header['OSCILLATION_RANGE'])
         df['index'] = list(zip(df.H, df.K, df.L))
         df_sorted = df.sort_values('ZOBS')
         df_sorted = df_sorted.drop(columns=['H', 'K', 'L'])
@@ -442,79 +384,38 @@ class GroupReflectionsGUI(LabelFrame):
         num_frame =  end_frame - start_frame + 1
         start_angle = start_angle + start_frame * oscillation_angle
 
-        file = any_reflection_file(self.file_name).file_content()
-        intensity = flex.double(file.iobs)
-        sigma = flex.double(file.sigma)
+        intensity = flex.double(df['IOBS'].to_numpy())
+        sigma = flex.double(df['SIGMA'].to_numpy())
         miller_set = miller.set(crystal.symmetry(unit_cell=self.unit_cell, space_group_symbol=self.var_space_group.get()), 
-                                indices=flex.miller_index(file.hkl))
+                                indices=flex.miller_index(df[['H', 'K', 'L']].values.tolist()))
         hkl = miller.array(miller_set, data=intensity, sigmas=sigma)
         hkl = hkl.remove_systematic_absences()
         df_hkl = pd.DataFrame(list(hkl), columns=['index', 'intensity', 'sigma'])
         merged = df_sorted.merge(df_hkl)
         merged.to_csv('1.csv')
-        Iobs_diff_acc = 0
-
-        for i in range(len(merged) - 1):
-            Iobs_first = merged['IOBS'][i]
-            target = merged['index'][i]
-            target = list(target)
-            target[0] = -target[0]
-            target[1] = -target[1]
-            target[2] = -target[2]
-            target = tuple(target)
-            search = merged[i+1:]
-            result = search[search['index']==target]
-            result = result.reset_index(drop=True)
-            if len(result['IOBS']) == 1:
-                Iobs_second = result['IOBS'][0]
-                Iobs_diff_acc = Iobs_diff_acc + (Iobs_first - Iobs_second) 
-            elif len(result['IOBS']) > 1:
-                print('Two reflections at the same time?')
-
-        print(f'{target}: {Iobs_first}, {Iobs_second}')
-        print(f'start: {start_angle: .2f}, end: {start_angle + oscillation_angle*num_frame: .2f}, frame number: {num_frame}, oscillation: {oscillation_angle}')
-        print(f'The difference is {Iobs_diff_acc}.\n')
 
-    def scaling_factor(self, value, power):
-        if value > 0:
-            result =  value ** power
-        else:
-            result = (-value) ** power
-            result = - result
-        return result
+        hkl_merged = np.array(merged['index'].tolist(), dtype=np.int64).reshape(-1, 3)
+        Iobs_diff_acc, frame_stats, n_mates = friedel_differences(merged['IOBS'].to_numpy(), hkl_merged, merged['ZOBS'].to_numpy())
 
-    def scaling_func(self, value, power):
-        if value > 0:
-            result = (1 + value) ** power
-        else:
-            result  = -(1 - value) ** power
-        return result
+        n_ambiguous = np.count_nonzero(n_mates > 1)
+        if n_ambiguous:
+            print(f'Two reflections at the same time? ({n_ambiguous} reflections with more than one Friedel mate)')
+
+        print(frame_stats.to_string())
+        print(f'Friedel pairs: {frame_stats["n_pairs"].sum()}')
+        print(f'start: {start_angle: .2f}, end: {start_angle + oscillation_angle*num_frame: .2f}, frame number: {num_frame}, oscillation: {oscillation_angle}')
+        print(f'The difference is {Iobs_diff_acc}.\n')
 
     def save_grouped(self):
         merged = self.group_df()
         self.save_file(merged)
 
     def split_grouped(self):
-        merged = self.group_df()
-
-        merged_g = merged.groupby(['indice2'], group_keys=False)
-        merged_g_sorted = merged_g.apply(pd.DataFrame.sort_values, ['I'])
-
-        selected_g_larger = merged_g_sorted.groupby('indice2', group_keys=False).apply(lambda x: x.iloc[int(x.I.size*self.var_ratio.get()):])
-        selected_g_smaller = merged_g_sorted.groupby('indice2', group_keys=False).apply(lambda x: x.iloc[:int(x.I.size*self.var_ratio.get())])
-
-        if self.var_scale_iobs.get():
-            power = self.var_power.get()
-            #selected_g_larger['I'] = selected_g_larger['I'] / 400
-            #selected_g_larger['sigma'] = selected_g_larger['sigma'] / 400
-
-            selected_g_larger['sigma'] = selected_g_larger['sigma'] * selected_g_larger['I'].apply(lambda x: power*self.scaling_func(x, power-1))
-            selected_g_larger['I'] = selected_g_larger['I'].apply(lambda x: self.scaling_func(x, power)) * selected_g_larger['I']
-            
-        if self.var_save_smaller.get():
-            self.save_file(selected_g_smaller)
-        else:
-            self.save_file(selected_g_larger)
+        self.space_group = self.var_space_group.get()
+        selected = split_equivalents(self.file_name, self.space_group, ratio=self.var_ratio.get(),
+                                     scale_iobs=self.var_scale_iobs.get(), power=self.var_power.get(),
+                                     save_smaller=self.var_save_smaller.get())
+        self.save_file(selected)
 
 def main():
     root = Tk()
@@ -0,0 +1,141 @@
+from contextlib import contextmanager
+import os
+import threading
+import time
+
+
+def available_cores() -> int:
+    """Number of cores this process may run on."""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def available_memory() -> float:
+    """Available memory in GB (from /proc/meminfo), or None if unknown."""
+    try:
+        with open("/proc/meminfo", "r") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) / 1024**2
+    except OSError:
+        pass
+    return None
+
+
+class CoreAllocator:
+    """Assign a core budget to every concurrently running XDS job.
+
+    The number of jobs running at the same time (`limit`) is at most
+    `max_jobs`, and is further limited by the available memory if
+    `mem_per_job` (GB) is given. Every job gets `total_cores // limit` cores,
+    and with `affinity` a disjoint set of CPUs to pin the job to.
+
+    With `adaptive`, the limit starts halfway and is doubled or halved after
+    every window of completed jobs, for as long as the measured throughput
+    (frames per second over all jobs) improves. When it stops improving, the
+    best limit is kept.
+
+    Usage:
+        allocator = CoreAllocator(max_jobs=4)
+        with allocator.job(n_frames=100) as (cores, cpus):
+            ...
+    """
+
+    def __init__(self, max_jobs: int = 1, total_cores: int = None, affinity: bool = False,
+                 mem_per_job: float = None, adaptive: bool = False):
+        self.total_cores = total_cores or available_cores()
+        self.affinity = affinity and hasattr(os, "sched_setaffinity")
+
+        max_jobs = max(1, min(max_jobs, self.total_cores))
+        if mem_per_job:
+            memory = available_memory()
+            if memory:
+                max_jobs = max(1, min(max_jobs, int(memory // mem_per_job)))
+        self.max_jobs = max_jobs
+
+        self.adaptive = adaptive and max_jobs > 1
+        self.limit = max(1, max_jobs // 2) if self.adaptive else max_jobs
+
+        self.running = 0
+        self.condition = threading.Condition()
+
+        cpus = sorted(os.sched_getaffinity(0)) if self.affinity else []
+        self.free_cpus = cpus[:self.total_cores]
+
+        # adaptive state
+        self.direction = 2
+        self.previous = None
+        self.history = {}  # limit -> throughput
+        self.window_start = time.perf_counter()
+        self.window_frames = 0
+        self.window_jobs = 0
+
+    @property
+    def cores_per_job(self) -> int:
+        return max(1, self.total_cores // self.limit)
+
+    def acquire(self):
+        with self.condition:
+            while self.running >= self.limit:
+                self.condition.wait()
+            self.running += 1
+            cores = self.cores_per_job
+            cpus = None
+            if self.affinity and len(self.free_cpus) >= cores:
+                cpus, self.free_cpus = self.free_cpus[:cores], self.free_cpus[cores:]
+            return cores, cpus
+
+    def release(self, cpus=None, n_frames: int = 0) -> None:
+        with self.condition:
+            self.running -= 1
+            if cpus:
+                self.free_cpus = sorted(self.free_cpus + list(cpus))
+            if self.adaptive:
+                self._measure(n_frames)
+            self.condition.notify_all()
+
+    @contextmanager
+    def job(self, n_frames: int = 0):
+        """Context manager that yields (cores, cpus) for one job. `cpus` is
+        None unless affinity is enabled. `n_frames` is used to measure the
+        throughput for the adaptive limit."""
+        cores, cpus = self.acquire()
+        try:
+            yield cores, cpus
+        finally:
+            self.release(cpus, n_frames=n_frames)
+
+    def _measure(self, n_frames: int) -> None:
+        self.window_frames += max(n_frames, 1)
+        self.window_jobs += 1
+        if self.window_jobs < max(2, self.limit):
+            return
+
+        throughput = self.window_frames / (time.perf_counter() - self.window_start)
+        self.history[self.limit] = throughput
+
+        previous = self.previous
+        if previous is not None and throughput <= self.history[previous]:
+            # worse than the previous limit, go back (or try the other direction once)
+            new_limit = max(1, previous // 2)
+            if self.direction > 1 and len(self.history) == 2 and new_limit not in self.history:
+                self.direction = 0.5
+            else:
+                new_limit = previous
+                self.adaptive = False
+        else:
+            self.previous = self.limit
+            new_limit = min(self.max_jobs, max(1, int(self.limit * self.direction)))
+            if new_limit in self.history:
+                new_limit = self.limit
+                self.adaptive = False
+
+        if new_limit != self.limit:
+            print(f"Adjusting the number of concurrent jobs: {self.limit} -> {new_limit} "
+                  f"({throughput:.2f} frames/s at {self.limit} jobs)")
+        self.limit = new_limit
+
+        self.window_start = time.perf_counter()
+        self.window_frames = 0
+        self.window_jobs = 0
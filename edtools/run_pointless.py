@@ -1,7 +1,11 @@
+from concurrent.futures import ThreadPoolExecutor
+from collections import Counter
 from pathlib import Path
 import yaml
 import os
 from .cluster import run_pointless
+from . import cluster
+from . import runner
 
 
 def main():
@@ -14,10 +18,22 @@ def main():
     parser.add_argument("args",
                         type=str, nargs="*", metavar="FILE",
                         help="Path to a cells.yaml XDS_ASCII.HKL files")
+
+    parser.add_argument("-j", "--jobs",
+                        action="store", type=int, dest="n_jobs",
+                        help="Number of pointless jobs to run in parallel (default: 1)")
+
+    parser.add_argument("--no-cache",
+                        action="store_false", dest="use_cache",
+                        help="Always run pointless, do not use results from previous runs on the same input files")
+
+    parser.set_defaults(n_jobs=1,
+                        use_cache=True)
    
     options = parser.parse_args()
 
     args = options.args
+    cluster.cache.enabled = options.use_cache
 
     if not args:  # attempt to populate args
         if os.path.exists("cells.yaml"):
@@ -40,13 +56,20 @@ def main():
 
     print(f"{len(lst)} XDS_ASCII.HKL files found.\n")
 
-    ds = []
-    for i, fn in enumerate(lst):
-        print(fn)
-        print(f"Running pointless on data set #{i}\n")
-        d = run_pointless(fn)
+    # files in the same directory need their own pointless output files
+    n_per_drc = Counter(fn.parent for fn in lst)
+
+    def run(args):
+        i, fn = args
+        if n_per_drc[fn.parent] > 1:
+            d = run_pointless(fn, i=i, xmlout=f"{fn.stem}.pointless.xml", logfile=f"{fn.stem}.pointless.log")
+        else:
+            d = run_pointless(fn, i=i)
         d["filename"] = fn.name
-        ds.append(d)
+        return d
+
+    with runner.cancel_on_interrupt(), ThreadPoolExecutor(max_workers=options.n_jobs) as executor:
+        ds = list(executor.map(run, enumerate(lst)))
 
     print("  # Filename             Lauegr.  prob.  conf. - cell                                             | idx")
     for i, d in enumerate(ds):
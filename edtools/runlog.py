@@ -0,0 +1,125 @@
+from contextlib import nullcontext
+from pathlib import Path
+import json
+import os
+import threading
+import time
+
+XDSJOBS = ("XYCORR", "INIT", "COLSPOT", "IDXREF", "DEFPIX", "INTEGRATE", "CORRECT")
+
+
+def parse_lp_timing(fn) -> dict:
+    """Read the cpu and wall-clock time that XDS reports at the end of an
+    LP file. Returns a dict with `cpu` and `wall` in seconds (None if not
+    found)."""
+    d = {"cpu": None, "wall": None}
+    with open(fn, "rb") as f:
+        f.seek(0, 2)
+        f.seek(max(0, f.tell() - 2048))
+        for line in f.read().decode(errors="replace").splitlines():
+            line = line.strip()
+            if line.startswith("cpu time used"):
+                d["cpu"] = float(line.split()[3])
+            elif line.startswith("elapsed wall-clock time"):
+                d["wall"] = float(line.split()[3])
+    return d
+
+
+def step_timings(path, since: float = 0) -> dict:
+    """Collect the timing of every XDS step in `path` from the LP files that
+    were written after `since` (epoch seconds)."""
+    steps = {}
+    for job in XDSJOBS:
+        fn = (Path(path) / job).with_suffix(".LP")
+        try:
+            if fn.stat().st_mtime < since:
+                continue
+            steps[job] = parse_lp_timing(fn)
+        except (OSError, ValueError, IndexError):
+            continue
+    return steps
+
+
+def run_process(p, lock=None) -> dict:
+    """Wait for `subprocess.Popen` object `p`, and return the wall time,
+    and on POSIX the cpu time and peak memory of the process and its
+    children from `os.wait4`.
+
+    lock: the process is reaped (and `p.returncode` set) while holding
+        `lock`, so that other threads can check `p.returncode` and signal
+        the process under the same lock without hitting a reused pid
+    """
+    t0 = time.perf_counter()
+    stats = {}
+    if hasattr(os, "wait4"):
+        if lock is not None and hasattr(os, "waitid"):
+            # wait for the exit without reaping, the pid stays valid until `wait4`
+            os.waitid(os.P_PID, p.pid, os.WEXITED | os.WNOWAIT)
+        else:
+            lock = nullcontext()
+        with lock:
+            _, status, rusage = os.wait4(p.pid, 0)
+            p.returncode = os.waitstatus_to_exitcode(status) if hasattr(os, "waitstatus_to_exitcode") else status
+        stats["cpu_user"] = rusage.ru_utime
+        stats["cpu_sys"] = rusage.ru_stime
+        stats["max_rss_mb"] = rusage.ru_maxrss / 1024  # kB on Linux
+    else:
+        p.wait()
+    stats["wall"] = time.perf_counter() - t0
+    stats["returncode"] = p.returncode
+    return stats
+
+
+class RunLog:
+    """Append one JSON record per XDS run to `fn` (JSON lines), safe to use
+    from multiple threads."""
+
+    def __init__(self, fn):
+        self.fn = Path(fn)
+        self.lock = threading.Lock()
+
+    def record(self, **entry) -> None:
+        entry.setdefault("time", time.strftime("%Y-%m-%dT%H:%M:%S"))
+        line = json.dumps(entry, default=str)
+        with self.lock:
+            with open(self.fn, "a") as f:
+                print(line, file=f)
+
+    def read(self) -> list:
+        if not self.fn.exists():
+            return []
+        with open(self.fn, "r") as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def summary(self, n_slowest: int = 5) -> str:
+        """Return a report with the time spent per XDS step, and the slowest
+        data sets."""
+        records = self.read()
+        if not records:
+            return "No runs recorded"
+
+        lines = [f"{len(records)} XDS runs recorded in {self.fn}", ""]
+        lines.append(f"{'step':10s} {'n':>5s} {'total (s)':>10s} {'mean (s)':>9s} {'max (s)':>9s} {'cpu/wall':>9s}")
+        for job in XDSJOBS:
+            walls = [r["steps"][job]["wall"] for r in records if job in r.get("steps", {}) and r["steps"][job]["wall"] is not None]
+            cpus = [r["steps"][job]["cpu"] or 0 for r in records if job in r.get("steps", {}) and r["steps"][job]["wall"] is not None]
+            if not walls:
+                continue
+            total = sum(walls)
+            ratio = sum(cpus) / total if total else 0
+            lines.append(f"{job:10s} {len(walls):5d} {total:10.1f} {total/len(walls):9.1f} {max(walls):9.1f} {ratio:9.1f}")
+
+        total = sum(r.get("wall", 0) for r in records)
+        rss = [r["max_rss_mb"] for r in records if r.get("max_rss_mb")]
+        lines.append("")
+        lines.append(f"Total wall time: {total:.1f} s")
+        if rss:
+            lines.append(f"Peak memory: {max(rss):.0f} MB (mean {sum(rss)/len(rss):.0f} MB)")
+
+        slowest = sorted(records, key=lambda r: r.get("wall", 0), reverse=True)[:n_slowest]
+        lines.append("")
+        lines.append("Slowest data sets:")
+        for r in slowest:
+            lines.append(f"{r.get('wall', 0):9.1f} s  {r['directory']}")
+
+        return "\n".join(lines)
@@ -0,0 +1,268 @@
+from contextlib import contextmanager
+import atexit
+import os
+import signal
+import subprocess as sp
+import sys
+import threading
+import time
+
+from .runlog import run_process
+
+platform = sys.platform
+
+if platform == "win32":
+    from .wsl import bash_exe
+
+# default timeouts in seconds per tool (None = no timeout), can be changed by the programs
+TIMEOUTS = {
+    "xds": None,
+    "xds_par": None,
+    "xscale": 3600,
+    "xdsconv": 600,
+    "pointless": 600,
+}
+
+# number of times a failed program is run again, can be changed by the programs
+RETRIES = 0
+
+_active = set()
+_lock = threading.Lock()
+_cancelled = threading.Event()
+# held while a process is reaped, and while checking and signalling it
+_reap_lock = threading.Lock()
+
+
+class RunResult:
+    """Exit status of an external program run with `run`."""
+
+    def __init__(self, cmd, cwd=None):
+        self.cmd = cmd
+        self.cwd = cwd
+        self.returncode = None
+        self.timed_out = False
+        self.cancelled = False
+        self.attempts = 0
+        self.output = None
+        self.error = None
+        self.stats = {}
+
+    @property
+    def ok(self) -> bool:
+        return self.returncode == 0 and not self.timed_out and not self.cancelled and self.error is None
+
+    def __repr__(self):
+        if self.ok:
+            status = "ok"
+        elif self.cancelled:
+            status = "cancelled"
+        elif self.timed_out:
+            status = "timed out"
+        elif self.error:
+            status = f"error: {self.error}"
+        else:
+            status = f"exit status {self.returncode}"
+        return f"{self.cmd} [{self.cwd}]: {status}"
+
+
+def _signal(p, sig) -> bool:
+    """Send `sig` to the process group of `p`, unless the process has been
+    reaped already (its pid may be in use by another process). `run_process`
+    reaps under the same lock, so the pid cannot be reaped in between.
+    Returns False if the process has been reaped."""
+    # do not use `p.poll()`, it would reap the process before `os.wait4`
+    with _reap_lock:
+        if p.returncode is not None:
+            return False
+        os.killpg(p.pid, sig)
+    return True
+
+
+def _kill(p, grace: float = 5.0) -> None:
+    """Kill process `p` and all its children."""
+    if p.returncode is not None:
+        return
+    if platform == "win32":
+        sp.run(["taskkill", "/F", "/T", "/PID", str(p.pid)], stdout=sp.DEVNULL, stderr=sp.DEVNULL)
+        return
+    try:
+        if not _signal(p, signal.SIGTERM):
+            return
+        t0 = time.perf_counter()
+        while time.perf_counter() - t0 < grace:
+            if p.returncode is not None:
+                return
+            time.sleep(0.1)
+        _signal(p, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+def terminate_all() -> None:
+    """Kill all running external programs, and prevent new ones from starting."""
+    _cancelled.set()
+    with _lock:
+        active = list(_active)
+    for p in active:
+        _kill(p, grace=1.0)
+
+
+atexit.register(terminate_all)
+
+
+@contextmanager
+def cancel_on_interrupt():
+    """Kill all external programs when Ctrl-C is pressed. Every program runs
+    in its own process group, so it does not receive the SIGINT from the
+    terminal itself."""
+    try:
+        yield
+    except KeyboardInterrupt:
+        print("\nInterrupted, stopping all running programs...")
+        terminate_all()
+        raise
+
+
+def run(cmd: str, cwd=None, timeout: float = -1, retries: int = None, quiet: bool = True,
+        stdout=None, input: str = None, capture: bool = False, env: dict = None,
+        cpus: list = None, name: str = None) -> RunResult:
+    """Run external program `cmd` (through WSL on Windows).
+
+    cwd: working directory
+    timeout: kill the program after this many seconds, None for no
+        timeout. The default is looked up in `TIMEOUTS` by `name` (the
+        first word of `cmd` if not given).
+    retries: number of times to run the program again if it fails or
+        times out (default: `RETRIES`)
+    quiet: discard stdout
+    stdout: file name to write stdout to
+    input: text to pass to stdin
+    capture: return stdout (and stderr) as `result.output`
+    cpus: pin the program to these CPUs (Linux only)
+
+    The program runs in its own process group, so that it can be killed
+    with all its children on a timeout or when Ctrl-C is pressed.
+
+    Returns a `RunResult` with the exit status, the cpu time and peak
+    memory (POSIX).
+    """
+    name = name or cmd.split()[0]
+    if timeout == -1:
+        timeout = TIMEOUTS.get(name)
+    if retries is None:
+        retries = RETRIES
+
+    result = RunResult(cmd, cwd=cwd)
+
+    for attempt in range(retries + 1):
+        if _cancelled.is_set():
+            result.cancelled = True
+            return result
+
+        result.attempts = attempt + 1
+        result.timed_out = False
+        result.error = None
+        _run_once(result, cmd, cwd=cwd, timeout=timeout, quiet=quiet, stdout=stdout,
+                  input=input, capture=capture, env=env, cpus=cpus)
+
+        if result.ok or result.cancelled:
+            break
+        if attempt < retries:
+            print(f"Retrying ({attempt + 1}/{retries}): {result}")
+
+    return result
+
+
+def _run_once(result, cmd, cwd, timeout, quiet, stdout, input, capture, env, cpus) -> None:
+    kwargs = {"cwd": None if cwd is None else str(cwd)}
+
+    if platform == "win32":
+        if quiet and not (stdout or capture):
+            cmd = f"{cmd} 2>&1 >/dev/null"
+        # as a list, so that `cmd` with its arguments is a single argument of `bash -c`
+        args = [bash_exe, "-ic", cmd]
+        kwargs["creationflags"] = sp.CREATE_NEW_PROCESS_GROUP
+    else:
+        args = cmd
+        kwargs.update(shell=True, env=env, start_new_session=True)
+
+    out = None
+    if capture:
+        kwargs.update(stdout=sp.PIPE, stderr=sp.STDOUT)
+    elif stdout:
+        out = open(stdout, "w")
+        kwargs["stdout"] = out
+    elif quiet and platform != "win32":
+        kwargs["stdout"] = sp.DEVNULL
+
+    if input is not None:
+        kwargs["stdin"] = sp.PIPE
+
+    try:
+        p = sp.Popen(args, **kwargs)
+    except Exception as e:
+        result.error = str(e)
+        if out:
+            out.close()
+        return
+
+    # pin the CPUs from here, `preexec_fn` is not safe when other threads
+    # are running. The shell execs the program, so it keeps the same pid, and
+    # the affinity is set long before the program starts its own threads.
+    if cpus and hasattr(os, "sched_setaffinity"):
+        try:
+            os.sched_setaffinity(p.pid, cpus)
+        except OSError:
+            pass  # finished already
+
+    with _lock:
+        _active.add(p)
+
+    def on_timeout():
+        result.timed_out = True
+        _kill(p)
+
+    timer = threading.Timer(timeout, on_timeout) if timeout else None
+    if timer:
+        timer.daemon = True
+        timer.start()
+
+    try:
+        # the process is only reaped by `run_process` (not by `communicate`),
+        # see `_signal`
+        if input is not None:
+            writer = threading.Thread(target=_write_input, args=(p.stdin, input), daemon=True)
+            writer.start()
+        if capture:
+            output = p.stdout.read()
+            p.stdout.close()
+            result.output = output.decode(errors="replace")
+        result.stats = run_process(p, lock=_reap_lock)
+        result.returncode = p.returncode
+    finally:
+        if timer:
+            timer.cancel()
+        with _lock:
+            _active.discard(p)
+        if out:
+            out.close()
+
+    if _cancelled.is_set():
+        result.cancelled = True
+
+
+def _write_input(f, text: str) -> None:
+    try:
+        f.write(text.encode())
+        f.close()
+    except OSError:
+        pass  # the program did not read all input
+
+
+def report(results: list) -> None:
+    """Print the programs that did not finish successfully."""
+    failed = [result for result in results if result is not None and not result.ok]
+    if failed:
+        print(f"\n{len(failed)} program runs did not finish successfully:")
+        for result in failed:
+            print(f"  {result}")
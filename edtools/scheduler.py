@@ -0,0 +1,170 @@
+from pathlib import Path
+import itertools
+import queue
+import threading
+
+from .watch import expected_frames
+
+
+def count_lines(fn, bufsize: int = 1 << 20) -> int:
+    """Count the number of lines in `fn` without decoding it."""
+    n = 0
+    with open(fn, "rb") as f:
+        while True:
+            buf = f.read(bufsize)
+            if not buf:
+                return n
+            n += buf.count(b"\n")
+
+
+def previous_isa(drc) -> float:
+    """Return ISa from CORRECT.LP of a previous XDS run in `drc` (or None)."""
+    fn = Path(drc) / "CORRECT.LP"
+    if not fn.exists():
+        return None
+
+    isa = None
+    with open(fn, "r", errors="replace") as f:
+        for line in f:
+            if line.startswith("     a        b          ISa"):
+                try:
+                    isa = float(next(f).split()[-1])
+                except (StopIteration, ValueError, IndexError):
+                    pass
+    return isa
+
+
+def dataset_priority(drc) -> tuple:
+    """Expected value of processing the data set in `drc` from cheap
+    signals, higher is better.
+
+    Returns the tuple (ISa of a previous run, number of spots in SPOT.XDS,
+    number of frames), missing signals are 0. Tuples compare element by
+    element, so a previous ISa dominates the spot count, which dominates the
+    number of frames.
+    """
+    drc = Path(drc)
+
+    isa = previous_isa(drc) or 0.0
+
+    spot_xds = drc / "SPOT.XDS"
+    n_spots = count_lines(spot_xds) if spot_xds.exists() else 0
+
+    n_frames = len(expected_frames(drc / "XDS.INP"))
+
+    return (isa, n_spots, n_frames)
+
+
+class PriorityScheduler:
+    """Run jobs on a pool of worker threads, the job with the highest
+    priority first. Jobs with the same priority run in submission order.
+    Jobs can be added while others are running.
+
+    Usage:
+        scheduler = PriorityScheduler(max_workers=2)
+        scheduler.submit(func, *args, priority=(10.0, 2000, 100))
+        scheduler.join()
+        scheduler.shutdown()
+    """
+
+    def __init__(self, max_workers: int = 1):
+        self.queue = queue.PriorityQueue()
+        self.counter = itertools.count()
+        self.workers = [threading.Thread(target=self._work, daemon=True) for _ in range(max_workers)]
+        for worker in self.workers:
+            worker.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            # e.g. Ctrl-C, drop the queue and do not wait for the running jobs
+            self.cancel_pending()
+            return
+        self.join()
+        self.shutdown()
+
+    @staticmethod
+    def _key(priority) -> tuple:
+        if isinstance(priority, (tuple, list)):
+            return tuple(-val for val in priority)
+        return (-priority,)
+
+    def submit(self, func, *args, priority=0) -> None:
+        self.queue.put((self._key(priority), next(self.counter), func, args))
+
+    def _work(self) -> None:
+        while True:
+            key, _, func, args = self.queue.get()
+            try:
+                if func is None:
+                    return
+                func(*args)
+            except Exception as e:
+                print("ERROR:", e)
+            finally:
+                self.queue.task_done()
+
+    def cancel_pending(self) -> int:
+        """Remove all jobs that have not started yet, returns the number of
+        cancelled jobs."""
+        n = 0
+        while True:
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                return n
+            self.queue.task_done()
+            n += 1
+
+    def join(self) -> None:
+        """Wait until all submitted jobs are done."""
+        self.queue.join()
+
+    def shutdown(self) -> None:
+        # the sentinels sort after all regular jobs
+        for _ in self.workers:
+            self.queue.put(((float("inf"),), next(self.counter), None, ()))
+        for worker in self.workers:
+            worker.join()
+
+
+class CellConsensus:
+    """Count data sets with consistent unit cells.
+
+    Two cells are consistent if all cell lengths agree within `rel_tol`
+    (relative) and all angles within `angle_tol` degrees. `add` returns True
+    once `n_target` mutually consistent cells have been collected.
+    """
+
+    def __init__(self, n_target: int, rel_tol: float = 0.02, angle_tol: float = 2.0):
+        self.n_target = n_target
+        self.rel_tol = rel_tol
+        self.angle_tol = angle_tol
+        self.groups = []  # list of (reference cell, [cells])
+        self.lock = threading.Lock()
+
+    def consistent(self, cell1, cell2) -> bool:
+        lengths = all(abs(a - b) <= self.rel_tol * max(a, b) for a, b in zip(cell1[:3], cell2[:3]))
+        angles = all(abs(a - b) <= self.angle_tol for a, b in zip(cell1[3:], cell2[3:]))
+        return lengths and angles
+
+    def add(self, cell) -> bool:
+        with self.lock:
+            for reference, cells in self.groups:
+                if self.consistent(reference, cell):
+                    cells.append(cell)
+                    break
+            else:
+                self.groups.append((cell, [cell]))
+            return self.reached()
+
+    def reached(self) -> bool:
+        return any(len(cells) >= self.n_target for _, cells in self.groups)
+
+    def best(self) -> list:
+        """Cells of the largest group."""
+        if not self.groups:
+            return []
+        return max(self.groups, key=lambda group: len(group[1]))[1]
@@ -0,0 +1,141 @@
+import numpy as np
+from scipy import ndimage
+
+
+def _slices(n: int, s: int) -> (slice, slice):
+    """Return the destination/source slices along one axis of length `n`
+    for an integer shift `s`."""
+    if s >= 0:
+        return slice(s, n), slice(0, n - s)
+    else:
+        return slice(0, n + s), slice(-s, n)
+
+
+def shift_integer(arr: np.ndarray, shift, out: np.ndarray = None, fill=None) -> np.ndarray:
+    """Translate the last two axes of `arr` by an integer number of pixels.
+
+    The shifted data are copied with a single slice assignment into `out`
+    (allocated if not given), no intermediate arrays are made.
+
+    shift: (rows, columns), values are rounded to the nearest integer
+    fill: value for the uncovered border. If None, the edge pixels are
+        repeated (equivalent to mode='nearest' in `scipy.ndimage.shift`)
+    """
+    if out is None:
+        out = np.empty_like(arr)
+
+    h, w = arr.shape[-2:]
+    s0, s1 = (int(round(float(val))) for val in shift)
+
+    if abs(s0) >= h or abs(s1) >= w:
+        out[...] = arr.mean() if fill is None else fill
+        return out
+
+    dst0, src0 = _slices(h, s0)
+    dst1, src1 = _slices(w, s1)
+    out[..., dst0, dst1] = arr[..., src0, src1]
+
+    if fill is None:
+        if s0 > 0:
+            out[..., :s0, :] = out[..., s0:s0+1, :]
+        elif s0 < 0:
+            out[..., s0:, :] = out[..., s0-1:s0, :]
+        if s1 > 0:
+            out[..., :, :s1] = out[..., :, s1:s1+1]
+        elif s1 < 0:
+            out[..., :, s1:] = out[..., :, s1-1:s1]
+    else:
+        if s0 > 0:
+            out[..., :s0, :] = fill
+        elif s0 < 0:
+            out[..., s0:, :] = fill
+        if s1 > 0:
+            out[..., :, :s1] = fill
+        elif s1 < 0:
+            out[..., :, s1:] = fill
+
+    return out
+
+
+def _fourier_phase(shape: (int, int), shifts: np.ndarray) -> np.ndarray:
+    """Phase ramps for shifting images of `shape` by `shifts` (n, 2)."""
+    h, w = shape
+    ky = np.fft.fftfreq(h)
+    kx = np.fft.rfftfreq(w)
+    shifts = np.atleast_2d(shifts)
+    phase = np.exp(-2j * np.pi * shifts[:, 0, None, None] * ky[None, :, None]) \
+          * np.exp(-2j * np.pi * shifts[:, 1, None, None] * kx[None, None, :])
+    return phase
+
+
+def _to_dtype(arr: np.ndarray, dtype) -> np.ndarray:
+    """Round and clip `arr` to the range of integer `dtype`."""
+    dtype = np.dtype(dtype)
+    if dtype.kind in 'ui':
+        info = np.iinfo(dtype)
+        arr = np.clip(np.round(arr), info.min, info.max)
+    return arr.astype(dtype, copy=False)
+
+
+def shift_subpixel(arr: np.ndarray, shift, order=1, out: np.ndarray = None, mode: str = 'nearest') -> np.ndarray:
+    """Translate image `arr` by a sub-pixel `shift` (rows, columns).
+
+    order: spline order (1 = bilinear, 3 = cubic) passed to
+        `scipy.ndimage.shift`, or 'fourier' to apply the shift as a phase
+        ramp in Fourier space (periodic boundaries)
+    out: optional output array, its dtype is used for the result
+    """
+    dtype = arr.dtype if out is None else out.dtype
+
+    if order == 'fourier':
+        shifted = np.fft.irfft2(np.fft.rfft2(arr) * _fourier_phase(arr.shape, shift)[0], s=arr.shape)
+        result = _to_dtype(shifted, dtype)
+        if out is None:
+            return result
+        out[...] = result
+        return out
+
+    if out is None:
+        out = np.empty(arr.shape, dtype=dtype)
+    ndimage.shift(arr, shift, output=out, order=int(order), mode=mode)
+    return out
+
+
+def shift_image(arr: np.ndarray, shift, order=3, out: np.ndarray = None) -> np.ndarray:
+    """Translate image `arr` by `shift` (rows, columns).
+
+    order: 0 uses the integer fast path (`shift_integer`), which is
+        sufficient when the drift is below half a pixel; 1-5 select the
+        spline order, or 'fourier' for a Fourier shift
+    """
+    if order == 0:
+        return shift_integer(arr, shift, out=out)
+    else:
+        return shift_subpixel(arr, shift, order=order, out=out)
+
+
+def shift_stack(stack: np.ndarray, shifts, order=0, out: np.ndarray = None) -> np.ndarray:
+    """Translate every frame in `stack` (n_frames, h, w) by the corresponding
+    row of `shifts` (n_frames, 2).
+
+    For the Fourier method, all frames are transformed in a single batched
+    FFT. See `shift_image` for the meaning of `order`.
+    """
+    shifts = np.asarray(shifts, dtype=float).reshape(-1, 2)
+    if len(shifts) != len(stack):
+        raise ValueError(f"Number of shifts ({len(shifts)}) does not match number of frames ({len(stack)})")
+
+    if out is None:
+        out = np.empty_like(stack)
+
+    if order == 'fourier':
+        h, w = stack.shape[-2:]
+        ft = np.fft.rfft2(stack, axes=(-2, -1))
+        ft *= _fourier_phase((h, w), shifts)
+        out[...] = _to_dtype(np.fft.irfft2(ft, s=(h, w), axes=(-2, -1)), out.dtype)
+        return out
+
+    for frame, shift, frame_out in zip(stack, shifts, out):
+        shift_image(frame, shift, order=order, out=frame_out)
+
+    return out
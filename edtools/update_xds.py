@@ -1,6 +1,13 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
 from pathlib import Path
+import os
 import shutil
+import tarfile
+import time
+import zipfile
 from .utils import parse_args_for_fns
+from .xds_inp import XDSInput
 
 XDSJOBS = ("XYCORR", "INIT", "COLSPOT", "IDXREF", "DEFPIX", "INTEGRATE", "CORRECT")
 
@@ -35,129 +42,247 @@ def update_xds(fn,
                refine_corr=None,
                trusted_region=None,
                trusted_pixels=None,
-               reidx=None):
-    shutil.copyfile(fn, fn.with_name("XDS.INP~"))
-    
-    lines = open(fn, "r", encoding = 'cp1252').readlines()
-    if not lines:
-        return
-
-    pre = "!" if comment else ""
-
-    new_lines = []
-    HAS_BEAM_DIV_RELF_RANGE = False
-
-    if "all" in jobs:
+               reidx=None,
+               backup=True,
+               skip_unchanged=False,
+               edits=None):
+    """Update XDS.INP file `fn` in place, the file is replaced atomically.
+
+    edits: dict of raw XDS keyword -> value, applied after the options above
+
+    backup: copy the original file to `XDS.INP~` before writing
+    skip_unchanged: do not touch the file if the edits do not change it
+
+    Returns True if the file was written.
+    """
+    inp = XDSInput.read(fn)
+    if not inp.lines:
+        return False
+    original = str(inp)
+
+    raw_edits = edits or {}
+    edits = {}
+    to_comment = []
+
+    if cell:
+        edits["UNIT_CELL_CONSTANTS"] = " ".join((f"{val:.3f}" for val in cell))
+    if spgr:
+        edits["SPACE_GROUP_NUMBER"] = f"{spgr}"
+    if axis_error:
+        edits["MAX_CELL_AXIS_ERROR"] = f"{axis_error:.2f}"
+    if angle_error:
+        edits["MAX_CELL_ANGLE_ERROR"] = f"{angle_error:.2f}"
+    if overload:
+        edits["OVERLOAD"] = f"{overload:d}"
+    if hi_res:
+        edits["INCLUDE_RESOLUTION_RANGE"] = f"{lo_res:.2f} {hi_res:.2f}"
+    if wfac1:
+        edits["WFAC1"] = f"{wfac1:.1f}"
+    if sp:
+        edits["STRONG_PIXEL"] = f"{sp}"
+    if indnumthre:
+        edits["MINIMUM_FRACTION_OF_INDEXED_SPOTS"] = f"{indnumthre:.2f}"
+    if cut_frames:
+        for keyword in ("DATA_RANGE", "SPOT_RANGE", "BACKGROUND_RANGE"):
+            value = inp.get(keyword)
+            if value:
+                data_begin, data_end = value.split()[:2]
+                data_begin_cf = round(int(data_begin))
+                data_end_cf = round(int(data_end)*(1-cut_frames))
+                edits[keyword] = f"{data_begin_cf:d} {data_end_cf:d}"
+    if processors:
+        edits["MAXIMUM_NUMBER_OF_JOBS"] = f"{processors:d}"
+        edits["MAXIMUM_NUMBER_OF_PROCESSORS"] = f"{processors:d}"
+    if center:
+        edits["ORGX"] = f"{center[0]:.2f}"
+        edits["ORGY"] = f"{center[1]:.2f}"
+    if axis:
+        edits["ROTATION_AXIS"] = f"{axis[0]} {axis[1]} {axis[2]}"
+    if cam_len:
+        edits["DETECTOR_DISTANCE"] = f"{cam_len}"
+    if pixel_size:
+        edits["QX"] = f"{pixel_size[0]}"
+        edits["QY"] = f"{pixel_size[1]}"
+    if refine_idx:
+        edits["REFINE(IDXREF)"] = " ".join(refine_idx)
+    if refine_integrate:
+        edits["REFINE(INTEGRATE)"] = " ".join(refine_integrate)
+    if refine_corr:
+        edits["REFINE(CORRECT)"] = " ".join(refine_corr)
+    if trusted_region:
+        edits["TRUSTED_REGION"] = f"{trusted_region[0]} {trusted_region[1]}"
+    if trusted_pixels:
+        edits["VALUE_RANGE_FOR_TRUSTED_DETECTOR_PIXELS"] = f"{trusted_pixels[0]} {trusted_pixels[1]}"
+    if mosaicity:
+        edits["BEAM_DIVERGENCE_E.S.D."] = f"{mosaicity[0]:.3f}"
+        edits["REFLECTING_RANGE_E.S.D."] = f"{mosaicity[1]:.3f}"
+    if reidx:
+        edits["REIDX"] = " ".join(reidx)
+
+    if comment:
+        to_comment.extend(("UNIT_CELL_CONSTANTS", "SPACE_GROUP_NUMBER", "REIDX",
+                           "STRONG_PIXEL", "MINIMUM_FRACTION_OF_INDEXED_SPOTS"))
+    if untrusted:
+        to_comment.append("UNTRUSTED_RECTANGLE")
+    if corr:
+        to_comment.extend(("X-GEO_CORR", "Y-GEO_CORR"))
+
+    edits.update(raw_edits)
+
+    inp.update(edits)
+    inp.comment(to_comment)
+
+    # the reference to the XDS paper is sometimes problematic
+    inp.delete_lines("Cryst.")
+    if dl:
+        inp.delete_lines(dl)
+
+    if jobs and "all" in jobs:
         jobs = XDSJOBS
 
     if jobs:
         jobs = [job.upper() for job in jobs]
-        jobs_line = "JOB= " + " ".join(jobs) + "\n\n"
-        new_lines.append(jobs_line)
-
-    for line in lines:
-        if cell and "UNIT_CELL_CONSTANTS" in line:
-            cell_str = " ".join((f"{val:.3f}" for val in cell))
-            cell_line = f"{pre}UNIT_CELL_CONSTANTS= {cell_str}\n"
-            line = cell_line
-        elif spgr and "SPACE_GROUP_NUMBER" in line:
-            spgr_line = f"{pre}SPACE_GROUP_NUMBER= {spgr}\n"
-            line = spgr_line
-        elif axis_error and "MAX_CELL_AXIS_ERROR" in line:
-            line = f"MAX_CELL_AXIS_ERROR= {axis_error:.2f}\n"
-        elif angle_error and "MAX_CELL_ANGLE_ERROR" in line:
-            line = f"MAX_CELL_ANGLE_ERROR= {angle_error:.2f}\n"
-        elif overload and "OVERLOAD" in line:
-            line = f"OVERLOAD= {overload:d}\n"
-        elif hi_res and "INCLUDE_RESOLUTION_RANGE" in line:
-            line = f"INCLUDE_RESOLUTION_RANGE= {lo_res:.2f} {hi_res:.2f}\n"
-        elif wfac1 and "WFAC1" in line:
-            line = f"WFAC1= {wfac1:.1f}\n"
-        elif sp and "STRONG_PIXEL" in line:
-            sp_line = f"{pre}STRONG_PIXEL= {sp}\n"
-            line = sp_line
-        elif indnumthre and "MINIMUM_FRACTION_OF_INDEXED_SPOTS" in line:
-            line = f"MINIMUM_FRACTION_OF_INDEXED_SPOTS= {indnumthre:.2f}\n" 
-        elif d and "J. Appl. Cryst. (2018)." in line:
-            line = ""
-        elif cut_frames:
-            try:
-                keyword = line.strip().split()[0]
-            except IndexError:
-                pass
-            else:
-                if keyword in ("DATA_RANGE=", "SPOT_RANGE=", "BACKGROUND_RANGE="):
-                    data_begin, data_end = line[20:].split()
-                    data_begin_cf = round(int(data_begin))
-                    data_end_cf = round(int(data_end)*(1-cut_frames))
-                    line = f"{keyword:20s}        {data_begin_cf:d} {data_end_cf:d}\n"
-        elif comment and "UNIT_CELL_CONSTANTS" in line:
-            line = pre + line
-        elif comment and "SPACE_GROUP_NUMBER" in line:
-            line = pre + line
-        elif comment and "REIDX" in line:
-            line = pre + line
-        elif comment and "STRONG_PIXEL" in line:
-            line = pre + line
-        elif comment and "MINIMUM_FRACTION_OF_INDEXED_SPOTS" in line:
-            line = pre + line
-        elif dl and dl in line:
-            line = ""
-        elif jobs and ("JOB=" in line):
-            continue
-        elif processors:
-            try:
-                keyword = line.strip().split("=")[0]
-            except IndexError:
-                pass
-            else:
-                if keyword in ("MAXIMUM_NUMBER_OF_JOBS", "MAXIMUM_NUMBER_OF_PROCESSORS"):
-                    line = f"{keyword}={processors:d}\n"
-        elif center and "ORGX" in line and "ORGY" in line:
-            line = f"ORGX= {center[0]:.2f}    ORGY= {center[1]:.2f}\n"
-        elif untrusted and "UNTRUSTED_RECTANGLE" in line:
-            line = "!" + line
-        elif corr and "GEO_CORR=" in line:
-            line = "!" + line
-        elif axis and "ROTATION_AXIS" in line:
-            line = f"ROTATION_AXIS= {axis[0]} {axis[1]} {axis[2]}\n"
-        elif cam_len and "DETECTOR_DISTANCE" in line:
-            line = f"DETECTOR_DISTANCE= {cam_len}\n"
-        elif pixel_size and "QX" in line:
-            line = f"QX= {pixel_size[0]}  QY= {pixel_size[1]}\n"
-        elif refine_idx and "REFINE(IDXREF)" in line:
-            line = f"REFINE(IDXREF)=   {' '.join(refine_idx)}\n"
-        elif refine_integrate and "REFINE(INTEGRATE)" in line:
-            line = f"REFINE(INTEGRATE)=   {' '.join(refine_integrate)}\n"
-        elif refine_corr and "REFINE(CORRECT)" in line:
-            line = f"REFINE(CORRECT)=   {' '.join(refine_corr)}\n"
-        elif trusted_region and "TRUSTED_REGION" in line:
-            line = f"TRUSTED_REGION= {trusted_region[0]} {trusted_region[1]}\n"
-        elif trusted_pixels and "VALUE_RANGE_FOR_TRUSTED_DETECTOR_PIXELS" in line:
-            line = f"VALUE_RANGE_FOR_TRUSTED_DETECTOR_PIXELS= {trusted_pixels[0]} {trusted_pixels[1]}\n"
-        elif mosaicity and "BEAM_DIVERGENCE_E.S.D." in line:
-            HAS_BEAM_DIV_RELF_RANGE = True
-            line = f"BEAM_DIVERGENCE_E.S.D.= {mosaicity[0]:.3f}\n"
-        elif mosaicity and "REFLECTING_RANGE_E.S.D." in line:
-            HAS_BEAM_DIV_RELF_RANGE = True
-            line = f"REFLECTING_RANGE_E.S.D.= {mosaicity[1]:.3f}\n"
-        elif reidx and "REIDX=" in line:
-            line = f"REIDX= {' '.join(reidx)}\n"
-        if "Cryst." in line:
-            line = ""
-
-
-        new_lines.append(line)
+        inp.delete(["JOB"])
+        inp.insert(0, "")
+        inp.insert(0, "JOB= " + " ".join(jobs))
 
     if apd:
-        line = f"{apd}\n"
-        new_lines.append(line)
+        inp.append(apd)
+
+    if skip_unchanged and str(inp) == original:
+        return False
+
+    if backup:
+        shutil.copyfile(fn, fn.with_name("XDS.INP~"))
+
+    inp.write(fn)
+    return True
+
+
+def backup_archive(fns, fmt="tar"):
+    """Store all files in `fns` in a single tar.gz or zip archive in the
+    current directory. The paths in the archive are relative to the common
+    parent directory. Returns the path to the archive."""
+    fns = [Path(fn) for fn in fns]
+    if not fns:
+        return None
+
+    root = Path(os.path.commonpath([fn.parent for fn in fns]))
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+
+    if fmt == "tar":
+        archive = Path(f"XDS.INP_backup_{stamp}.tar.gz")
+        with tarfile.open(archive, "w:gz") as tar:
+            for fn in fns:
+                tar.add(fn, arcname=fn.relative_to(root))
+    elif fmt == "zip":
+        archive = Path(f"XDS.INP_backup_{stamp}.zip")
+        with zipfile.ZipFile(archive, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+            for fn in fns:
+                zf.write(fn, arcname=fn.relative_to(root))
+    else:
+        raise ValueError(f"Unknown backup format: {fmt!r}")
+
+    return archive
+
+
+def _format_value(value) -> str:
+    if isinstance(value, (list, tuple)):
+        return " ".join(_format_value(val) for val in value)
+    if isinstance(value, float):
+        return f"{value:.6g}"
+    return str(value)
+
+
+def read_plan(fn) -> dict:
+    """Read an update plan from a CSV, Parquet or YAML file.
+
+    A table (CSV/Parquet) has a column `directory` with the data set
+    directory (or the path to the XDS.INP file), and a column for every XDS
+    keyword to update. Only columns named in capitals are used as keywords,
+    so the `beam_centers.csv` written by `edtools.find_beam_center` can be
+    used directly. Empty cells are skipped.
+
+    A YAML file contains either a list of mappings with a `directory` key,
+    or a mapping directory -> {keyword: value}.
+
+    Returns a dict XDS.INP path -> {keyword: value string}.
+    """
+    fn = Path(fn)
+    suffix = fn.suffix.lower()
+
+    if suffix in (".yaml", ".yml"):
+        import yaml
+        data = yaml.load(open(fn, "r"), Loader=yaml.Loader) or {}
+        if isinstance(data, dict):
+            rows = [dict(values or {}, directory=drc) for drc, values in data.items()]
+        else:
+            rows = data
+    else:
+        import pandas as pd
+        if suffix in (".parquet", ".pq"):
+            df = pd.read_parquet(fn)
+        else:
+            df = pd.read_csv(fn)
+        if "directory" not in df.columns:
+            raise ValueError(f"Plan {fn} has no column `directory`")
+        rows = df.to_dict("records")
+
+    plan = {}
+    for row in rows:
+        drc = Path(str(row["directory"]))
+        if not drc.is_absolute():
+            drc = fn.parent / drc
+        xds_inp = drc if drc.name == "XDS.INP" else drc / "XDS.INP"
+
+        edits = {}
+        for key, value in row.items():
+            key = str(key)
+            if key == "directory" or not key.isupper():
+                continue
+            if value is None or (isinstance(value, float) and value != value):  # NaN
+                continue
+            edits[key] = _format_value(value)
+
+        plan.setdefault(xds_inp.resolve(), {}).update(edits)
+
+    return plan
+
+
+def update_many(fns, threads=8, backup="file", skip_unchanged=False, plan=None, **kwargs):
+    """Apply the same update (see `update_xds` for the keywords) to all files
+    in `fns` on a thread pool.
+
+    backup: `file` to make a `XDS.INP~` copy next to every file, `tar` or
+        `zip` to store all original files in a single archive, `none` to
+        skip the backup
+    plan: dict XDS.INP path -> {keyword: value} with additional per-file
+        edits (see `read_plan`)
+
+    Returns the number of files written.
+    """
+    if backup in ("tar", "zip"):
+        archive = backup_archive(fns, fmt=backup)
+        if archive:
+            print(f"Backup of {len(fns)} files written to {archive}")
+
+    func = partial(update_xds, backup=(backup == "file"), skip_unchanged=skip_unchanged, **kwargs)
+    plan = plan or {}
+
+    n_written = 0
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        futures = {executor.submit(func, fn, edits=plan.get(fn)): fn for fn in fns}
+        for future in as_completed(futures):
+            fn = futures[future]
+            try:
+                written = future.result()
+            except Exception as e:
+                print(f"\033[KError updating {fn}: {e}")
+            else:
+                n_written += bool(written)
+                print("\033[K", fn, end='\r')  # "\033[K" clears line
 
-    if mosaicity and HAS_BEAM_DIV_RELF_RANGE is False:
-        line = f"BEAM_DIVERGENCE_E.S.D.=   {mosaicity[0]:.3f}\nREFLECTING_RANGE_E.S.D.=   {mosaicity[1]:.2f}\n"
-        new_lines.append(line)
-        
-    open(fn, "w").writelines(new_lines)
+    return n_written
 
 
 def main():
@@ -288,6 +413,25 @@ def main():
                         action="store", type=str, nargs=12, dest="reidx",
                         help="Update the trusted pixels.")
 
+    parser.add_argument("-t", "--threads",
+                        action="store", type=int, dest="threads",
+                        help="Number of files to update in parallel (default: 8)")
+
+    parser.add_argument("-b", "--backup",
+                        action="store", type=str, dest="backup",
+                        choices=("file", "tar", "zip", "none"),
+                        help="Backup strategy: `file` makes a XDS.INP~ copy next to every file, `tar`/`zip` store all original files in a single archive in the current directory, `none` makes no backup (default: file)")
+
+    parser.add_argument("-u", "--skip-unchanged",
+                        action="store_true", dest="skip_unchanged",
+                        help="Do not write files whose content does not change")
+
+    parser.add_argument("--plan",
+                        action="store", type=str, dest="plan",
+                        help="CSV, Parquet or YAML file mapping data set directories to XDS keyword values, "
+                        "e.g. the `beam_centers.csv` from `edtools.find_beam_center`. Only the listed XDS.INP files are updated, "
+                        "the other options are applied to all of them.")
+
     parser.set_defaults(cell=None,
                         spgr=None,
                         comment=False,
@@ -314,7 +458,11 @@ def main():
                         refine_index=None,
                         trusted_region=None,
                         trusted_pixels=None,
-                        reidx=None)
+                        reidx=None,
+                        threads=8,
+                        backup="file",
+                        skip_unchanged=False,
+                        plan=None)
     
     options = parser.parse_args()
     spgr = options.spgr
@@ -348,43 +496,51 @@ def main():
     trusted_pixels = options.trusted_pixels
     reidx = options.reidx
 
-    fns = parse_args_for_fns(fns, name="XDS.INP", match=match)
-
-    for fn in fns:
-        print("\033[K", fn, end='\r')  # "\033[K" clears line
-        update_xds(fn, 
-                   cell=cell, 
-                   spgr=spgr, 
-                   comment=comment, 
-                   axis_error=axis_error, 
-                   angle_error=angle_error, 
-                   overload=overload, 
-                   lo_res=lo_res, 
-                   hi_res=hi_res, 
-                   cut_frames=cut_frames, 
-                   wfac1=wfac1, 
-                   apd=append,
-                   jobs=jobs,
-                   sp=StrongPixel, 
-                   indnumthre = indnumthre, 
-                   d=del_ref, 
-                   dl=del_line,
-                   processors = processors,
-                   center=center,
-                   axis=axis,
-                   cam_len=cam_len,
-                   mosaicity=mosaicity,
-                   pixel_size=pixel_size,
-                   untrusted=untrusted,
-                   corr=corr,
-                   refine_idx=refine_index,
-                   refine_integrate=refine_integrate,
-                   refine_corr=refine_corr,
-                   trusted_region=trusted_region,
-                   trusted_pixels=trusted_pixels,
-                   reidx=reidx)
-
-    print(f"\033[KUpdated {len(fns)} files")
+    if options.plan:
+        plan = read_plan(options.plan)
+        fns = [fn for fn in plan if fn.exists()]
+        print(f"{len(fns)}/{len(plan)} files named XDS.INP in plan {options.plan} found.")
+    else:
+        plan = None
+        fns = parse_args_for_fns(fns, name="XDS.INP", match=match)
+
+    n_written = update_many(fns,
+                            threads=options.threads,
+                            backup=options.backup,
+                            skip_unchanged=options.skip_unchanged,
+                            plan=plan,
+                            cell=cell,
+                            spgr=spgr,
+                            comment=comment,
+                            axis_error=axis_error,
+                            angle_error=angle_error,
+                            overload=overload,
+                            lo_res=lo_res,
+                            hi_res=hi_res,
+                            cut_frames=cut_frames,
+                            wfac1=wfac1,
+                            apd=append,
+                            jobs=jobs,
+                            sp=StrongPixel,
+                            indnumthre=indnumthre,
+                            d=del_ref,
+                            dl=del_line,
+                            processors=processors,
+                            center=center,
+                            axis=axis,
+                            cam_len=cam_len,
+                            mosaicity=mosaicity,
+                            pixel_size=pixel_size,
+                            untrusted=untrusted,
+                            corr=corr,
+                            refine_idx=refine_index,
+                            refine_integrate=refine_integrate,
+                            refine_corr=refine_corr,
+                            trusted_region=trusted_region,
+                            trusted_pixels=trusted_pixels,
+                            reidx=reidx)
+
+    print(f"\033[KUpdated {n_written}/{len(fns)} files")
 
 
 if __name__ == '__main__':
@@ -1,5 +1,8 @@
 from math import radians, cos
 from pathlib import Path
+import os
+import shutil
+import tempfile
 import yaml
 
 
@@ -56,3 +59,18 @@ def parse_args_for_fns(args, name="XDS.INP", match=None):
 
     return new_fns
 
+
+def atomic_write(fn, text: str, encoding: str = None):
+    """Write `text` to `fn` through a temporary file in the same directory
+    that is renamed over `fn`, so that `fn` is never left half-written."""
+    fn = Path(fn)
+    fd, tmp = tempfile.mkstemp(dir=fn.parent, prefix=f".{fn.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding=encoding) as f:
+            f.write(text)
+        if fn.exists():
+            shutil.copymode(fn, tmp)
+        os.replace(tmp, fn)
+    except BaseException:
+        os.remove(tmp)
+        raise
@@ -0,0 +1,165 @@
+from pathlib import Path
+import threading
+import time
+
+from .xds_inp import XDSInput
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+
+
+def expected_frames(xds_inp) -> list:
+    """Return the list of frames that XDS will read for `xds_inp`, based on
+    NAME_TEMPLATE_OF_DATA_FRAMES and DATA_RANGE. Returns an empty list if
+    the file is incomplete."""
+    xds_inp = Path(xds_inp)
+    try:
+        inp = XDSInput.read(xds_inp)
+    except (OSError, UnicodeDecodeError):
+        return []
+
+    template = inp.get("NAME_TEMPLATE_OF_DATA_FRAMES")
+    data_range = inp.get("DATA_RANGE")
+    if not template or not data_range:
+        return []
+
+    template = template.split()[0]
+    try:
+        first, last = (int(val) for val in data_range.split()[:2])
+    except ValueError:
+        return []
+
+    n = template.count("?")
+    if not n:
+        return []
+    i = template.index("?")
+    head, tail = template[:i], template[i+n:]
+
+    root = xds_inp.parent
+    return [root / f"{head}{j:0{n}d}{tail}" for j in range(first, last + 1)]
+
+
+def dataset_signature(xds_inp):
+    """Cheap signature of the state of a data set, or None if it is not
+    complete yet (XDS.INP unreadable or frames missing)."""
+    xds_inp = Path(xds_inp)
+    frames = expected_frames(xds_inp)
+    if not frames:
+        return None
+
+    try:
+        inp_stat = xds_inp.stat()
+        last_stat = frames[-1].stat()
+    except OSError:
+        return None
+
+    if not all(frame.exists() for frame in frames):
+        return None
+
+    return (inp_stat.st_size, inp_stat.st_mtime, len(frames), last_stat.st_size, last_stat.st_mtime)
+
+
+class DatasetWatcher:
+    """Watch a directory tree for new data sets (directories with XDS.INP).
+
+    A data set is considered complete once all frames listed in XDS.INP
+    exist, and the signature of XDS.INP and the last frame has not changed
+    for `settle` seconds. Complete data sets are passed to `callback` once.
+
+    The tree is polled every `interval` seconds. If `watchdog` is installed,
+    file system events (inotify) wake up the poller immediately, so that the
+    interval only serves as a fallback.
+
+    Usage:
+        watcher = DatasetWatcher(".", callback=print)
+        watcher.run()  # until Ctrl-C
+    """
+
+    def __init__(self, root, callback, name="XDS.INP", match=None, interval=5.0, settle=10.0, seen=()):
+        self.root = Path(root)
+        self.callback = callback
+        self.name = name
+        self.match = match
+        self.interval = interval
+        self.settle = settle
+
+        self.seen = {Path(fn).resolve() for fn in seen}
+        self.pending = {}  # fn -> (signature, time when the signature was first seen)
+
+        self.wakeup = threading.Event()
+        self.observer = None
+
+    def start_observer(self) -> bool:
+        if Observer is None:
+            return False
+
+        wakeup = self.wakeup
+
+        class Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                wakeup.set()
+
+        try:
+            self.observer = Observer()
+            self.observer.schedule(Handler(), str(self.root), recursive=True)
+            self.observer.start()
+        except OSError:
+            self.observer = None
+            return False
+        return True
+
+    def candidates(self) -> list:
+        fns = self.root.rglob(self.name)
+        if self.match:
+            fns = (fn for fn in fns if fn.match(f"{self.match}/*"))
+        return [fn.resolve() for fn in fns]
+
+    def poll(self) -> list:
+        """Check all candidates once and return the data sets that became
+        complete."""
+        now = time.monotonic()
+        ready = []
+
+        for fn in self.candidates():
+            if fn in self.seen:
+                continue
+
+            signature = dataset_signature(fn)
+            if signature is None:
+                self.pending.pop(fn, None)
+                continue
+
+            previous = self.pending.get(fn)
+            if previous is None or previous[0] != signature:
+                self.pending[fn] = (signature, now)
+            elif now - previous[1] >= self.settle:
+                del self.pending[fn]
+                self.seen.add(fn)
+                ready.append(fn)
+
+        return ready
+
+    def run(self) -> None:
+        """Poll until interrupted with Ctrl-C."""
+        mode = "inotify" if self.start_observer() else "polling"
+        print(f"Watching {self.root.resolve()} for new data sets ({mode}), press Ctrl-C to stop")
+
+        try:
+            while True:
+                for fn in self.poll():
+                    self.callback(fn)
+
+                # while data sets are settling, check again after `settle` seconds
+                timeout = min(self.interval, self.settle) if self.pending else self.interval
+                if self.wakeup.wait(timeout):
+                    time.sleep(1.0)  # collect a burst of events into a single poll
+                    self.wakeup.clear()
+        except KeyboardInterrupt:
+            print("\nStopped watching")
+        finally:
+            if self.observer is not None:
+                self.observer.stop()
+                self.observer.join()
@@ -0,0 +1,179 @@
+from pathlib import Path
+import re
+
+# a keyword is a token ending in `=` at the start of the line or after whitespace,
+# e.g. `ORGX=`, `REFINE(IDXREF)=`, `FRIEDEL'S_LAW=`, `BEAM_DIVERGENCE_E.S.D.=`
+KEYWORD = re.compile(r"(?:(?<=\s)|^)([A-Z][A-Z0-9_().'/\-]*)=")
+
+
+class XDSLine:
+    """A single line of an XDS input file.
+
+    `code` is the part before the comment sign `!`, `rest` the comment and the
+    line ending. `entries` holds for every keyword on the line the keyword
+    and the span of its value in `code`.
+    """
+
+    def __init__(self, text: str):
+        self.text = text
+        self.parse()
+
+    def parse(self):
+        text = self.text
+        body = text.rstrip("\r\n")
+        i = body.find("!")
+        code = body if i < 0 else body[:i]
+        self.code = code
+        self.rest = text[len(code):]
+
+        matches = list(KEYWORD.finditer(code))
+        self.entries = []
+        for j, m in enumerate(matches):
+            end = matches[j+1].start() if j+1 < len(matches) else len(code)
+            self.entries.append((m.group(1), m.end(), end))
+
+    @property
+    def keywords(self) -> list:
+        return [kw for kw, _, _ in self.entries]
+
+    def get(self, keyword: str) -> str:
+        for kw, start, end in self.entries:
+            if kw == keyword:
+                return self.code[start:end].strip()
+        return None
+
+    def set(self, keyword: str, value: str):
+        """Replace the value of `keyword`, keeping the surrounding whitespace."""
+        for kw, start, end in self.entries:
+            if kw != keyword:
+                continue
+            raw = self.code[start:end]
+            core = raw.strip()
+            lead = raw[:len(raw) - len(raw.lstrip())] or " "
+            trail = raw[len(raw.rstrip()):] if core else ""
+            if not trail and end < len(self.code):
+                trail = " "  # keep the next keyword separated
+            self.text = self.code[:start] + lead + value + trail + self.code[end:] + self.rest
+            self.parse()
+            return
+
+    def comment(self):
+        self.text = "!" + self.text
+        self.parse()
+
+    def is_commented(self, keyword: str) -> bool:
+        """True if the line is `keyword` that has been commented out."""
+        stripped = self.text.lstrip()
+        return stripped.startswith("!") and stripped.lstrip("! \t").startswith(f"{keyword}=")
+
+
+class XDSInput:
+    """Ordered keyword model of an XDS input file (XDS.INP, XSCALE.INP, ...).
+
+    The file is tokenized once; edits only touch the lines that contain the
+    edited keywords, all other lines (including comments and layout) are
+    written back unchanged.
+
+    Usage:
+        inp = XDSInput.read("XDS.INP")
+        inp.update({"ORGX": "256.00", "ORGY": "256.00"})
+        inp.write("XDS.INP")
+    """
+
+    def __init__(self, lines: list):
+        self.lines = [XDSLine(line) for line in lines]
+
+    @classmethod
+    def read(cls, fn, encoding: str = "cp1252"):
+        with open(fn, "r", encoding=encoding) as f:
+            return cls(f.readlines())
+
+    @classmethod
+    def from_string(cls, text: str):
+        return cls(text.splitlines(keepends=True))
+
+    def __str__(self):
+        return "".join(line.text for line in self.lines)
+
+    def __contains__(self, keyword: str):
+        return any(keyword in line.keywords for line in self.lines)
+
+    def write(self, fn, atomic: bool = True):
+        from .utils import atomic_write
+        text = str(self)
+        if atomic:
+            atomic_write(fn, text)
+        else:
+            Path(fn).write_text(text)
+
+    def keywords(self) -> dict:
+        """Return a dict keyword -> value of the active keywords (first occurrence)."""
+        d = {}
+        for line in self.lines:
+            for kw in line.keywords:
+                d.setdefault(kw, line.get(kw))
+        return d
+
+    def get(self, keyword: str, default=None) -> str:
+        """Return the value of the first occurrence of `keyword`."""
+        for line in self.lines:
+            if keyword in line.keywords:
+                return line.get(keyword)
+        return default
+
+    def update(self, edits: dict, append: bool = True) -> list:
+        """Apply `edits` (keyword -> value string) in a single pass.
+
+        Every active occurrence of a keyword gets the new value. A keyword
+        that is only present as a commented-out line (`!KEYWORD= ...`) is
+        uncommented and updated, otherwise it is appended to the end of the
+        file if `append` is True.
+
+        Returns the list of keywords that were not found in the file.
+        """
+        found = set()
+        for line in self.lines:
+            for kw in line.keywords:
+                if kw in edits:
+                    line.set(kw, edits[kw])
+                    found.add(kw)
+
+        missing = [kw for kw in edits if kw not in found]
+        for kw in missing:
+            for line in self.lines:
+                if line.is_commented(kw):
+                    line.text = f"{kw}= {edits[kw]}\n"
+                    line.parse()
+                    break
+            else:
+                if append:
+                    self.append(f"{kw}= {edits[kw]}")
+        return missing
+
+    def set(self, keyword: str, value: str):
+        self.update({keyword: value})
+
+    def comment(self, keywords) -> None:
+        """Comment out all lines that contain any of `keywords`."""
+        keywords = set(keywords)
+        for line in self.lines:
+            if keywords.intersection(line.keywords):
+                line.comment()
+
+    def delete(self, keywords) -> None:
+        """Delete all lines that contain any of `keywords`."""
+        keywords = set(keywords)
+        self.lines = [line for line in self.lines if not keywords.intersection(line.keywords)]
+
+    def delete_lines(self, text: str) -> None:
+        """Delete all lines that contain the substring `text`."""
+        self.lines = [line for line in self.lines if text not in line.text]
+
+    def append(self, text: str) -> None:
+        if self.lines and not self.lines[-1].text.endswith("\n"):
+            self.lines[-1].text += "\n"
+            self.lines[-1].parse()
+        self.lines.append(XDSLine(text.rstrip("\n") + "\n"))
+
+    def insert(self, index: int, text: str) -> None:
+        self.lines.insert(index, XDSLine(text.rstrip("\n") + "\n"))
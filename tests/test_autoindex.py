@@ -0,0 +1,72 @@
+import json
+import os
+import stat
+import sys
+
+import pytest
+
+from edtools import autoindex
+from edtools.runlog import RunLog
+
+pytestmark = pytest.mark.skipif(sys.platform == "win32", reason="fake XDS is a shell script")
+
+FAKE_XDS = """#!/bin/sh
+cp XDS.INP XDS.INP.run
+if [ -r /proc/$$/status ]; then
+    sleep 0.2
+    grep Cpus_allowed_list /proc/$$/status > affinity
+fi
+for job in XYCORR INIT; do
+    printf ' cpu time used                 1.2 sec\\n elapsed wall-clock time       0.3 sec\\n' > $job.LP
+done
+exit 0
+"""
+
+
+@pytest.fixture
+def fake_xds(tmp_path, monkeypatch):
+    bindir = tmp_path / "bin"
+    bindir.mkdir()
+    exe = bindir / "xds_par"
+    exe.write_text(FAKE_XDS)
+    exe.chmod(exe.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setenv("PATH", f"{bindir}{os.pathsep}{os.environ['PATH']}")
+
+    drc = tmp_path / "data"
+    drc.mkdir()
+    (drc / "XDS.INP").write_text("JOB= XYCORR INIT COLSPOT IDXREF\n")
+    return drc
+
+
+def test_xds_index_runlog(fake_xds, tmp_path, monkeypatch):
+    log = RunLog(tmp_path / "autoindex_log.jsonl")
+    monkeypatch.setattr(autoindex, "runlog", log)
+    monkeypatch.setattr(autoindex, "results", [])
+
+    result = autoindex.xds_index(fake_xds, sequence=3)
+
+    assert result.ok
+    records = log.read()
+    assert len(records) == 1
+    record = records[0]
+    assert record["directory"] == str(fake_xds)
+    assert record["sequence"] == 3
+    assert record["returncode"] == 0
+    assert record["steps"]["XYCORR"] == {"cpu": 1.2, "wall": 0.3}
+    json.dumps(record)
+
+
+def test_xds_index_cores(fake_xds, monkeypatch):
+    monkeypatch.setattr(autoindex, "results", [])
+    original = (fake_xds / "XDS.INP").read_text()
+    cpus = sorted(os.sched_getaffinity(0))[:1] if hasattr(os, "sched_getaffinity") else None
+
+    result = autoindex.xds_index(fake_xds, cores=2, cpus=cpus)
+
+    assert result.ok
+    during = (fake_xds / "XDS.INP.run").read_text()
+    assert "MAXIMUM_NUMBER_OF_JOBS= 1" in during
+    assert "MAXIMUM_NUMBER_OF_PROCESSORS= 2" in during
+    assert (fake_xds / "XDS.INP").read_text() == original
+    if cpus and (fake_xds / "affinity").exists():
+        assert (fake_xds / "affinity").read_text().split()[-1] == str(cpus[0])
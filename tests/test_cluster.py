@@ -0,0 +1,97 @@
+import os
+import stat
+import sys
+
+import pytest
+
+from edtools import cluster
+from edtools.cache import ResultCache
+
+pytestmark = pytest.mark.skipif(sys.platform == "win32", reason="fake XSCALE is a shell script")
+
+FAKE_XSCALE = """#!/bin/sh
+echo run >> ../xscale_runs
+printf '      0.80 1000 500 600 83.3%% 10.0%% 11.0%% 900 5.5 12.0%% 98.7*\\n    total 1000 500 600 83.3%% 10.0%% 11.0%% 900 5.5 12.0%% 98.7*\\n' > XSCALE.LP
+touch MERGED.HKL
+exit ${XSCALE_STATUS:-0}
+"""
+
+FAKE_XDSCONV = """#!/bin/sh
+touch XDSCONV.LP shelx.hkl
+exit ${XDSCONV_STATUS:-0}
+"""
+
+
+def install(bindir, name, script):
+    exe = bindir / name
+    exe.write_text(script)
+    exe.chmod(exe.stat().st_mode | stat.S_IEXEC)
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    bindir = tmp_path / "bin"
+    bindir.mkdir()
+    install(bindir, "xscale", FAKE_XSCALE)
+    install(bindir, "xdsconv", FAKE_XDSCONV)
+    monkeypatch.setenv("PATH", f"{bindir}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setattr(cluster, "POINTLESS", False)
+    monkeypatch.setattr(cluster, "cache", ResultCache(tmp_path / "cache"))
+
+    for name, data in (("a", "1 2 3\n"), ("b", "4 5 6\n")):
+        drc = tmp_path / "data" / name
+        drc.mkdir(parents=True)
+        (drc / "XDS_ASCII.HKL").write_text(data)
+
+    drc = tmp_path / "run"
+    drc.mkdir()
+    monkeypatch.chdir(drc)
+    return tmp_path
+
+
+def make_clusters(fns, number=1, distance_cutoff=0.5):
+    return {number: {"files": fns, "n_clust": len(fns), "clust": list(range(len(fns))),
+                     "distance_cutoff": distance_cutoff, "method": "average"}}
+
+
+def xscale_runs(workdir):
+    fn = workdir / "run" / "xscale_runs"
+    return len(fn.read_text().splitlines()) if fn.exists() else 0
+
+
+def test_xscale_cache_ignores_comments_and_paths(workdir):
+    fns = [workdir / "data" / "a" / "XDS_ASCII.HKL", workdir / "data" / "b" / "XDS_ASCII.HKL"]
+    results = cluster.run_xscale(make_clusters(fns), cell="10 10 10 90 90 90", spgr="1")
+    assert xscale_runs(workdir) == 1
+    assert results[0]["N_obs"] == 1000
+
+    # same data from another location, in a cluster with another description
+    moved = workdir / "moved"
+    (workdir / "data").rename(moved)
+    fns = [moved / "a" / "XDS_ASCII.HKL", moved / "b" / "XDS_ASCII.HKL"]
+    results = cluster.run_xscale(make_clusters(fns, number=2, distance_cutoff=0.7), cell="10 10 10 90 90 90", spgr="1")
+    assert xscale_runs(workdir) == 1
+    assert results[0]["N_obs"] == 1000
+
+    # different data
+    fns[1].write_text("7 8 9\n")
+    cluster.run_xscale(make_clusters(fns, number=3), cell="10 10 10 90 90 90", spgr="1")
+    assert xscale_runs(workdir) == 2
+
+
+@pytest.mark.parametrize("failing", ["XSCALE_STATUS", "XDSCONV_STATUS"])
+def test_xscale_cache_not_stored_on_failure(workdir, monkeypatch, failing):
+    fns = [workdir / "data" / "a" / "XDS_ASCII.HKL"]
+    monkeypatch.setenv(failing, "1")
+    cluster.run_xscale(make_clusters(fns), cell="10 10 10 90 90 90", spgr="1")
+    assert not list((workdir / "cache").glob("*/*/result.json"))
+
+    monkeypatch.delenv(failing)
+    cluster.run_xscale(make_clusters(fns), cell="10 10 10 90 90 90", spgr="1")
+    assert xscale_runs(workdir) == 2
+    assert len(list((workdir / "cache").glob("*/*/result.json"))) == 1
+
+
+def test_strip_comments():
+    inp = "! Cluster items: [1, 2]\n\nSNRC= 2\n    ! /data/a/XDS_ASCII.HKL\n    INPUT_FILE= 1_XDS_ASCII.HKL ! note\n"
+    assert cluster.strip_comments(inp) == "SNRC= 2\n    INPUT_FILE= 1_XDS_ASCII.HKL"
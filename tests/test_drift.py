@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+from scipy import ndimage
+
+from edtools.drift import phase_correlation, track_drift
+
+
+def beam(center, shape=(32, 32), width=3.0):
+    yy, xx = np.mgrid[:shape[0], :shape[1]]
+    return 30000 * np.exp(-0.5 * ((yy - center[0])**2 + (xx - center[1])**2) / width**2)
+
+
+SHIFTS = np.array([(0.0, 0.0), (1.3, -0.7), (-2.4, 0.25), (0.5, 3.5), (-4.0, -1.2)])
+
+
+def test_phase_correlation_recovers_shift():
+    reference = beam((16, 16))
+    stack = np.array([beam((16 - dy, 16 - dx)) for dy, dx in SHIFTS])
+    shifts = phase_correlation(stack, reference)
+    np.testing.assert_allclose(shifts, SHIFTS, atol=0.05)
+
+    # `ndimage.shift(stack[i], shifts[i])` matches the reference
+    for frame, shift in zip(stack, shifts):
+        moved = ndimage.shift(frame, shift, order=3, mode="nearest")
+        assert np.abs(moved - reference).max() < 0.02 * reference.max()
+
+
+def test_phase_correlation_single_frame():
+    reference = beam((16, 16))
+    shift = phase_correlation(beam((14.5, 17.2)), reference)
+    assert shift.shape == (2,)
+    np.testing.assert_allclose(shift, (1.5, -1.2), atol=0.05)
+
+
+@pytest.mark.parametrize("running", [False, True])
+def test_track_drift(running):
+    template = beam((16, 16))
+    drift = np.c_[np.linspace(0, 3, 10), np.linspace(0, -2, 10)]
+    stack = np.array([beam((16 + dy, 16 + dx)) for dy, dx in drift])
+    shifts = track_drift(stack, template, running=running)
+    np.testing.assert_allclose(shifts, -drift, atol=0.1)
+
+
+def test_track_drift_smooth():
+    template = beam((16, 16))
+    drift = np.c_[np.linspace(0, 3, 10), np.zeros(10)]
+    stack = np.array([beam((16 + dy, 16 + dx)) for dy, dx in drift])
+    # a linear trajectory is not changed by the smoothing, except at the ends
+    shifts = track_drift(stack, template, smooth=1.0)
+    np.testing.assert_allclose(shifts[2:-2], -drift[2:-2], atol=0.1)
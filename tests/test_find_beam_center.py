@@ -0,0 +1,58 @@
+from pathlib import Path
+
+import pandas as pd
+
+from edtools.find_beam_center import apply_centers, output_template, process_dataset, write_center_summary
+from edtools.update_xds import read_plan
+from edtools.xds_inp import XDSInput
+
+
+def test_center_summary_next_to_data_sets(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    results = [{"directory": str(tmp_path / "data" / name / "SMV"), "ORGX": 256.1, "ORGY": 250.2, "n_frames": 10}
+               for name in ("e1", "e2")]
+    for result in results:
+        Path(result["directory"]).mkdir(parents=True)
+    write_center_summary(results)
+
+    fn = tmp_path / "data" / "beam_centers.csv"
+    assert fn.exists()
+    assert not Path("beam_centers.csv").exists()
+    assert list(pd.read_csv(fn)["ORGX"]) == [256.1, 256.1]
+
+    # the table can be used as an update plan from any directory
+    plan = read_plan(fn)
+    assert sorted(plan) == [(tmp_path / "data" / name / "SMV" / "XDS.INP").resolve() for name in ("e1", "e2")]
+
+    monkeypatch.chdir(tmp_path / "data")
+    write_center_summary([dict(result, directory=f"{name}/SMV") for result, name in zip(results, ("e1", "e2"))],
+                         fn=tmp_path / "centers.csv")
+    assert sorted(read_plan(tmp_path / "centers.csv")) == sorted(plan)
+
+
+def test_process_dataset_reports_error(tmp_path, capsys):
+    (tmp_path / "data").mkdir()
+    assert process_dataset(tmp_path / "XDS.INP") is None
+    out = capsys.readouterr().out
+    assert "Beam center finding was interrupted" in out
+    assert "(IndexError: " in out  # no frames
+
+
+def test_output_template(tmp_path):
+    fn = tmp_path / "XDS.INP"
+    fn.write_text("NAME_TEMPLATE_OF_DATA_FRAMES= data/00???.cbf   CBF\nDATA_RANGE= 1 10\n")
+    assert output_template(fn, "corrected") == "corrected/00???.img   SMV"
+
+    fn.write_text("DATA_RANGE= 1 10\n")
+    assert output_template(fn, "corrected") is None
+
+
+def test_apply_centers_output(tmp_path):
+    fn = tmp_path / "XDS.INP"
+    fn.write_text("NAME_TEMPLATE_OF_DATA_FRAMES= data/00???.img   SMV\nORGX= 0 ORGY= 0\n")
+    apply_centers([{"directory": str(tmp_path), "ORGX": 256.1, "ORGY": 250.2,
+                    "NAME_TEMPLATE_OF_DATA_FRAMES": output_template(fn, "corrected")}])
+
+    inp = XDSInput.read(fn)
+    assert inp.get("NAME_TEMPLATE_OF_DATA_FRAMES") == "corrected/00???.img   SMV"
+    assert float(inp.get("ORGX")) == 256.1
@@ -0,0 +1,181 @@
+import numpy as np
+import pytest
+
+from edtools.hkl_io import (INTEGRATE_COLUMNS, format_shelx_hkl, parse_header_line, read_header, read_shelx_hkl,
+                            read_xds_hkl, write_shelx_hkl)
+
+
+def reference_value(value, decimals=2):
+    """`%8.2f`, with fewer decimals if the value does not fit."""
+    for d in range(decimals, -1, -1):
+        s = f"%8.{d}f" % value
+        if len(s) <= 8:
+            return s
+    raise ValueError(value)
+
+
+def reference_hkl(hkl, intensity, sigma, decimals=2):
+    """The `%4d%4d%4d%8.2f%8.2f` loop that `format_shelx_hkl` replaced."""
+    lines = []
+    for (h, k, l), i, s in zip(hkl, intensity, sigma):
+        lines.append("%4d%4d%4d" % (h, k, l) + reference_value(i, decimals) + reference_value(s, decimals) + "\n")
+    lines.append("   0   0   0    0.00    0.00\n")
+    return "".join(lines).encode()
+
+
+def reflections(n=2000, seed=0):
+    rng = np.random.default_rng(seed)
+    hkl = rng.integers(-150, 150, size=(n, 3))
+    intensity = rng.normal(0, 1, n) * 10.0 ** rng.integers(-4, 5, n)
+    sigma = np.abs(rng.normal(0, 1, n)) * 10.0 ** rng.integers(-4, 4, n)
+    # values that round to zero, with and without sign, and values that
+    # need fewer decimals to fit in 8 characters
+    intensity[:8] = [-0.001, -0.0049, 0.004, -0.0, 0.0, 99999.99, -9999.999, -123456.7]
+    sigma[:4] = [1234567.4, 99999.996, 0.005, 0.015]
+    return hkl, intensity, sigma
+
+
+def test_format_shelx_hkl_matches_percent_formatting():
+    hkl, intensity, sigma = reflections()
+    assert format_shelx_hkl(hkl, intensity, sigma) == reference_hkl(hkl, intensity, sigma)
+
+
+def test_format_shelx_hkl_fewer_decimals():
+    buf = format_shelx_hkl([[1, 2, 3], [-1, -2, -3]], [-123456.7, 12345.678], [1234567.4, -99999.99], terminate=False)
+    assert buf == b"   1   2   3 -123457 1234567\n  -1  -2  -312345.68 -100000\n"
+
+
+@pytest.mark.parametrize("hkl, intensity", [([[1, 2, 3]], [-12345678.0]), ([[1, 2, 3]], [1e9]), ([[10000, 0, 0]], [1.0])])
+def test_format_shelx_hkl_overflow(hkl, intensity):
+    with pytest.raises(ValueError):
+        format_shelx_hkl(hkl, intensity, [1.0])
+
+
+def test_shelx_hkl_round_trip(tmp_path):
+    hkl, intensity, sigma = reflections()
+    fn = tmp_path / "shelx.hkl"
+    write_shelx_hkl(fn, hkl, intensity, sigma)
+
+    arr = read_shelx_hkl(fn)
+    assert len(arr) == len(hkl)
+    np.testing.assert_array_equal(np.column_stack([arr["H"], arr["K"], arr["L"]]), hkl)
+    expected = [[float(reference_value(i)), float(reference_value(s))] for i, s in zip(intensity, sigma)]
+    np.testing.assert_array_equal(np.column_stack([arr["I"], arr["SIGMA"]]), expected)
+
+
+def test_read_shelx_hkl_touching_fields(tmp_path):
+    fn = tmp_path / "shelx.hkl"
+    fn.write_bytes(b"  12-120  -3-1234.5612345.67\n\n   1   0   0    1.00    0.10   1\n   0   0   0    0.00    0.00\n   5   5   5    1.00    1.00\n")
+    arr = read_shelx_hkl(fn)
+    assert arr.tolist() == [(12, -120, -3, -1234.56, 12345.67), (1, 0, 0, 1.0, 0.1)]
+
+
+XDS_ASCII_HEADER = """\
+!FORMAT=XDS_ASCII    MERGE=FALSE    FRIEDEL'S_LAW=FALSE
+!OUTPUT_FILE=XDS_ASCII.HKL        DATE=22-Jan-2019
+!Generated by CORRECT   (VERSION Jan 26, 2018  BUILT=20180126)   22-Jan-2019
+!PROFILE_FITTING= TRUE
+!NAME_TEMPLATE_OF_DATA_FRAMES=/data/SMV/data/00???.img   SMV
+!DATA_RANGE=       1     100
+!ROTATION_AXIS=  -0.999961  0.008832  0.000000
+!OSCILLATION_RANGE=  0.300000
+!STARTING_ANGLE=   -30.000
+!SPACE_GROUP_NUMBER=   5
+!UNIT_CELL_CONSTANTS=    10.100    11.200    12.300  90.000  95.000  90.000
+!NX=   512  NY=   512    QX=  0.055000  QY=  0.055000
+!ORGX=   255.40  ORGY=   262.10
+!NUMBER_OF_ITEMS_IN_EACH_DATA_RECORD=8
+!ITEM_H=1
+!ITEM_K=2
+!ITEM_L=3
+!ITEM_IOBS=4
+!ITEM_SIGMA(IOBS)=5
+!ITEM_XD=6
+!ITEM_YD=7
+!ITEM_ZD=8
+!END_OF_HEADER
+"""
+
+XDS_ASCII_DATA = """\
+     1     2     3  1.234E+02  5.678E+00   100.0   200.0    3.5
+    -1    -2     0  9.870E+01  4.321E+00   110.5   210.0   12.0
+"""
+
+INTEGRATE_HEADER = """\
+!OUTPUT_FILE=INTEGRATE.HKL    DATE=22-Jan-2019
+!Generated by INTEGRATE   (VERSION Jan 26, 2018  BUILT=20180126)   22-Jan-2019
+!STARTING_ANGLE=   -30.000
+!OSCILLATION_RANGE=  0.300000
+!END_OF_HEADER
+"""
+
+INTEGRATE_DATA = (" ".join(["1", "2", "3"] + ["%.1f" % x for x in range(1, 18)] + ["1"]) + "\n"
+                  + " ".join(["-1", "0", "4"] + ["%.1f" % -x for x in range(1, 18)] + ["2"]) + "\n")
+
+
+def test_parse_header_line():
+    assert parse_header_line("!NX=   512  NY=   512    QX=  0.055000  QY=  0.055000") == {
+        "NX": 512, "NY": 512, "QX": 0.055, "QY": 0.055}
+    assert parse_header_line("!Generated by CORRECT   (VERSION Jan 26, 2018  BUILT=20180126)   22-Jan-2019") == {
+        "BUILT": 20180126}
+    assert parse_header_line("!UNIT_CELL_CONSTANTS=    10.100    11.200    12.300  90.000  95.000  90.000") == {
+        "UNIT_CELL_CONSTANTS": [10.1, 11.2, 12.3, 90.0, 95.0, 90.0]}
+
+
+def test_read_header(tmp_path):
+    fn = tmp_path / "XDS_ASCII.HKL"
+    fn.write_text(XDS_ASCII_HEADER + XDS_ASCII_DATA + "!END_OF_DATA\n")
+    header, offset = read_header(fn)
+
+    assert offset == len(XDS_ASCII_HEADER.encode())
+    assert header["FORMAT"] == "XDS_ASCII"
+    assert header["FRIEDEL'S_LAW"] == "FALSE"
+    assert header["DATE"] == "22-Jan-2019"
+    assert header["BUILT"] == 20180126
+    assert header["NAME_TEMPLATE_OF_DATA_FRAMES"] == "/data/SMV/data/00???.img   SMV"
+    assert header["DATA_RANGE"] == [1, 100]
+    assert header["STARTING_ANGLE"] == -30.0
+    assert header["SPACE_GROUP_NUMBER"] == 5
+    assert header["ORGX"] == 255.4 and header["ORGY"] == 262.1
+    assert header["ITEM_SIGMA(IOBS)"] == 5
+
+
+def test_read_xds_ascii(tmp_path):
+    fn = tmp_path / "XDS_ASCII.HKL"
+    # anything after !END_OF_DATA is not read
+    fn.write_text(XDS_ASCII_HEADER + XDS_ASCII_DATA + "!END_OF_DATA\n     9     9     9  1.0  1.0  1.0  1.0  1.0\n")
+    arr, header = read_xds_hkl(fn)
+
+    assert arr.dtype.names == ("H", "K", "L", "IOBS", "SIGMA(IOBS)", "XD", "YD", "ZD")
+    assert arr["H"].dtype == np.int32
+    assert arr[["H", "K", "L"]].tolist() == [(1, 2, 3), (-1, -2, 0)]
+    np.testing.assert_allclose(arr["IOBS"], [123.4, 98.7])
+    np.testing.assert_allclose(arr["ZD"], [3.5, 12.0])
+    assert header["SPACE_GROUP_NUMBER"] == 5
+
+    df, _ = read_xds_hkl(fn, as_frame=True)
+    assert list(df.columns) == list(arr.dtype.names)
+    assert len(df) == 2
+
+
+def test_read_integrate_hkl(tmp_path):
+    fn = tmp_path / "INTEGRATE.HKL"
+    fn.write_text(INTEGRATE_HEADER + INTEGRATE_DATA + "!END_OF_DATA\n")
+    arr, header = read_xds_hkl(fn)
+
+    assert arr.dtype.names == INTEGRATE_COLUMNS
+    assert arr[["H", "K", "L", "ISEG"]].tolist() == [(1, 2, 3, 1), (-1, 0, 4, 2)]
+    np.testing.assert_allclose(arr["ZOBS"], [12.0, -12.0])
+    assert header["OSCILLATION_RANGE"] == 0.3
+
+
+@pytest.mark.parametrize("end", ["!END_OF_DATA\n", ""])
+def test_read_xds_hkl_empty(tmp_path, end):
+    fn = tmp_path / "XDS_ASCII.HKL"
+    fn.write_text(XDS_ASCII_HEADER + end)
+    arr, header = read_xds_hkl(fn)
+
+    assert len(arr) == 0
+    assert arr.dtype.names[:3] == ("H", "K", "L")
+    df, _ = read_xds_hkl(fn, as_frame=True)
+    assert len(df) == 0
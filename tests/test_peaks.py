@@ -0,0 +1,100 @@
+import numpy as np
+import pytest
+from scipy import interpolate, ndimage
+
+from edtools.find_beam_center import find_beam_center, find_beam_centers
+from edtools.peaks import find_peak_positions
+
+
+def old_find_peak_max(arr, sigma, m=50, w=10, kind=3):
+    """The interp1d upsampling that `peaks.find_peak_positions` replaced."""
+    y1 = ndimage.gaussian_filter1d(arr, sigma)
+    c1 = np.argmax(y1)
+
+    win_len = 2 * w + 1
+
+    try:
+        r1 = np.linspace(c1 - w, c1 + w, win_len)
+        f = interpolate.interp1d(r1, y1[c1 - w: c1 + w + 1], kind=kind)
+        r2 = np.linspace(c1 - w, c1 + w, win_len * m)
+        y2 = f(r2)
+        c2 = np.argmax(y2) / m
+    except ValueError:
+        return c1
+
+    return c2 + c1 - w
+
+
+def old_find_beam_center(img, sigma=30, m=100, kind=3):
+    img_thresh = img.copy()
+    img_thresh[img_thresh < 7000] = 0
+    xx = np.sum(img_thresh, axis=1)
+    yy = np.sum(img_thresh, axis=0)
+    return np.array([old_find_peak_max(xx, sigma, m=m, kind=kind), old_find_peak_max(yy, sigma, m=m, kind=kind)])
+
+
+def gaussian_profiles(centers, length=32, width=3.0):
+    x = np.arange(length)
+    return np.exp(-0.5 * ((x - np.asarray(centers)[:, None]) / width)**2)
+
+
+def beam_image(tx, ty, shape=(512, 512), width=3.0):
+    yy, xx = np.mgrid[:shape[0], :shape[1]]
+    return 30000 * np.exp(-0.5 * ((yy - tx)**2 + (xx - ty)**2) / width**2)
+
+
+CENTERS = np.linspace(14.0, 18.0, 17)  # sub-pixel centers in a 32 px beam window
+
+
+@pytest.mark.parametrize("method, tol", [("gaussian", 0.01), ("parabolic", 0.1), ("centroid", 0.05)])
+def test_find_peak_positions_accuracy(method, tol):
+    pos = find_peak_positions(gaussian_profiles(CENTERS), sigma=5, method=method)
+    assert np.abs(pos - CENTERS).max() < tol
+
+
+def test_find_peak_positions_single_profile():
+    profiles = gaussian_profiles(CENTERS)
+    batch = find_peak_positions(profiles, sigma=5)
+    single = [find_peak_positions(profile, sigma=5) for profile in profiles]
+    np.testing.assert_allclose(batch, single)
+
+
+def test_old_upsampling_is_biased():
+    # the upsampled grid step is 2w / (m (2w + 1) - 1) px, but the index was
+    # divided by m, which puts the peak about 0.5 px too far
+    old = np.array([old_find_peak_max(profile, 5) for profile in gaussian_profiles(CENTERS)])
+    new = find_peak_positions(gaussian_profiles(CENTERS), sigma=5)
+    bias = old - CENTERS
+    assert np.all((bias > 0.4) & (bias < 0.6))
+    np.testing.assert_allclose(old - new, bias, atol=0.01)
+
+
+@pytest.mark.parametrize("tx, ty", [(250.3, 260.7), (255.5, 248.2), (262.9, 251.05)])
+def test_xds_origin(tx, ty):
+    """ORGX/ORGY as computed in `process_dataset`: window origin + sub-pixel
+    position in the window + 1 (XDS counts pixels from 1)."""
+    img = beam_image(tx, ty)
+
+    center_x, center_y = find_beam_center(img)
+    x0 = int(round(center_x - 16))
+    y0 = int(round(center_y - 16))
+    center_x_new, center_y_new = find_beam_center(img[x0:x0 + 32, y0:y0 + 32], sigma=5)
+
+    assert abs(x0 + center_x_new + 1 - (tx + 1)) < 0.05
+    assert abs(y0 + center_y_new + 1 - (ty + 1)) < 0.05
+
+    # the old empirical `center - 16 + c_new + 0.8` only absorbed the bias
+    # on average, the error depends on the rounding of the window origin
+    old_x, old_y = old_find_beam_center(img)
+    assert abs(old_x - tx - 0.5) < 0.1
+    window = img[int(round(old_x - 16)):int(round(old_x + 16)), int(round(old_y - 16)):int(round(old_y + 16))]
+    old_x_new, _ = old_find_beam_center(window, sigma=5)
+    old_error = old_x - 16 + old_x_new + 0.8 - (tx + 1)
+    assert abs(old_error) > abs(x0 + center_x_new - tx)
+
+
+def test_find_beam_centers_stack():
+    shifts = [(0.0, 0.0), (1.3, -0.7), (-2.4, 0.25)]
+    stack = np.array([beam_image(16 + dx, 16 + dy, shape=(32, 32)) for dx, dy in shifts])
+    centers = find_beam_centers(stack, sigma=5)
+    np.testing.assert_allclose(centers, 16 + np.array(shifts), atol=0.05)
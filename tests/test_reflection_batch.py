@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+from edtools.hkl_io import read_shelx_hkl
+from edtools.reflection_batch import output_names, process_many
+
+HEADER = """!FORMAT=XDS_ASCII    MERGE=FALSE    FRIEDEL'S_LAW=TRUE
+!NX=   512  NY=   512    QX=  0.055000  QY=  0.055000
+!ORGX=   255.50  ORGY=   257.25
+!ROTATION_AXIS= -0.998 0.061 0.000
+!STARTING_ANGLE=   -30.000
+!OSCILLATION_RANGE=  0.230000
+!NUMBER_OF_ITEMS_IN_EACH_DATA_RECORD=21
+!END_OF_HEADER
+"""
+
+
+def write_integrate_hkl(fn, n=50, seed=0):
+    rng = np.random.default_rng(seed)
+    with open(fn, "w") as f:
+        f.write(HEADER)
+        for _ in range(n):
+            h, k, l = rng.integers(-5, 6, 3)
+            f.write(f"{h:6d}{k:6d}{l:6d} {rng.random() * 1000:.3E} {rng.random() * 10:.3E}"
+                    f" 100.0 200.0 10.0 1.000E+00 100  95   12"
+                    f" {rng.random() * 512:7.1f}{rng.random() * 512:7.1f}{rng.random() * 100:9.1f}"
+                    f"  -0.00   0.06   0.00   0.06   0.00    1\n")
+        f.write("!END_OF_DATA\n")
+
+
+def test_output_names_unique_for_smv_layout(tmp_path):
+    fns = []
+    for i, name in enumerate(("e1", "e2")):
+        drc = tmp_path / name / "SMV"
+        drc.mkdir(parents=True)
+        fns.append(drc / "INTEGRATE.HKL")
+        write_integrate_hkl(fns[-1], seed=i)
+
+    outdir = tmp_path / "out"
+    outdir.mkdir()
+    outs = output_names(fns, "transform", outdir=outdir)
+    assert [out.name for out in outs] == ["e1_SMV_INTEGRATE_transform.hkl", "e2_SMV_INTEGRATE_transform.hkl"]
+
+    results = process_many("transform", fns, n_jobs=2, outdir=outdir)
+    assert all(error is None for _, _, error in results)
+    first, second = (read_shelx_hkl(out) for out in outs)
+    assert len(first) == len(second) == 50
+    assert not np.array_equal(first, second)
+
+
+def test_output_names_duplicate_input(tmp_path):
+    fn = tmp_path / "INTEGRATE.HKL"
+    with pytest.raises(ValueError):
+        output_names([fn, fn], "transform", outdir=tmp_path / "out")
@@ -0,0 +1,176 @@
+import itertools
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from edtools.reflection_ops import (asu_representatives, friedel_differences, friedel_pairs, group_reflections,
+                                   scale_intensities, split_groups)
+
+# point group mmm (P2/m 2/m 2/m): all sign changes of h, k, l
+MMM = np.array([np.diag(signs) for signs in itertools.product((1, -1), repeat=3)])
+# point group 222: the proper rotations of mmm
+P222 = np.array([r for r in MMM if round(np.linalg.det(r)) == 1])
+
+
+def old_representative(h, rotations, anomalous=False):
+    """Largest (h, k, l) among the equivalents of `h`, one by one."""
+    equivalents = [tuple(np.dot(h, r)) for r in rotations]
+    if not anomalous:
+        equivalents += [tuple(-x for x in e) for e in equivalents]
+    return max(equivalents)
+
+
+def random_reflections(n=300, seed=0):
+    rng = np.random.default_rng(seed)
+    hkl = rng.integers(-4, 5, size=(n, 3))
+    intensity = rng.permutation(n) * 1.5 + rng.random(n)  # distinct, no ties in the sort
+    sigma = rng.random(n) + 0.1
+    return hkl, intensity, sigma
+
+
+def test_asu_representatives_mmm_orbit():
+    hkl = np.array([1, -2, 3])
+    orbit = np.array([hkl * np.diag(r) for r in MMM])
+    rep = asu_representatives(orbit, MMM)
+    np.testing.assert_array_equal(rep, np.tile([1, 2, 3], (len(MMM), 1)))
+
+
+def test_asu_representatives_anomalous():
+    orbit = np.array([np.dot([1, 2, 3], r) for r in P222])
+    rep = asu_representatives(orbit, P222, anomalous=True)
+    assert len(np.unique(rep, axis=0)) == 1
+    friedel = asu_representatives(-orbit, P222, anomalous=True)
+    assert not np.array_equal(rep[0], friedel[0])
+
+    # without `anomalous`, the Friedel mates are equivalent
+    assert len(np.unique(asu_representatives(np.vstack([orbit, -orbit]), P222), axis=0)) == 1
+
+
+@pytest.mark.parametrize("rotations, anomalous", [(MMM, False), (P222, False), (P222, True)])
+def test_asu_representatives_matches_loop(rotations, anomalous):
+    hkl, _, _ = random_reflections()
+    rep = asu_representatives(hkl, rotations, anomalous=anomalous, chunk=64)
+    expected = [old_representative(h, rotations, anomalous=anomalous) for h in hkl]
+    np.testing.assert_array_equal(rep, expected)
+
+
+def old_group(hkl, intensity, sigma, rotations):
+    """The pandas grouping of the old `group_df`: average duplicate indices,
+    then group by the representative of the equivalents."""
+    df = pd.DataFrame({"indice": [tuple(h) for h in hkl], "I": intensity, "sigma": sigma})
+    df = df.groupby("indice").mean().reset_index()
+    df["indice2"] = [old_representative(h, rotations) for h in df["indice"]]
+    return df
+
+
+def test_group_reflections_matches_pandas():
+    hkl, intensity, sigma = random_reflections()
+    grouped = group_reflections(hkl, intensity, sigma, MMM)
+    old = old_group(hkl, intensity, sigma, MMM)
+
+    assert len(grouped) == len(old)
+    new_groups = {frozenset(map(tuple, g[["H", "K", "L"]].to_numpy())) for _, g in grouped.groupby("GROUP")}
+    old_groups = {frozenset(g["indice"]) for _, g in old.groupby("indice2")}
+    assert new_groups == old_groups
+
+    new = grouped.set_index(grouped[["H", "K", "L"]].apply(tuple, axis=1))
+    old = old.set_index("indice").loc[new.index]
+    np.testing.assert_allclose(new["I"], old["I"])
+    np.testing.assert_allclose(new["SIGMA"], old["sigma"])
+
+    # sorted by group, and by intensity within a group
+    assert np.all(np.diff(grouped["GROUP"]) >= 0)
+    for _, g in grouped.groupby("GROUP"):
+        assert np.all(np.diff(g["I"]) >= 0)
+
+
+@pytest.mark.parametrize("ratio", [0.0, 0.3, 0.5, 0.75, 1.0])
+def test_split_groups_matches_pandas(ratio):
+    hkl, intensity, sigma = random_reflections()
+    grouped = group_reflections(hkl, intensity, sigma, MMM)
+
+    old = old_group(hkl, intensity, sigma, MMM)
+    # `groupby("indice2").apply(lambda x: x.iloc[int(x.I.size * ratio):])` on the sorted groups
+    old = old.sort_values(["indice2", "I"])
+    larger = pd.concat([x.iloc[int(x.I.size * ratio):] for _, x in old.groupby("indice2")])
+
+    upper = split_groups(grouped["GROUP"].to_numpy(), ratio=ratio)
+    selected = set(map(tuple, grouped.loc[upper, ["H", "K", "L"]].to_numpy()))
+    assert selected == set(larger["indice"])
+
+
+def test_scale_intensities_matches_loop():
+    def scaling_func(value, power):
+        if value > 0:
+            return (1 + value) ** power
+        return -(1 - value) ** power
+
+    intensity = np.array([-5.0, -0.5, 0.0, 0.5, 20.0])
+    sigma = np.array([1.0, 0.2, 0.3, 0.1, 2.0])
+    power = 0.7
+    scaled, scaled_sigma = scale_intensities(intensity, sigma, power)
+    np.testing.assert_allclose(scaled, [scaling_func(i, power) * i for i in intensity])
+    np.testing.assert_allclose(scaled_sigma, [s * power * scaling_func(i, power - 1) for i, s in zip(intensity, sigma)])
+
+
+def old_friedel(iobs, hkl):
+    """The O(N^2) loop of the old `check_I_frame_seq`: for every reflection,
+    look for its Friedel mate among the later reflections."""
+    hkl = [tuple(h) for h in hkl]
+    pairs = []
+    n_mates = np.zeros(len(hkl), dtype=int)
+    for i in range(len(hkl) - 1):
+        target = tuple(-x for x in hkl[i])
+        found = [j for j in range(i + 1, len(hkl)) if hkl[j] == target]
+        n_mates[i] = len(found)
+        if len(found) == 1:
+            pairs.append((i, found[0], iobs[i] - iobs[found[0]]))
+    return pairs, n_mates
+
+
+def friedel_reflections(n=400, seed=0):
+    rng = np.random.default_rng(seed)
+    hkl = rng.integers(-2, 3, size=(n, 3))  # small range, many mates and duplicates
+    hkl[:6] = [[0, 0, 0], [1, 2, 3], [0, 0, 0], [-1, -2, -3], [-1, -2, -3], [0, 0, 0]]
+    iobs = rng.normal(100, 30, n)
+    frames = np.sort(rng.uniform(1, 50, n))
+    return iobs, hkl, frames
+
+
+def test_friedel_pairs_matches_loop():
+    iobs, hkl, _ = friedel_reflections()
+    first, second, n_mates = friedel_pairs(hkl)
+    pairs, old_n_mates = old_friedel(iobs, hkl)
+
+    np.testing.assert_array_equal(n_mates, old_n_mates)
+    assert list(zip(first, second)) == [(i, j) for i, j, _ in pairs]
+    assert np.any(n_mates > 1)
+
+
+def test_friedel_pairs_special_cases():
+    hkl = [[0, 0, 0], [1, 2, 3], [0, 0, 0], [-1, -2, -3], [-1, -2, -3], [0, 0, 0]]
+    first, second, n_mates = friedel_pairs(hkl)
+    # (0, 0, 0) is its own Friedel mate, (1, 2, 3) has two later mates
+    np.testing.assert_array_equal(n_mates, [2, 2, 1, 0, 0, 0])
+    assert list(zip(first, second)) == [(2, 5)]
+
+
+@pytest.mark.parametrize("n", [0, 1])
+def test_friedel_pairs_short(n):
+    first, second, n_mates = friedel_pairs(np.zeros((n, 3), dtype=int) + 1)
+    assert len(first) == len(second) == 0
+    assert len(n_mates) == n
+
+
+def test_friedel_differences_matches_loop():
+    iobs, hkl, frames = friedel_reflections()
+    total, stats, n_mates = friedel_differences(iobs, hkl, frames)
+    pairs, _ = old_friedel(iobs, hkl)
+
+    assert total == pytest.approx(sum(diff for _, _, diff in pairs))
+    assert stats["n_pairs"].sum() == len(pairs)
+    for frame, row in stats.iterrows():
+        diffs = [diff for i, _, diff in pairs if int(np.floor(frames[i])) == frame]
+        assert row["n_pairs"] == len(diffs)
+        assert row["diff_sum"] == pytest.approx(sum(diffs))
@@ -0,0 +1,49 @@
+import signal
+import subprocess as sp
+import sys
+import time
+
+import pytest
+
+from edtools import runlog, runner
+
+pytestmark = pytest.mark.skipif(sys.platform == "win32", reason="runs the WSL code path with /bin/sh")
+
+
+def test_wsl_command_with_arguments(monkeypatch):
+    # the command and its arguments must reach `bash -c` as one argument
+    monkeypatch.setattr(runner, "platform", "win32")
+    monkeypatch.setattr(runner, "bash_exe", "/bin/sh", raising=False)
+    monkeypatch.setattr(sp, "CREATE_NEW_PROCESS_GROUP", 0, raising=False)
+
+    result = runner.run("echo one two", capture=True)
+
+    assert result.ok
+    assert "one two" in result.output.splitlines()
+
+
+def test_input_and_capture():
+    result = runner.run("cat", input="one two\n", capture=True)
+    assert result.ok
+    assert result.output == "one two\n"
+    assert result.stats["returncode"] == 0
+
+
+def test_timeout_kills_process_group():
+    t0 = time.perf_counter()
+    result = runner.run("sleep 10 & sleep 10; wait", timeout=0.5)
+    assert result.timed_out
+    assert not result.ok
+    assert time.perf_counter() - t0 < 5
+
+
+def test_no_signal_after_reap(monkeypatch):
+    p = sp.Popen("exit 3", shell=True, start_new_session=True)
+    runlog.run_process(p, lock=runner._reap_lock)
+    assert p.returncode == 3
+
+    sent = []
+    monkeypatch.setattr(runner.os, "killpg", lambda pid, sig: sent.append((pid, sig)))
+    assert not runner._signal(p, signal.SIGTERM)
+    runner._kill(p)
+    assert sent == []
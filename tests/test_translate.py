@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+from scipy import ndimage
+
+from edtools.translate import shift_image, shift_integer, shift_stack, shift_subpixel
+
+
+def beam(center, shape=(64, 64), width=3.0, scale=30000.0):
+    yy, xx = np.mgrid[:shape[0], :shape[1]]
+    return scale * np.exp(-0.5 * ((yy - center[0])**2 + (xx - center[1])**2) / width**2)
+
+
+def centroid(img):
+    return np.array(ndimage.center_of_mass(img))
+
+
+@pytest.mark.parametrize("shift", [(0, 0), (3, -2), (-5, 7), (10, 0), (0, -12)])
+def test_shift_integer_matches_ndimage(shift):
+    arr = np.random.default_rng(0).random((20, 30))
+    expected = ndimage.shift(arr, shift, order=0, mode="nearest")
+    np.testing.assert_array_equal(shift_integer(arr, shift), expected)
+    np.testing.assert_array_equal(shift_image(arr, shift, order=0), expected)
+
+
+def test_shift_integer_fill():
+    arr = np.ones((5, 6))
+    out = shift_integer(arr, (2, -1), fill=0)
+    assert out[:2].sum() == 0 and out[:, -1].sum() == 0
+    assert out[2:, :-1].min() == 1
+
+    np.testing.assert_array_equal(shift_integer(arr * 2, (10, 0)), np.full((5, 6), 2.0))
+
+
+def test_shift_integer_recovers_beam():
+    out = shift_integer(beam((30, 32)), (4, -3))
+    np.testing.assert_allclose(centroid(out), (34, 29), atol=1e-6)
+
+
+@pytest.mark.parametrize("order", [1, 3, "fourier"])
+@pytest.mark.parametrize("shift", [(0.3, -0.7), (2.25, 1.5), (-3.6, 4.1)])
+def test_shift_subpixel_recovers_beam(order, shift):
+    center = np.array((31.2, 32.7))
+    out = shift_subpixel(beam(center), shift, order=order)
+    np.testing.assert_allclose(centroid(out), center + shift, atol=0.02)
+
+
+def test_shift_subpixel_dtype():
+    arr = beam((32, 32)).astype(np.uint16)
+    for order in (1, 3, "fourier"):
+        out = shift_subpixel(arr, (0.5, 0.5), order=order)
+        assert out.dtype == np.uint16
+    out = np.empty(arr.shape, dtype=np.float32)
+    assert shift_subpixel(arr, (0.5, 0.5), order="fourier", out=out) is out
+
+
+@pytest.mark.parametrize("order", [0, 1, 3, "fourier"])
+def test_shift_stack(order):
+    shifts = np.array([(0.0, 0.0), (1.3, -0.7), (-2.4, 0.25)])
+    stack = np.array([beam((32, 32)) for _ in shifts])
+    out = shift_stack(stack, shifts, order=order)
+
+    for frame, shift, frame_out in zip(stack, shifts, out):
+        np.testing.assert_allclose(frame_out, shift_image(frame, shift, order=order), atol=1e-6 * frame.max())
+    expected = 32 + (np.round(shifts) if order == 0 else shifts)
+    np.testing.assert_allclose([centroid(frame) for frame in out], expected, atol=0.02)
+
+
+def test_shift_stack_shape_mismatch():
+    with pytest.raises(ValueError):
+        shift_stack(np.zeros((3, 8, 8)), [(0, 0), (1, 1)])